@@ -1,35 +1,21 @@
+import sys
 from common import SimpleTokenizer
 from pathlib import Path
-import json
-from math import log
+from common.IndexReader import load_index, open_segmented
+from common.MetadataStore import MetadataStore
+from common.CommandLine import split_options
+from common.Pipeline import imap_ordered
+from common.VectorScoring import bm25_backend, BACKENDS, HAVE_NUMPY
 
 K1 = 1.2
 B = 0.75
 
+# top k scorer, NumPy when it is installed (see common/VectorScoring.py), pure Python otherwise
+scorer = bm25_backend()
+
 def bm25(query_terms):
-    query_terms = set(query_terms)  # avoid dupes
-    scores = [0] * num_docs
-
-    for term in query_terms:
-        term_id = lexicon.get(term, None)
-        posting = None
-
-        if term_id:
-            posting = inverted_index.get(str(term_id), None)
-        if posting:
-            ni = len(posting) // 2
-            
-            for i in range(0, len(posting), 2):
-                doc_id = posting[i]
-                fi = posting[i + 1]
-                
-                k = K1 * ((1-B) + B * doc_lengths[doc_id]/avg_doc_length)
-                scores[doc_id] += ((fi / (k+fi)) * log((num_docs-ni+0.5)/(ni+0.5)))
-
-    scored_docs = [(doc_id, score) for doc_id, score in enumerate(scores) if score > 0]
-    scored_docs.sort(key=lambda x: x[1], reverse=True)
-    
-    return scored_docs[:1000]
+    # top 1000 for the run file, see common/Scoring.py
+    return scorer(query_terms, lexicon, inverted_index, norms, num_docs, 1000)
 
 def build_output_file(search_results):
     Q0 = 'Q0'
@@ -38,72 +24,120 @@ def build_output_file(search_results):
     output = []
     for topic_id, doc_results in search_results:
         for rank, (doc_id, score) in enumerate(doc_results, 1):
-            docno = get_docno_using_txt(index_path, doc_id)
-            output.append(f"{topic_id} {Q0} {docno.strip()} {rank} {score} {RUNTAG}")
+            docno = metadata_store.docno(doc_id)
+            output.append(f"{topic_id} {Q0} {docno} {rank} {score} {RUNTAG}")
     
     return '\n'.join(output)
 
-def get_docno_using_txt(index_path, doc_id):
-    cnt = 0
-    docno_path = Path(str(index_path) + '/docno.txt')
-    
-    with open(docno_path, 'r') as file:
-        for line in file:
-            if cnt == doc_id:
-                return line
-            cnt += 1
-
-def main():
-    global index_path
-    index_path = Path('/Users/campbellwang/stemmed_index/') # hardcoded path
-    lexicon_path = index_path / 'metadata/lexicon.json'
-    inverted_index_path = index_path / 'metadata/inverted_index.json'
-    doc_lengths_path = index_path / 'doc-lengths.txt'
-    queries_path = Path('queries.txt')
-    
+def load(path, in_memory):
     global lexicon
     global inverted_index
-    global doc_lengths
+    global norms
     global num_docs
-    global avg_doc_length
-
-    print("Loading lexicon...")
-    with open(lexicon_path, 'r') as file:
-        lexicon = json.load(file)
-
-    print("Loading inverted index...")
-    with open(inverted_index_path, 'r') as file:
-        inverted_index = json.load(file)
-
-    total_word_count = 0
-    doc_lengths = []
-    num_docs = 0
-
-    print("Loading doc lengths...")
-    with open(doc_lengths_path, "r") as f:
-        for line in f:
-            words = int(line.strip())
-            total_word_count += words
-            doc_lengths.append(words)
-            num_docs += 1
-    
-    avg_doc_length = total_word_count / num_docs
 
-    search_results = []
-    print("Processing queries...")
+    # fans out over every segment of the index, see common/IndexReader.py
+    lexicon, inverted_index, norms, num_docs, _ = load_index(path, in_memory=in_memory, k1=K1, b=B)
+
+def init_worker(path, backend):
+    # every pool process memory-maps the index instead of decoding its own copy, so the postings
+    # are shared read-only through the page cache
+    global scorer
+    scorer = bm25_backend(backend)
+    load(path, in_memory=False)
+
+def score_query(query):
+    return bm25(SimpleTokenizer.Tokenize(query))
+
+def main():
+    args, options = split_options(sys.argv[1:])
+    if len(args) not in (0, 3):
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Expected an index directory, a queries file and an output file!
+
+                Usage: python src/BM25.py <directory to index> <path to queries file> <path to output file> [--workers <N>] [--backend python|numpy]
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    workers = 1
+    if 'workers' in options:
+        try:
+            workers = int(options['workers'])
+        except ValueError:
+            workers = 0
+        if workers < 1:
+            print(
+                '''
+                # ------------------------------------------------------------------------------------------------
+
+                    Error: --workers expects a positive whole number!
+
+                # ------------------------------------------------------------------------------------------------
+                '''
+            )
+            return -1
+
+    global scorer
+    backend = None
+    if 'backend' in options:
+        if options['backend'] not in BACKENDS:
+            print(
+                '''
+                # ------------------------------------------------------------------------------------------------
+
+                    Error: --backend expects python or numpy!
+
+                    Usage: python src/BM25.py <directory to index> <path to queries file> <path to output file> [--workers <N>] [--backend python|numpy]
+
+                # ------------------------------------------------------------------------------------------------
+                '''
+            )
+            return -1
+        if options['backend'] == 'numpy' and not HAVE_NUMPY:
+            print("NumPy is not installed, scoring in pure Python")
+        backend = options['backend']
+        scorer = bm25_backend(backend)
+
+    if args:
+        index_path, queries_path, output_path = Path(args[0]), Path(args[1]), Path(args[2])
+    else:
+        index_path = Path('/Users/campbellwang/stemmed_index/') # hardcoded path
+        queries_path = Path('queries.txt')
+        output_path = Path('bm25.txt')
+
+    topics = []
+    queries = []
     with open(queries_path, 'r') as f:
         for idx, line in enumerate(f):
             if idx % 2 == 0:
-                curr_topic = line.strip()
+                topics.append(line.strip())
             else:
-                query_terms = [word for word in SimpleTokenizer.Tokenize(line.strip())]
-                results = bm25(query_terms)
-                search_results.append((curr_topic, results))
+                queries.append(line.strip())
+
+    if workers > 1:
+        # small batches so every worker gets a share of even a short queries file
+        scored = imap_ordered(score_query, queries, workers, batch_size=16 * workers, initializer=init_worker, initargs=(index_path, backend))
+    else:
+        load(index_path, in_memory=True)
+        scored = imap_ordered(score_query, queries)
+
+    global metadata_store
+    # id -> docno is a fixed-width slice of metadata/docnos.bin, see common/MetadataStore.py
+    metadata_store = open_segmented(index_path, lambda path: MetadataStore(path / 'metadata'))
+
+    print("Processing queries...")
+    # results come back in queries file order whatever the number of workers
+    search_results = [(topic, results) for topic, (_, results) in zip(topics, scored)]
 
     output_content = build_output_file(search_results)
     
     print(output_content)
-    with open('bm25.txt', 'w') as f:
+    with open(output_path, 'w') as f:
         f.write(output_content)
 
 if __name__ == '__main__':
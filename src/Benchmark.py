@@ -0,0 +1,978 @@
+'''
+Micro-benchmarks for the indexing and query tools.
+
+Usage: python src/Benchmark.py <benchmark> <arguments...>
+'''
+import sys
+import gzip
+import json
+import re
+import time
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from common.PostingsFile import PostingsReader, POSTINGS_FILE, DIRECTORY_FILE
+from common.FieldExtractor import extract_fields
+from common.DocumentFramer import frame_documents
+from common.SimpleTokenizer import Tokenize
+from common.DisplayFields import sanitizer
+
+def bench_postings(index_path):
+    # size and full-decode speed of the JSON postings vs the binary postings
+    metadata_path = Path(index_path) / 'metadata'
+    json_path = metadata_path / 'inverted_index.json'
+
+    start = time.perf_counter()
+    reader = PostingsReader(metadata_path)
+    open_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    num_postings = 0
+    for term_id in range(len(reader)):
+        postings = reader.get(term_id)
+        if postings:
+            num_postings += len(postings) // 2
+    decode_time = time.perf_counter() - start
+
+    binary_size = (metadata_path / POSTINGS_FILE).stat().st_size + (metadata_path / DIRECTORY_FILE).stat().st_size
+    print(f"binary: {binary_size:,} bytes, open {open_time:.3f}s, decode all {decode_time:.3f}s "
+          f"({num_postings / max(decode_time, 1e-9):,.0f} postings/s)")
+
+    if json_path.is_file():
+        start = time.perf_counter()
+        with open(json_path, 'r') as f:
+            json.load(f)
+        json_time = time.perf_counter() - start
+        json_size = json_path.stat().st_size
+        print(f"json:   {json_size:,} bytes, load {json_time:.3f}s")
+        print(f"binary is {binary_size / max(json_size, 1):.1%} of the JSON size")
+
+def bench_indexing(gz_path, max_workers=None):
+    # docs/sec of IndexEngine.read with 1, 2, 4, ... up to max_workers parse/tokenize workers
+    import IndexEngine
+
+    max_workers = int(max_workers) if max_workers else os.cpu_count()
+    worker_counts = []
+    workers = 1
+    while workers < max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(max_workers)
+
+    baseline = None
+    for workers in worker_counts:
+        tmp = tempfile.mkdtemp()
+        try:
+            IndexEngine.destPath = tmp + '/index'
+            IndexEngine.createDirectory(IndexEngine.destPath)
+            start = time.perf_counter()
+            IndexEngine.read(gz_path, IndexEngine.destPath, workers=workers)
+            elapsed = time.perf_counter() - start
+            with open(IndexEngine.destPath + '/docno.txt') as f:
+                num_docs = sum(1 for _ in f)
+        finally:
+            shutil.rmtree(tmp)
+
+        docs_per_sec = num_docs / elapsed
+        baseline = baseline or docs_per_sec
+        print(f"{workers:>3} workers: {docs_per_sec:>10,.0f} docs/s ({docs_per_sec / baseline:.2f}x)")
+
+def rss_bytes():
+    # current resident set size from /proc on Linux, the peak (in bytes on macOS) elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def load_postings_for_memory(kind, metadata_path, json_path, results):
+    # runs in a fresh process, so the peak RSS growth is the loaded index alone
+    before = rss_bytes()
+    start = time.perf_counter()
+    if kind == 'json':
+        with open(json_path, 'r') as f:
+            postings = json.load(f)
+        with open(Path(metadata_path).parent / 'doc-lengths.txt', 'r') as f:
+            doc_lengths = [int(line.strip()) for line in f]
+    else:
+        from array import array
+        from common.PostingsFile import PostingsArrays
+        postings = PostingsArrays(metadata_path)
+        with open(Path(metadata_path).parent / 'doc-lengths.txt', 'r') as f:
+            doc_lengths = array('I', (int(line.strip()) for line in f))
+    results.put((time.perf_counter() - start, rss_bytes() - before))
+
+def bench_memory(index_path):
+    # resident memory and load time of the JSON dict-of-lists index vs the typed-array index
+    import multiprocessing
+
+    metadata_path = Path(index_path) / 'metadata'
+    json_path = metadata_path / 'inverted_index.json'
+    tmp = None
+    if not json_path.is_file():
+        # same layout the old IndexEngine wrote: {"term id": [doc, tf, doc, tf, ...]}
+        tmp = tempfile.mkdtemp()
+        json_path = Path(tmp) / 'inverted_index.json'
+        reader = PostingsReader(metadata_path)
+        with open(json_path, 'w') as f:
+            json.dump({term_id: reader.get(term_id) for term_id in range(len(reader)) if term_id in reader}, f)
+        reader.close()
+
+    try:
+        context = multiprocessing.get_context('spawn')
+        measured = {}
+        for kind in ('json', 'arrays'):
+            results = context.Queue()
+            process = context.Process(target=load_postings_for_memory, args=(kind, str(metadata_path), str(json_path), results))
+            process.start()
+            measured[kind] = results.get()
+            process.join()
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+
+    (json_time, json_rss), (arrays_time, arrays_rss) = measured['json'], measured['arrays']
+    print(f"json dicts:   load {json_time:.3f}s, {json_rss / 1e6:,.1f} MB resident")
+    print(f"typed arrays: load {arrays_time:.3f}s, {arrays_rss / 1e6:,.1f} MB resident ({json_rss / max(arrays_rss, 1):.1f}x smaller)")
+
+def load_lexicon_for_memory(kind, metadata_path, json_path, terms, results):
+    # runs in a fresh process: open time, resident memory and lookup time of every term in terms
+    before = rss_bytes()
+    start = time.perf_counter()
+    if kind == 'json':
+        with open(json_path, 'r') as f:
+            lexicon = json.load(f)
+    else:
+        from common.LexiconFile import LexiconFile
+        lexicon = LexiconFile(metadata_path)
+    open_time = time.perf_counter() - start
+    rss = rss_bytes() - before
+
+    start = time.perf_counter()
+    term_ids = [lexicon.get(term) for term in terms]
+    lookup_time = time.perf_counter() - start
+    results.put((open_time, rss, lookup_time, term_ids))
+
+def bench_lexicon(index_path, num_lookups=10000):
+    # lexicon.json loaded into a dict vs the memory-mapped front-coded lexicon.bin
+    import multiprocessing
+    import random
+    from common.LexiconFile import LEXICON_FILE
+    from common.IndexReader import read_lexicon
+
+    metadata_path = Path(index_path) / 'metadata'
+    lexicon = read_lexicon(metadata_path)
+    json_path = metadata_path / 'lexicon.json'
+    tmp = None
+    if not json_path.is_file():
+        tmp = tempfile.mkdtemp()
+        json_path = Path(tmp) / 'lexicon.json'
+        with open(json_path, 'w') as f:
+            json.dump(lexicon, f)
+
+    # half of the lookups are terms that are not in the lexicon
+    rnd = random.Random(0)
+    vocabulary = list(lexicon)
+    terms = [rnd.choice(vocabulary) + ('' if i % 2 else 'zz') for i in range(int(num_lookups))]
+
+    try:
+        context = multiprocessing.get_context('spawn')
+        measured = {}
+        for kind in ('json', 'mmap'):
+            results = context.Queue()
+            process = context.Process(target=load_lexicon_for_memory, args=(kind, str(metadata_path), str(json_path), terms, results))
+            process.start()
+            measured[kind] = results.get()
+            process.join()
+        json_size = json_path.stat().st_size
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+
+    binary_size = (metadata_path / LEXICON_FILE).stat().st_size
+    same = measured['json'][3] == measured['mmap'][3]
+    print(f"{len(vocabulary):,} terms, {len(terms):,} lookups, term ids {'match' if same else 'DIFFER'}")
+    for kind, name, size in (('json', 'lexicon.json', json_size), ('mmap', LEXICON_FILE, binary_size)):
+        open_time, rss, lookup_time, _ = measured[kind]
+        print(f"{name + ':':14}{size:>12,} bytes, open {open_time * 1000:8.3f} ms, {rss / 1e6:6.1f} MB resident, "
+              f"{lookup_time / len(terms) * 1e6:.2f} us/lookup")
+
+def three_regex_fields(full_text):
+    # the per-field extraction IndexEngine used before common.FieldExtractor, kept as the reference
+    fields = []
+    for field in ('HEADLINE', 'GRAPHIC', 'TEXT'):
+        match = re.findall(f'<{field}>.*?<\\/{field}>', full_text)
+        if match:
+            words = [w for w in match[0].split(' ') if w not in ['<P>', '</P>', f'<{field}>', f'</{field}>']]
+            fields.append(' '.join(words))
+        else:
+            fields.append(None)
+    return fields
+
+def field_tokens(fields):
+    tokens = []
+    for field in fields:
+        if field is not None:
+            tokens.extend(Tokenize(field))
+    return tokens
+
+def bench_extractor(gz_path):
+    # three-regex field extraction vs the single-pass extractor, tests/test_FieldExtractor.py checks they agree
+    documents = [document.decode('utf-8') for _, document in frame_documents(gz_path)]
+    joined = [document.replace('\n', ' ') for document in documents]
+
+    start = time.perf_counter()
+    old_fields = [three_regex_fields(full_text) for full_text in joined]
+    old_extract_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_fields = [extract_fields(document) for document in documents]
+    new_extract_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for fields in old_fields:
+        field_tokens(fields)
+    old_time = old_extract_time + time.perf_counter() - start
+
+    start = time.perf_counter()
+    for fields in new_fields:
+        field_tokens(fields)
+    new_time = new_extract_time + time.perf_counter() - start
+
+    print(f"{len(documents):,} documents")
+    print(f"extraction only:   three regexes {old_extract_time:.3f}s, single pass {new_extract_time:.3f}s ({old_extract_time / new_extract_time:.2f}x)")
+    print(f"with tokenization: three regexes {old_time:.3f}s, single pass {new_time:.3f}s ({old_time / new_time:.2f}x)")
+
+def random_unicode_text(rnd, alphabet):
+    # mostly word characters and separators, with arbitrary code points mixed in
+    return ''.join(
+        rnd.choice(alphabet) if rnd.random() < 0.3 else rnd.choice('abcXYZ019 _.-,\n\t')
+        for _ in range(rnd.randint(0, 60))
+    )
+
+def bench_tokenizer(gz_path, num_cases=100000):
+    # property check of Tokenize against the reference loop on random Unicode text, then throughput
+    from common.SimpleTokenizer import ReferenceTokenize, TokenizeMany
+    import random
+
+    rnd = random.Random(0)
+    alphabet = [chr(c) for c in range(0x110000) if not 0xD800 <= c <= 0xDFFF]
+    for _ in range(int(num_cases)):
+        text = random_unicode_text(rnd, alphabet)
+        if Tokenize(text) != ReferenceTokenize(text):
+            print(f"Tokens differ for {text!r}")
+            return -1
+    # every code point at least once, next to word characters and on its own
+    for i in range(0, len(alphabet), 1000):
+        text = 'a'.join(alphabet[i:i + 1000]) + ' ' + ''.join(alphabet[i:i + 1000])
+        if Tokenize(text) != ReferenceTokenize(text):
+            print(f"Tokens differ for code points {ord(alphabet[i]):#x} to {ord(alphabet[min(i + 999, len(alphabet) - 1)]):#x}")
+            return -1
+    print(f"{int(num_cases):,} random Unicode texts and every code point: identical tokens")
+
+    fields = []
+    for _, document in frame_documents(gz_path):
+        fields.extend(field for field in extract_fields(document.decode('utf-8')) if field is not None)
+    num_chars = sum(len(field) for field in fields)
+
+    start = time.perf_counter()
+    reference = [ReferenceTokenize(field) for field in fields]
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tokens = [Tokenize(field) for field in fields]
+    tokenize_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = TokenizeMany(fields)
+    batch_time = time.perf_counter() - start
+
+    print(f"{len(fields):,} fields, {num_chars / 1e6:,.1f}M characters, tokens {'match' if reference == tokens == batch else 'DIFFER'}")
+    print(f"reference:    {reference_time:.3f}s ({num_chars / reference_time / 1e6:,.1f}M chars/s)")
+    print(f"Tokenize:     {tokenize_time:.3f}s ({num_chars / tokenize_time / 1e6:,.1f}M chars/s, {reference_time / tokenize_time:.1f}x)")
+    print(f"TokenizeMany: {batch_time:.3f}s ({num_chars / batch_time / 1e6:,.1f}M chars/s, {reference_time / batch_time:.1f}x)")
+
+def line_framed_documents(gz_path):
+    # the text-mode, line-by-line framing IndexEngine used before common.DocumentFramer
+    content = []
+    docno = ''
+    with gzip.open(gz_path, 'rt') as f:
+        for line in f:
+            l = line.strip()
+            content.append(l)
+            if '<DOCNO>' in l and '</DOCNO>' in l:
+                docno = l.split(' ')[1]
+            if l == '</DOC>':
+                yield docno, '\n'.join(content), ' '.join(content)
+                content.clear()
+
+def bench_framer(gz_path):
+    # line-by-line text framing vs byte-level chunked framing over the whole archive
+    start = time.perf_counter()
+    old_docnos = [docno for docno, _, _ in line_framed_documents(gz_path)]
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_docnos = []
+    num_bytes = 0
+    for docno, document in frame_documents(gz_path):
+        new_docnos.append(docno)
+        num_bytes += len(document)
+    new_time = time.perf_counter() - start
+
+    print(f"{len(new_docnos):,} documents, docnos {'match' if old_docnos == new_docnos else 'DIFFER'}")
+    print(f"line framing: {old_time:.3f}s ({len(old_docnos) / old_time:,.0f} docs/s)")
+    print(f"byte framing: {new_time:.3f}s ({len(new_docnos) / new_time:,.0f} docs/s, "
+          f"{num_bytes / new_time / 1e6:,.1f} MB/s, {old_time / new_time:.2f}x)")
+
+def bench_stemming(gz_path):
+    # Porter stemming per token occurrence vs the stem cache, cold and warm
+    from nltk.stem import PorterStemmer
+    from common.StemCache import StemCache, hit_rate
+
+    ps = PorterStemmer()
+    documents = [field_tokens(extract_fields(document.decode('utf-8'))) for _, document in frame_documents(gz_path)]
+    num_tokens = sum(len(tokens) for tokens in documents)
+
+    start = time.perf_counter()
+    uncached = [[ps.stem(token) for token in tokens] for tokens in documents]
+    uncached_time = time.perf_counter() - start
+
+    stem_cache = StemCache(ps.stem)
+    start = time.perf_counter()
+    cold = [stem_cache.stem_tokens(tokens) for tokens in documents]
+    cold_time = time.perf_counter() - start
+    cold_hits, cold_misses = stem_cache.hits, stem_cache.misses
+
+    stem_cache = StemCache(ps.stem, stem_cache.stems)
+    start = time.perf_counter()
+    warm = [stem_cache.stem_tokens(tokens) for tokens in documents]
+    warm_time = time.perf_counter() - start
+
+    print(f"{len(documents):,} documents, {num_tokens:,} tokens, {len(stem_cache):,} surface forms, stems {'match' if uncached == cold == warm else 'DIFFER'}")
+    print(f"uncached:   {uncached_time:.3f}s ({num_tokens / uncached_time:,.0f} tokens/s)")
+    print(f"cold cache: {cold_time:.3f}s ({uncached_time / cold_time:.1f}x, {hit_rate(cold_hits, cold_misses):.1%} hit rate)")
+    print(f"warm cache: {warm_time:.3f}s ({uncached_time / warm_time:.1f}x, {hit_rate(stem_cache.hits, stem_cache.misses):.1%} hit rate)")
+
+def read_queries(queries_path):
+    # queries file: topic id and query text on alternating lines
+    queries = []
+    with open(queries_path, 'r') as f:
+        for idx, line in enumerate(f):
+            if idx % 2 == 0:
+                topic_id = line.strip()
+            else:
+                queries.append((topic_id, line.strip()))
+    return queries
+
+def render_from_raw_document(doc_id, document_store, metadata_store):
+    # how SearchEngine rendered a result before display fields were stored at index time
+    headline, graphic, text = extract_fields(document_store.get(doc_id).decode('utf-8'))
+    headline = sanitizer('NULL' if headline is None else headline)
+    body = sanitizer(' '.join(field for field in (text, graphic) if field is not None))
+    docno = metadata_store.docno(doc_id)
+    year, month, day = docno[6:8], docno[2:4], docno[4:6]
+    date = datetime.strptime(f'19{year}{month}{day}', '%Y%m%d').strftime('%B %d, %Y')
+    return headline, body, date, docno
+
+def bench_render(index_path, queries_path):
+    # per-query time to render the top 10 results, re-extracting from raw documents vs stored display fields
+    import SearchEngine
+
+    index_path = Path(index_path)
+    lexicon, inverted_index, norms, num_docs, _ = SearchEngine.load_index_data(index_path)
+    document_store, display_store, metadata_store = SearchEngine.open_document_stores(index_path)
+
+    old_time, new_time, num_queries = 0, 0, 0
+    for _, query in read_queries(queries_path):
+        results = SearchEngine.bm25_search(Tokenize(query), lexicon, inverted_index, norms, num_docs)
+
+        start = time.perf_counter()
+        old = [render_from_raw_document(doc_id, document_store, metadata_store) for doc_id, _ in results]
+        old_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = [SearchEngine.get_document_content(doc_id, display_store, metadata_store) for doc_id, _ in results]
+        new_time += time.perf_counter() - start
+
+        if old != new:
+            print(f"Rendered results differ for query: {query}")
+        num_queries += 1
+
+    print(f"{num_queries} queries, top 10 results each")
+    print(f"from raw documents: {old_time / num_queries * 1000:.3f} ms/query")
+    print(f"display fields:     {new_time / num_queries * 1000:.3f} ms/query ({old_time / new_time:.1f}x)")
+
+def bm25_recomputed(query_terms, lexicon, inverted_index, doc_lengths, num_docs, avg_doc_length):
+    # SearchEngine.bm25_search before the collection stats: length norm and IDF per posting
+    from math import log
+    from SearchEngine import K1, B
+
+    scores = [0] * len(doc_lengths)
+    for term in set(query_terms):
+        term_id = lexicon.get(term)
+        posting = None if term_id is None else inverted_index.postings(term_id)
+        if posting:
+            doc_ids, tfs = posting
+            ni = len(doc_ids)
+            for doc_id, fi in zip(doc_ids, tfs):
+                k = K1 * ((1-B) + B * doc_lengths[doc_id]/avg_doc_length)
+                scores[doc_id] += ((fi / (k+fi)) * log((num_docs-ni+0.5)/(ni+0.5)))
+
+    scored_docs = [(doc_id, score) for doc_id, score in enumerate(scores) if score > 0]
+    scored_docs.sort(key=lambda x: x[1], reverse=True)
+    return scored_docs[:10]
+
+def bench_bm25(index_path, queries_path):
+    # collection statistics from doc-lengths.txt vs the stats files, then per-query BM25 latency
+    # with the length norm and IDF recomputed per posting vs precomputed
+    import SearchEngine
+    from common.Segments import read_manifest
+    from common.CollectionStats import compute_collection_stats, load_collection_stats
+
+    index_path = Path(index_path)
+    lexicon, inverted_index, norms, num_docs, _ = SearchEngine.load_index_data(index_path)
+    manifest = read_manifest(index_path)
+
+    start = time.perf_counter()
+    doc_lengths, _, total_length = compute_collection_stats(index_path, manifest)
+    parse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    load_collection_stats(index_path, manifest, SearchEngine.K1, SearchEngine.B)
+    stats_time = time.perf_counter() - start
+
+    queries = [Tokenize(query) for _, query in read_queries(queries_path)]
+    old_time, new_time, num_different = 0, 0, 0
+    for query_terms in queries:
+        start = time.perf_counter()
+        old = bm25_recomputed(query_terms, lexicon, inverted_index, doc_lengths, num_docs, total_length / num_docs)
+        old_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = SearchEngine.bm25_search(query_terms, lexicon, inverted_index, norms, num_docs)
+        new_time += time.perf_counter() - start
+        num_different += old != new
+
+    print(f"{len(queries)} queries, {num_different} with different results")
+    print(f"collection stats: doc-lengths.txt {parse_time * 1000:.1f} ms, stats files {stats_time * 1000:.1f} ms")
+    print(f"recomputed per posting: {old_time / len(queries) * 1000:.3f} ms/query")
+    print(f"precomputed:            {new_time / len(queries) * 1000:.3f} ms/query ({old_time / new_time:.2f}x)")
+
+def bm25_dense(query_terms, lexicon, inverted_index, norms, num_docs, k):
+    # scoring before common.Scoring: a score slot per internal id and a full sort of every match
+    from common.CollectionStats import bm25_idf
+
+    scores = [0] * len(norms)
+    for term in set(query_terms):
+        entry = lexicon.lookup(term)
+        posting = None if entry is None else inverted_index.postings(entry[0])
+        if posting:
+            doc_ids, tfs = posting
+            idf = bm25_idf(num_docs, len(doc_ids)) if entry[1] is None else entry[1]
+            for doc_id, fi in zip(doc_ids, tfs):
+                scores[doc_id] += fi / (norms[doc_id] + fi) * idf
+
+    scored_docs = [(doc_id, score) for doc_id, score in enumerate(scores) if score > 0]
+    scored_docs.sort(key=lambda x: x[1], reverse=True)
+    return scored_docs[:k]
+
+def bench_topk(index_path, queries_path):
+    # dense score array and full sort vs sparse accumulators and heap selection, for k = 10 and 1000
+    import SearchEngine
+    from common.Scoring import bm25_top_k
+
+    lexicon, inverted_index, norms, num_docs, _ = SearchEngine.load_index_data(Path(index_path))
+    queries = [Tokenize(query) for _, query in read_queries(queries_path)]
+    num_postings = sum(
+        inverted_index.df(lexicon[term]) for query_terms in queries for term in set(query_terms) if term in lexicon
+    )
+    print(f"{len(queries)} queries, {len(norms):,} documents, {num_postings / len(queries):,.0f} postings/query")
+
+    for k in (10, 1000):
+        dense_time, sparse_time, num_different = 0, 0, 0
+        for query_terms in queries:
+            start = time.perf_counter()
+            dense = bm25_dense(query_terms, lexicon, inverted_index, norms, num_docs, k)
+            dense_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            sparse = bm25_top_k(query_terms, lexicon, inverted_index, norms, num_docs, k)
+            sparse_time += time.perf_counter() - start
+            num_different += dense != sparse
+
+        print(f"k={k}: dense + sort {dense_time / len(queries) * 1000:.3f} ms/query, "
+              f"sparse + heap {sparse_time / len(queries) * 1000:.3f} ms/query "
+              f"({dense_time / sparse_time:.2f}x), {num_different} queries with different results")
+
+def bench_pruning(index_path, queries_path):
+    # exhaustive scoring vs block-max pruning: postings scored and latency, for k = 10 and 1000
+    import SearchEngine
+    from common.Scoring import bm25_top_k, block_max_top_k
+
+    lexicon, inverted_index, norms, num_docs, _ = SearchEngine.load_index_data(Path(index_path))
+    queries = [Tokenize(query) for _, query in read_queries(queries_path)]
+    num_postings = sum(
+        inverted_index.df(lexicon[term]) for query_terms in queries for term in set(query_terms) if term in lexicon
+    )
+    print(f"{len(queries)} queries, {len(norms):,} documents, {num_postings / len(queries):,.0f} postings/query")
+
+    for k in (10, 1000):
+        exhaustive_time, pruned_time, num_different = 0, 0, 0
+        stats = {'postings': 0}
+        for query_terms in queries:
+            start = time.perf_counter()
+            exhaustive = bm25_top_k(query_terms, lexicon, inverted_index, norms, num_docs, k)
+            exhaustive_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            pruned = block_max_top_k(query_terms, lexicon, inverted_index, norms, num_docs, k, stats)
+            pruned_time += time.perf_counter() - start
+            num_different += exhaustive != pruned
+
+        print(f"k={k}: exhaustive {num_postings / len(queries):,.0f} postings, {exhaustive_time / len(queries) * 1000:.3f} ms/query; "
+              f"block-max {stats['postings'] / len(queries):,.0f} postings ({stats['postings'] / max(num_postings, 1):.1%}), "
+              f"{pruned_time / len(queries) * 1000:.3f} ms/query ({exhaustive_time / pruned_time:.2f}x), "
+              f"{num_different} queries with different results")
+
+def bench_numpy(index_path, queries_path):
+    # pure-Python vs NumPy scoring of the top 1000, per query, in memory and memory-mapped
+    from common.IndexReader import load_index
+    from common.Scoring import bm25_top_k
+    from common.VectorScoring import numpy_bm25_top_k, HAVE_NUMPY
+
+    if not HAVE_NUMPY:
+        print("NumPy is not installed")
+        return -1
+
+    queries = read_queries(queries_path)
+    for in_memory in (True, False):
+        lexicon, inverted_index, norms, num_docs, _ = load_index(Path(index_path), in_memory=in_memory)
+        print(f"{'in memory' if in_memory else 'memory-mapped'}:")
+        python_total, numpy_total, num_different, max_difference = 0, 0, 0, 0
+        for topic, query in queries:
+            query_terms = Tokenize(query)
+            start = time.perf_counter()
+            expected = bm25_top_k(query_terms, lexicon, inverted_index, norms, num_docs, 1000)
+            python_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = numpy_bm25_top_k(query_terms, lexicon, inverted_index, norms, num_docs, 1000)
+            numpy_time = time.perf_counter() - start
+
+            python_total += python_time
+            numpy_total += numpy_time
+            if [doc_id for doc_id, _ in expected] != [doc_id for doc_id, _ in results]:
+                num_different += 1
+            else:
+                max_difference = max([max_difference] + [abs(a - b) for (_, a), (_, b) in zip(expected, results)])
+            print(f"    {topic:>6} python {python_time * 1000:8.2f} ms  numpy {numpy_time * 1000:8.2f} ms ({python_time / numpy_time:.1f}x)")
+
+        print(f"    total: python {python_total / len(queries) * 1000:.2f} ms/query, numpy {numpy_total / len(queries) * 1000:.2f} ms/query "
+              f"({python_total / numpy_total:.1f}x), {num_different} rankings different, largest score difference {max_difference}")
+        inverted_index.close()
+
+def bench_batch(index_path, queries_path, max_workers=None):
+    # queries/sec of the BM25 batch mode with 1, 2, 4, ... up to max_workers processes, scoring only
+    import BM25
+    from common.Pipeline import imap_ordered
+
+    max_workers = int(max_workers) if max_workers else os.cpu_count()
+    worker_counts = []
+    workers = 1
+    while workers < max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(max_workers)
+
+    queries = [query for _, query in read_queries(queries_path)]
+    baseline = None
+    expected = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        if workers > 1:
+            results = [results for _, results in imap_ordered(
+                BM25.score_query, queries, workers, batch_size=16 * workers,
+                initializer=BM25.init_worker, initargs=(Path(index_path), None))]
+        else:
+            # the same memory-mapped index the workers open
+            BM25.init_worker(Path(index_path), None)
+            results = [BM25.score_query(query) for query in queries]
+            BM25.inverted_index.close()
+        elapsed = time.perf_counter() - start
+
+        expected = expected or results
+        queries_per_sec = len(queries) / elapsed
+        baseline = baseline or queries_per_sec
+        print(f"{workers:>3} workers: {queries_per_sec:>8,.1f} queries/s ({queries_per_sec / baseline:.2f}x)"
+              f"{'' if results == expected else ', results different'}")
+
+def docno_from_txt(index_path, doc_id):
+    # BM25.py and BooleanAND.py before the docno table: docno.txt scanned for every result
+    with open(Path(index_path) / 'docno.txt', 'r') as f:
+        for cnt, line in enumerate(f):
+            if cnt == doc_id:
+                return line.strip()
+
+def docno_map_from_txt(index_path):
+    # GetDoc.py before the docno index: all of docno.txt loaded for every lookup
+    doc_to_id = {}
+    with open(Path(index_path) / 'docno.txt', 'r', encoding='utf-8') as f:
+        for internal_id, docno in enumerate(f):
+            doc_to_id[docno.strip()] = internal_id
+    return doc_to_id
+
+def bench_docnos(index_path, queries_path, max_scanned=1000):
+    # time to write the BM25 run file (top 1000 per topic) with docno.txt scans vs docnos.bin,
+    # and a GetDoc docno lookup with docno.txt loaded into a dict vs docno-index.bin
+    import BM25
+    from common.IndexReader import load_index, open_segmented
+    from common.MetadataStore import MetadataStore
+
+    index_path = Path(index_path)
+    lexicon, inverted_index, norms, num_docs, _ = load_index(index_path)
+    metadata_store = open_segmented(index_path, lambda path: MetadataStore(path / 'metadata'))
+    results = []
+    for _, query in read_queries(queries_path):
+        results.extend(doc_id for doc_id, _ in BM25.scorer(Tokenize(query), lexicon, inverted_index, norms, num_docs, 1000))
+
+    # the scans take long enough that only the first max_scanned results are timed
+    scanned = results[:int(max_scanned)]
+    start = time.perf_counter()
+    old = [docno_from_txt(index_path, doc_id) for doc_id in scanned]
+    old_time = (time.perf_counter() - start) / len(scanned)
+
+    start = time.perf_counter()
+    new = [metadata_store.docno(doc_id) for doc_id in results]
+    new_time = (time.perf_counter() - start) / len(results)
+
+    print(f"{len(results):,} results")
+    print(f"docno.txt scan: {old_time * 1e6:,.1f} us/result, {old_time * len(results):,.2f}s for the run file (timed over {len(scanned):,})")
+    print(f"docnos.bin:     {new_time * 1e6:,.1f} us/result, {new_time * len(results):,.4f}s for the run file "
+          f"({old_time / new_time:,.0f}x){'' if old == new[:len(old)] else ', docnos DIFFER'}")
+
+    docnos = sorted(set(new))
+    start = time.perf_counter()
+    doc_to_id = docno_map_from_txt(index_path)
+    old_time = time.perf_counter() - start
+    old = [doc_to_id[docno] for docno in docnos]
+
+    start = time.perf_counter()
+    new = [metadata_store.doc_id(docno) for docno in docnos]
+    new_time = (time.perf_counter() - start) / len(docnos)
+
+    print(f"docno -> id, {len(docnos):,} docnos")
+    print(f"docno.txt dict: {old_time * 1000:,.2f} ms to build per lookup")
+    print(f"docno-index.bin: {new_time * 1e6:,.1f} us/lookup ({old_time / new_time:,.0f}x)"
+          f"{'' if old == new else ', ids DIFFER'}")
+
+def bench_cache(index_path, queries_path, pages=3):
+    # SearchEngine sessions: every query, then the same terms reordered, paging through the first
+    # pages of both; scored from scratch every time vs through the result cache
+    import SearchEngine
+    from common.ResultCache import ResultCache
+
+    index_path = Path(index_path)
+    lexicon, inverted_index, norms, num_docs, _ = SearchEngine.load_index_data(index_path)
+    requests = []
+    for _, query in read_queries(queries_path):
+        query_terms = Tokenize(query)
+        for terms in (query_terms, query_terms[::-1]):
+            requests.extend((terms, page) for page in range(int(pages)))
+
+    start = time.perf_counter()
+    for terms, page in requests:
+        results = SearchEngine.bm25_search(terms, lexicon, inverted_index, norms, num_docs, k=(page + 1) * SearchEngine.PAGE_SIZE)
+    uncached_time = time.perf_counter() - start
+
+    cache = ResultCache()
+    start = time.perf_counter()
+    for terms, page in requests:
+        results = SearchEngine.cached_search(terms, cache, (page + 1) * SearchEngine.PAGE_SIZE, lexicon, inverted_index, norms, num_docs)
+    cached_time = time.perf_counter() - start
+
+    print(f"{len(requests)} page requests, {pages} pages per query")
+    print(f"no cache:     {uncached_time / len(requests) * 1000:.3f} ms/request")
+    print(f"result cache: {cached_time / len(requests) * 1000:.3f} ms/request ({uncached_time / cached_time:.1f}x), "
+          f"{cache.hits} hits, {cache.misses} misses ({cache.hit_rate():.0%}), {len(cache)} entries, {cache.size:,} bytes")
+
+def snippet_from_characters(text, query_terms):
+    # SearchEngine.create_snippet before the sentence offsets: sentences built a character at a time
+    import heapq
+
+    originals = []
+    curr_sentence = ""
+    for char in text:
+        curr_sentence += char
+        if char in '.!?':
+            originals.append(curr_sentence.strip())
+            curr_sentence = ""
+    if curr_sentence.strip():
+        originals.append(curr_sentence.strip())
+
+    sentences = [s.strip() for s in originals if s.strip()]
+    distinct_query_terms = set(query_terms)
+    max_heap = []
+    for i, sentence in enumerate(sentences):
+        l, c, d, k = 0, 0, 0, 0
+        tokenized_sentence = Tokenize(re.sub(r'[.!?]$', '', sentence))
+        if len(tokenized_sentence) < 5:
+            continue
+        if i == 0:
+            l = 2
+        elif i == 1:
+            l = 1
+
+        curr_run = 0
+        max_run = 0
+        for token in tokenized_sentence:
+            if token in query_terms:
+                curr_run += 1
+                c += 1
+            else:
+                max_run = max(max_run, curr_run)
+                curr_run = 0
+        k = max(max_run, curr_run)
+        for distinct_term in distinct_query_terms:
+            if distinct_term in tokenized_sentence:
+                d += 1
+        max_heap.append((-(l+2*c+4*d+3*k), sentence))
+
+    heapq.heapify(max_heap)
+    if len(max_heap) >= 2:
+        summary = []
+        for _ in range(2):
+            _, sentence, = heapq.heappop(max_heap)
+            if sentence.count('"') % 2 != 0:
+                sentence = sentence.replace('"', '')
+            if sentence.count("'") % 2 != 0:
+                sentence = sentence.replace("'", '')
+            summary.append(sentence)
+        return ' '.join(summary)
+    elif len(max_heap) == 1:
+        return heapq.heappop(max_heap)[1]
+    return " "
+
+def bench_snippets(index_path, queries_path):
+    # per-result snippet time: character loop vs sentences found at query time vs index-time offsets
+    import SearchEngine
+    from common.Snippets import make_snippet, parse_sentence_record
+
+    index_path = Path(index_path)
+    lexicon, inverted_index, norms, num_docs, _ = SearchEngine.load_index_data(index_path)
+    _, display_store, metadata_store = SearchEngine.open_document_stores(index_path)
+    sentence_store = SearchEngine.open_sentence_store(index_path)
+    if sentence_store is None:
+        print("Index has no sentence offsets, run ConvertIndex.py first")
+        return -1
+
+    results = []
+    for _, query in read_queries(queries_path):
+        query_terms = Tokenize(query)
+        for doc_id, _ in SearchEngine.bm25_search(query_terms, lexicon, inverted_index, norms, num_docs):
+            _, text, _, _ = SearchEngine.get_document_content(doc_id, display_store, metadata_store)
+            results.append((doc_id, text, query_terms))
+
+    start = time.perf_counter()
+    old = [snippet_from_characters(text, query_terms) for _, text, query_terms in results]
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    computed = [make_snippet(text, query_terms)[0] for _, text, query_terms in results]
+    computed_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stored = [make_snippet(text, query_terms, parse_sentence_record(sentence_store.get(doc_id)))[0] for doc_id, text, query_terms in results]
+    stored_time = time.perf_counter() - start
+
+    num_different = sum(a != b or a != c for a, b, c in zip(old, computed, stored))
+    print(f"{len(results)} results, {sum(len(text) for _, text, _ in results) / len(results):,.0f} characters on average, {num_different} snippets different")
+    print(f"character loop:     {old_time / len(results) * 1e6:,.1f} us/result")
+    print(f"query-time offsets: {computed_time / len(results) * 1e6:,.1f} us/result ({old_time / computed_time:.1f}x)")
+    print(f"index-time offsets: {stored_time / len(results) * 1e6:,.1f} us/result ({old_time / stored_time:.1f}x)")
+
+def percentile(values, q):
+    # nearest-rank percentile, q between 0 and 1
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def start_service(index_path, *options, workers=0):
+    # SearchService.py in a subprocess on a free port, (process, port) once it and its workers
+    # are serving
+    import subprocess
+    import threading
+
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).parent / 'SearchService.py'), str(index_path), '--port', '0', *options],
+        stdout=subprocess.PIPE, text=True)
+    port = None
+    for line in process.stdout:
+        match = re.search(r'http://[^/]+:(\d+)/', line)
+        if match:
+            port = int(match.group(1))
+        # unbuffered workers can print into the middle of each other's lines
+        workers -= len(re.findall(r'Worker \d+ ready', line))
+        if port is not None and workers <= 0:
+            # keeps reading what it prints, so a full pipe never blocks it
+            threading.Thread(target=process.stdout.read, daemon=True).start()
+            return process, port
+    raise RuntimeError('SearchService exited before serving')
+
+async def http_get(reader, writer, target):
+    # (status, body) of a GET on a keep-alive connection
+    import asyncio
+
+    writer.write(f'GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode('latin-1'))
+    status_line = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return int(status_line.split()[1]), await reader.readexactly(length)
+
+async def load_test(port, targets, clients):
+    # (latencies, failed requests, seconds) of clients keep-alive connections taking the next target
+    import asyncio
+
+    latencies = []
+    failed = 0
+    targets = iter(targets)
+
+    async def client():
+        nonlocal failed
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for target in targets:
+            start = time.perf_counter()
+            status, _ = await http_get(reader, writer, target)
+            latencies.append(time.perf_counter() - start)
+            failed += status != 200
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, failed, time.perf_counter() - start
+
+def bench_service(index_path, queries_path, max_clients=64, threads=None, min_requests=500):
+    # throughput and latency of SearchService under 1, 4, 16, ... up to max_clients concurrent
+    # clients sending /search requests, with the result cache off and on
+    import asyncio
+    from urllib.parse import quote_plus
+
+    queries = [query for _, query in read_queries(queries_path)]
+    rounds = -(-int(min_requests) // len(queries))
+    targets = [f'/search?q={quote_plus(query)}' for query in queries] * rounds
+
+    client_counts = []
+    clients = 1
+    while clients < int(max_clients):
+        client_counts.append(clients)
+        clients *= 4
+    client_counts.append(int(max_clients))
+
+    options = ['--threads', str(threads)] if threads else []
+    for name, cache_options in (('no cache', ['--cache-entries', '0']), ('result cache', [])):
+        process, port = start_service(index_path, *options, *cache_options)
+        try:
+            print(f"{name}, {len(targets)} requests:")
+            for clients in client_counts:
+                latencies, failed, elapsed = asyncio.run(load_test(port, targets, clients))
+                print(f"  {clients:>3} clients: {len(latencies) / elapsed:>8,.1f} requests/s, "
+                      f"p50 {percentile(latencies, 0.5) * 1000:>7.2f} ms, p99 {percentile(latencies, 0.99) * 1000:>7.2f} ms"
+                      f"{f', {failed} failed' if failed else ''}")
+        finally:
+            process.terminate()
+            process.wait()
+
+def process_memory(pid):
+    # (RSS, PSS) of a process in bytes, Linux only. PSS splits every shared page between the
+    # processes mapping it, so it adds up across processes where RSS counts shared pages every time
+    rss = pss = 0
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Rss:'):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith('Pss:'):
+                pss = int(line.split()[1]) * 1024
+    return rss, pss
+
+def process_tree(pid):
+    # pid and the pids of its children
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [pid] + [int(child) for child in f.read().split()]
+
+def bench_prefork(index_path, queries_path, max_workers=8, clients=64, min_requests=500):
+    # SearchService with every postings list decoded in one process vs 1, 2, 4, ... up to
+    # max_workers pre-forked workers sharing the memory-mapped index: total memory of the process
+    # tree after a load test, and throughput without the result cache
+    import asyncio
+    from urllib.parse import quote_plus
+
+    queries = [query for _, query in read_queries(queries_path)]
+    rounds = -(-int(min_requests) // len(queries))
+    targets = [f'/search?q={quote_plus(query)}' for query in queries] * rounds
+
+    configurations = [('in-memory', [])]
+    workers = 1
+    while workers < int(max_workers):
+        configurations.append((f'{workers} workers', ['--workers', str(workers)]))
+        workers *= 2
+    configurations.append((f'{max_workers} workers', ['--workers', str(max_workers)]))
+
+    baseline = None
+    print(f"{len(targets)} requests, {clients} clients, result cache off")
+    for name, options in configurations:
+        process, port = start_service(index_path, '--cache-entries', '0', *options, workers=int(options[1]) if options else 0)
+        try:
+            latencies, failed, elapsed = asyncio.run(load_test(port, targets, int(clients)))
+            memory = [process_memory(pid) for pid in process_tree(process.pid)]
+        finally:
+            process.terminate()
+            process.wait()
+
+        requests_per_sec = len(latencies) / elapsed
+        baseline = baseline or requests_per_sec
+        print(f"{name:>12}: RSS {sum(rss for rss, _ in memory) / 2**20:>7.1f} MB, PSS {sum(pss for _, pss in memory) / 2**20:>7.1f} MB, "
+              f"{requests_per_sec:>7,.1f} requests/s ({requests_per_sec / baseline:.2f}x), p99 {percentile(latencies, 0.99) * 1000:.1f} ms"
+              f"{f', {failed} failed' if failed else ''}")
+
+BENCHMARKS = {
+    'postings': (bench_postings, '<directory to index>'),
+    'memory': (bench_memory, '<directory to index>'),
+    'lexicon': (bench_lexicon, '<directory to index> [lookups]'),
+    'indexing': (bench_indexing, '<path to latimes gz file> [max workers]'),
+    'extractor': (bench_extractor, '<path to latimes gz file>'),
+    'framer': (bench_framer, '<path to latimes gz file>'),
+    'tokenizer': (bench_tokenizer, '<path to latimes gz file> [random cases]'),
+    'stemming': (bench_stemming, '<path to latimes gz file>'),
+    'render': (bench_render, '<directory to index> <path to queries file>'),
+    'bm25': (bench_bm25, '<directory to index> <path to queries file>'),
+    'topk': (bench_topk, '<directory to index> <path to queries file>'),
+    'pruning': (bench_pruning, '<directory to index> <path to queries file>'),
+    'numpy': (bench_numpy, '<directory to index> <path to queries file>'),
+    'batch': (bench_batch, '<directory to index> <path to queries file> [max workers]'),
+    'docnos': (bench_docnos, '<directory to index> <path to queries file> [results scanned]'),
+    'cache': (bench_cache, '<directory to index> <path to queries file> [pages]'),
+    'snippets': (bench_snippets, '<directory to index> <path to queries file>'),
+    'service': (bench_service, '<directory to index> <path to queries file> [max clients] [threads]'),
+    'prefork': (bench_prefork, '<directory to index> <path to queries file> [max workers] [clients]'),
+}
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print('Usage: python src/Benchmark.py <benchmark> <arguments...>')
+        for name, (_, usage) in BENCHMARKS.items():
+            print(f'    {name} {usage}')
+        return -1
+
+    bench, _ = BENCHMARKS[sys.argv[1]]
+    bench(*sys.argv[2:])
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 import sys
-import json
 from pathlib import Path
 from common.SimpleTokenizer import Tokenize
 import common.ErrorMessages
+from common.IndexReader import load_index, open_segmented
+from common.MetadataStore import MetadataStore
 
 def build_output_file(search_results):
     Q0 = 'Q0'
@@ -52,9 +53,9 @@ def build_sorted_query_terms(query):
         postings_length = 0
         term_id = -1
         try:
-            term_id = str(lexicon[term])
-            posting = inverted_index[term_id]
-            postings_length = len(posting)
+            term_id = lexicon[term]
+            # the directory already knows the document frequency, no need to decode the postings
+            postings_length = 2 * inverted_index.df(term_id)
             query_terms_ordered.append((postings_length, term_id))
         except KeyError:
             query_terms_ordered.append((postings_length, term_id))
@@ -62,49 +63,34 @@ def build_sorted_query_terms(query):
     query_terms_ordered.sort()
     return topic_id, query_terms_ordered
 
-def get_docno_using_txt(index_path, doc_id):
-    cnt = 0
-    docno_path = Path(str(index_path) + '/docno.txt')
-
-    if not docno_path.is_file():
-        raise FileNotFoundError(common.ErrorMessages.docno_file_not_found())
-    
-    with open(docno_path, 'r') as file:
-        for l in file:
-            line = l.strip()
-            if cnt == doc_id:
-                return line
-            cnt += 1
-
 def boolean_and_search(query_terms):
     result_set = []
     
-    try:
-        postings = inverted_index[query_terms[0][1]]
-    except KeyError:
+    postings = inverted_index.postings(query_terms[0][1])
+    if postings is None:
         return result_set
 
-    for i in range(0, len(postings), 2):
-        result_set.append(postings[i])
+    result_set = list(postings[0])
     
     for t in range(1, len(query_terms)):
-        try:
-            postings = inverted_index[query_terms[t][1]]
-            new_results = []
-            j,k = 0,0
-            while j < len(result_set) and k < len(postings):
-                if result_set[j] == postings[k]:
-                    new_results.append(result_set[j])
-                    j += 1
-                    k += 2
-                elif result_set[j] < postings[k]:
-                    j += 1
-                else:
-                    k += 2
-            result_set = new_results
-        except KeyError:
+        postings = inverted_index.postings(query_terms[t][1])
+        if postings is None:
             return []
 
+        doc_ids = postings[0]
+        new_results = []
+        j,k = 0,0
+        while j < len(result_set) and k < len(doc_ids):
+            if result_set[j] == doc_ids[k]:
+                new_results.append(result_set[j])
+                j += 1
+                k += 1
+            elif result_set[j] < doc_ids[k]:
+                j += 1
+            else:
+                k += 1
+        result_set = new_results
+
     return result_set
 
 def main():
@@ -115,27 +101,18 @@ def main():
     queries_path = sys.argv[2]
     output_path = sys.argv[3]
 
-    lexicon_path = Path(index_path + '/metadata/lexicon.json')
-    inverted_index_path = Path(index_path + '/metadata/inverted_index.json')
     index_path = Path(index_path)
 
     if not index_path.is_dir():
         raise FileNotFoundError(common.ErrorMessages.index_directory_not_found())
-    elif not lexicon_path.is_file():
-        raise FileNotFoundError(common.ErrorMessages.metadata_file_not_found_at_path('Lexicon'))
-    elif not inverted_index_path.is_file():
-        raise FileNotFoundError(common.ErrorMessages.metadata_file_not_found_at_path('Inverted index'))
         
     global lexicon
     global inverted_index
 
-    print("Loading lexicon...")
-    with open(lexicon_path, 'r') as file:
-        lexicon = json.load(file)
-
-    print("Loading inverted index...")
-    with open(inverted_index_path, 'r') as file:
-        inverted_index = json.load(file)
+    # fans out over every segment of the index, see common/IndexReader.py
+    lexicon, inverted_index, _, _, _ = load_index(index_path, in_memory=True)
+    # id -> docno is a fixed-width slice of metadata/docnos.bin, see common/MetadataStore.py
+    metadata_store = open_segmented(index_path, lambda path: MetadataStore(path / 'metadata'))
 
     queries_path = Path(queries_path)
     if not queries_path.is_file():
@@ -151,7 +128,7 @@ def main():
         res = boolean_and_search(query_terms)
         docnos = []
         for doc in res:
-            docnos.append(get_docno_using_txt(index_path, doc))
+            docnos.append(metadata_store.docno(doc))
 
         search_results.append((topic_id, res, docnos))
 
@@ -0,0 +1,189 @@
+import sys
+import json
+from pathlib import Path
+import common.ErrorMessages
+from array import array
+from common.PostingsFile import write_postings, write_postings_blocks, POSTINGS_FILE, DIRECTORY_FILE, BLOCKS_FILE
+from common.LexiconFile import write_lexicon, LEXICON_FILE
+from common.CollectionStats import update_collection_stats
+from common.ImpactFile import update_impact_index, IMPACT_BITS
+from common.Segments import count_lines, read_lines
+from common.DocumentStore import DocumentStore, DocumentStoreWriter, STORE_FILE
+from common.FieldExtractor import extract_fields
+from common.DisplayFields import build_display_record, parse_display_record, DISPLAY_STORE_FILE, DISPLAY_OFFSETS_FILE
+from common.Snippets import build_sentence_record, SENTENCES_STORE_FILE, SENTENCES_OFFSETS_FILE
+from common.MetadataStore import MetadataStore, MetadataStoreWriter, DOCNOS_FILE, DOCNO_INDEX_FILE, docno_date, add_docno_index
+from common.CommandLine import split_options
+
+def convert_json_postings(metadata_path):
+    inverted_index_path = metadata_path / 'inverted_index.json'
+    if not inverted_index_path.is_file():
+        print("No inverted_index.json found, skipping postings conversion")
+        return
+
+    print("Loading JSON inverted index...")
+    with open(inverted_index_path, 'r') as f:
+        inverted_index = {int(term_id): postings for term_id, postings in json.load(f).items()}
+
+    print("Writing binary postings...")
+    write_postings(metadata_path, inverted_index)
+
+    json_size = inverted_index_path.stat().st_size
+    binary_size = (metadata_path / POSTINGS_FILE).stat().st_size + (metadata_path / DIRECTORY_FILE).stat().st_size
+    print(f"inverted_index.json: {json_size:,} bytes")
+    print(f"{POSTINGS_FILE} + {DIRECTORY_FILE}: {binary_size:,} bytes ({binary_size / max(json_size, 1):.1%} of JSON)")
+
+def add_postings_blocks(metadata_path):
+    # binary postings written before the block maxima existed
+    if (metadata_path / BLOCKS_FILE).is_file() or not (metadata_path / POSTINGS_FILE).is_file():
+        print("No postings without block maxima, skipping block maxima")
+        return
+
+    print("Writing postings block maxima...")
+    doc_lengths_path = metadata_path.parent / 'doc-lengths.txt'
+    doc_lengths = array('I', (int(line) for line in read_lines(doc_lengths_path, count_lines(doc_lengths_path))))
+    write_postings_blocks(metadata_path, doc_lengths)
+    print(f"{BLOCKS_FILE}: {(metadata_path / BLOCKS_FILE).stat().st_size:,} bytes")
+
+def convert_json_lexicon(metadata_path):
+    lexicon_path = metadata_path / 'lexicon.json'
+    if (metadata_path / LEXICON_FILE).is_file() or not lexicon_path.is_file():
+        print("No lexicon.json to convert, skipping lexicon conversion")
+        return
+
+    print("Writing front-coded lexicon...")
+    with open(lexicon_path, 'r') as f:
+        write_lexicon(metadata_path, json.load(f), count_lines(metadata_path.parent / 'docno.txt'))
+
+    json_size = lexicon_path.stat().st_size
+    binary_size = (metadata_path / LEXICON_FILE).stat().st_size
+    print(f"lexicon.json: {json_size:,} bytes")
+    print(f"{LEXICON_FILE}: {binary_size:,} bytes ({binary_size / max(json_size, 1):.1%} of JSON)")
+
+def pack_documents(index_path, compress):
+    # packs the old documents/YY/MM/DD/<docno>.txt files into the document store, in internal id order
+    documents_path = index_path / 'documents'
+    docno_path = index_path / 'docno.txt'
+    if (documents_path / STORE_FILE).is_file():
+        print("Document store already exists, skipping document packing")
+        return
+    if not docno_path.is_file():
+        raise FileNotFoundError(common.ErrorMessages.docno_file_not_found())
+
+    print("Packing documents...")
+    num_docs = 0
+    unpacked_size = 0
+    with docno_path.open('r', encoding='utf-8') as f, DocumentStoreWriter(documents_path, compress) as document_store:
+        for line in f:
+            docno = line.strip()
+            year, month, day = docno[6:8], docno[2:4], docno[4:6]
+            with (documents_path / year / month / day / f'{docno}.txt').open('rb') as doc:
+                document = doc.read()
+            document_store.add(document)
+            num_docs += 1
+            unpacked_size += len(document)
+
+    packed_size = (documents_path / STORE_FILE).stat().st_size
+    print(f"{num_docs:,} documents, {unpacked_size:,} bytes in separate files, {packed_size:,} bytes packed")
+    print("The old per-document files are left in place and can be deleted once the store is verified.")
+
+def pack_metadata(index_path):
+    # packs the old metadata/YY/MM/DD/<docno>_meta.txt files into the metadata columns
+    metadata_path = index_path / 'metadata'
+    docno_path = index_path / 'docno.txt'
+    if (metadata_path / DOCNOS_FILE).is_file():
+        print("Metadata columns already exist, skipping metadata packing")
+        return
+    if not docno_path.is_file():
+        raise FileNotFoundError(common.ErrorMessages.docno_file_not_found())
+
+    print("Packing metadata...")
+    with docno_path.open('r', encoding='utf-8') as f, MetadataStoreWriter(metadata_path) as metadata_store:
+        for line in f:
+            docno = line.strip()
+            year, month, day = docno[6:8], docno[2:4], docno[4:6]
+            meta_path = metadata_path / year / month / day / f'{docno}_meta.txt'
+
+            headline = 'NULL'
+            if meta_path.is_file():
+                with meta_path.open('r', encoding='utf-8') as meta:
+                    for meta_line in meta:
+                        if meta_line.startswith('headline: '):
+                            headline = meta_line[len('headline: '):].rstrip('\n')
+
+            metadata_store.add(docno, docno_date(docno), headline)
+
+def add_docno_lookup(metadata_path):
+    # metadata columns written before the docno -> internal id index existed
+    if (metadata_path / DOCNO_INDEX_FILE).is_file() or not (metadata_path / DOCNOS_FILE).is_file():
+        print("No metadata columns without a docno index, skipping docno index")
+        return
+
+    print("Writing docno index...")
+    add_docno_index(metadata_path)
+    print(f"{DOCNO_INDEX_FILE}: {(metadata_path / DOCNO_INDEX_FILE).stat().st_size:,} bytes")
+
+def build_display_fields(index_path, compress):
+    # pre-renders the sanitized headline, date and body text that SearchEngine shows for each result
+    documents_path = index_path / 'documents'
+    if (documents_path / DISPLAY_STORE_FILE).is_file():
+        print("Display fields already exist, skipping display field extraction")
+        return
+
+    print("Extracting display fields...")
+    document_store = DocumentStore(documents_path)
+    metadata_store = MetadataStore(index_path / 'metadata')
+    with DocumentStoreWriter(documents_path, compress, store_file=DISPLAY_STORE_FILE, offsets_file=DISPLAY_OFFSETS_FILE) as display_store:
+        for doc_id in range(len(document_store)):
+            headline, graphic, text = extract_fields(document_store.get(doc_id).decode('utf-8'))
+            display_store.add(build_display_record(headline, graphic, text, metadata_store.date(doc_id)))
+
+def build_sentence_offsets(index_path):
+    # sentence and token offsets of the display bodies, for snippets
+    documents_path = index_path / 'documents'
+    if (documents_path / SENTENCES_STORE_FILE).is_file():
+        print("Sentence offsets already exist, skipping sentence offsets")
+        return
+
+    print("Recording sentence offsets...")
+    display_store = DocumentStore(documents_path, store_file=DISPLAY_STORE_FILE, offsets_file=DISPLAY_OFFSETS_FILE)
+    with DocumentStoreWriter(documents_path, store_file=SENTENCES_STORE_FILE, offsets_file=SENTENCES_OFFSETS_FILE) as sentence_store:
+        for doc_id in range(len(display_store)):
+            sentence_store.add(build_sentence_record(parse_display_record(display_store.get(doc_id))[2]))
+    display_store.close()
+
+def main():
+    args, options = split_options(sys.argv[1:], flags=('compress-documents', 'impacts'))
+    if len(args) != 1:
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Expected exactly one argument!
+
+                Usage: python src/ConvertIndex.py <directory to index> [--compress-documents] [--impacts]
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    index_path = Path(args[0])
+    if not index_path.is_dir():
+        raise FileNotFoundError(common.ErrorMessages.index_directory_not_found())
+
+    convert_json_postings(index_path / 'metadata')
+    add_postings_blocks(index_path / 'metadata')
+    convert_json_lexicon(index_path / 'metadata')
+    pack_documents(index_path, 'compress-documents' in options)
+    pack_metadata(index_path)
+    add_docno_lookup(index_path / 'metadata')
+    build_display_fields(index_path, 'compress-documents' in options)
+    build_sentence_offsets(index_path)
+    print("Writing collection statistics...")
+    update_collection_stats(index_path)
+    # impact-ordered postings for SearchEngine, see common/ImpactFile.py
+    update_impact_index(index_path, IMPACT_BITS if 'impacts' in options else None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import sys
+from pathlib import Path
+from common.Segments import delete_docnos, start_background_merge
+from common.CollectionStats import update_collection_stats
+
+def main():
+    if len(sys.argv) < 3:
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Expected a directory and at least one docno!
+
+                Usage: python src/DeleteDoc.py <directory> <docno> [<docno> ...]
+
+                Sample: DeleteDoc /home/smucker/latimes-index LA010290-0030
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    docpath = sys.argv[1]
+    docnos = [docno.strip() for docno in sys.argv[2:]]
+
+    if not Path(docpath).is_dir():
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Directory does not exist!
+
+                Choose a new directory path, or create the directory using IndexEngine.
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    num_deleted = delete_docnos(docpath, docnos)
+    if not num_deleted:
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Docno specified does not exist!
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    print(f"Deleted {num_deleted} documents")
+    # N and the average doc length only count live documents
+    update_collection_stats(docpath)
+    # segments with many deletions get compacted, and stale impacts rebuilt
+    start_background_merge(docpath)
+
+if __name__ == '__main__':
+    main()
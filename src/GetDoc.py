@@ -1,5 +1,8 @@
 import sys
 from pathlib import Path
+from common.DocumentStore import DocumentStore
+from common.MetadataStore import MetadataStore
+from common.IndexReader import open_segmented, open_live_docs
 
 def check_directories(docpath):
     p = Path(docpath)
@@ -46,14 +49,19 @@ def check_directories(docpath):
         return -1
     return 1
 
-def check_docno_file(docpath):
-    p = Path(docpath + '/docno.txt')
-    if not p.is_file():
+def open_stores(docpath):
+    global document_store
+    global metadata_store
+    global live_docs
+    live_docs = open_live_docs(docpath)
+    try:
+        document_store = open_segmented(docpath, lambda path: DocumentStore(path / 'documents'))
+    except FileNotFoundError:
         print(
             '''
             # ------------------------------------------------------------------------------------------------
 
-                Error: docno.txt does not exist!
+                Error: Document store does not exist!
 
                 Choose a new directory path, or reconstruct using IndexEngine.
 
@@ -61,26 +69,30 @@ def check_docno_file(docpath):
             '''
         )
         return -1
-    return 1
 
-def construct_map(docpath):
-    p = Path(docpath)
-    global id_to_doc
-    id_to_doc = []
+    try:
+        metadata_store = open_segmented(docpath, lambda path: MetadataStore(path / 'metadata'))
+    except FileNotFoundError:
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
 
-    with p.open("r", encoding ="utf-8") as f:
-        for doc in f:
-            id_to_doc.append(doc)
+                Error: Document metadata does not exist!
+
+                Choose a new directory path, or reconstruct using IndexEngine.
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+    return 1
 
 def docno_helper(docpath, identifier):
     identifier = identifier.strip()
-    year, month, day = identifier[6:8], identifier[2:4], identifier[4:6]
-    path_to_doc = docpath + f'/documents/{year}/{month}/{day}/{identifier}.txt'
-    path_to_meta = docpath + f'/metadata/{year}/{month}/{day}/{identifier}_meta.txt'
-
-    content = ['\n']
+    # binary search of metadata/docno-index.bin, see common/MetadataStore.py
+    internal_id = metadata_store.doc_id(identifier)
 
-    if not Path(path_to_doc).is_file():
+    if internal_id is None:
         print('''
         # ------------------------------------------------------------------------------------------------
 
@@ -89,33 +101,39 @@ def docno_helper(docpath, identifier):
         # ------------------------------------------------------------------------------------------------
         ''')
         return -1
-    elif not Path(path_to_meta).is_file():
+
+    id_helper(internal_id)
+
+def id_helper(internal_id):
+    if not live_docs.is_live(internal_id):
         print('''
         # ------------------------------------------------------------------------------------------------
 
-            Error: Metadata for docno specified does not exist!
+            Error: Document has been deleted from the index!
 
         # ------------------------------------------------------------------------------------------------
         ''')
         return -1
-    else:
-        with Path(path_to_meta).open("r", encoding ="utf-8") as f:
-            for line in f:
-                content.append(line)
-        content.append('raw document:\n')
-        with Path(path_to_doc).open("r", encoding ="utf-8") as f2:
-            for l in f2:
-                content.append(l)
 
-        print(''.join(content))
+    content = ['\n']
+    content.append(f'docno: {metadata_store.docno(internal_id)}\n')
+    content.append(f'internal id: {internal_id}\n')
+    content.append(f'date: {metadata_store.date(internal_id)}\n')
+    content.append(f'headline: {metadata_store.headline(internal_id)}\n')
+    content.append('raw document:\n')
+    content.append(document_store.get(internal_id).decode('utf-8'))
+
+    print(''.join(content))
 
 def fetch_doc(method, docpath, identifier):
     if method == 'docno':
         docno_helper(docpath, identifier)
     elif method == 'id':
         try:
-            docno = id_to_doc[int(identifier)]
-            docno_helper(docpath, docno)
+            internal_id = int(identifier)
+            if internal_id not in metadata_store:
+                raise IndexError(internal_id)
+            id_helper(internal_id)
         except IndexError:
             print('''
                 # ------------------------------------------------------------------------------------------------
@@ -178,10 +196,8 @@ def main():
     if check_directories(docpath) == -1:
         return -1
     
-    if check_docno_file(docpath) == -1:
+    if open_stores(docpath) == -1:
         return -1
-    else:
-        construct_map(docpath + '/docno.txt')
 
     fetch_doc(method, docpath, identifier)
 
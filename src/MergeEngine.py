@@ -0,0 +1,284 @@
+'''
+Merges adjacent segments of an incrementally built index into one (see common/Segments.py).
+
+IndexEngine --append starts this in the background after publishing a new segment. It keeps
+merging according to the tiered merge policy until nothing is left to merge, so a merged
+segment is byte for byte what IndexEngine would have built from those archives in one go, minus
+the deleted documents, which are physically dropped here.
+Searches keep working the whole time: the manifest is only swapped once the merged segment
+is complete, and running searches keep their already opened files.
+'''
+
+import sys
+from array import array
+import fcntl
+from pathlib import Path
+from common.CommandLine import split_options
+from common.PostingsFile import PostingsReader, write_postings_stream
+from common.LexiconFile import write_lexicon
+from common.DocumentStore import DocumentStore, DocumentStoreWriter
+from common.MetadataStore import MetadataStore, MetadataStoreWriter
+from common.DisplayFields import DISPLAY_STORE_FILE, DISPLAY_OFFSETS_FILE, parse_display_record
+from common.Snippets import build_sentence_record, SENTENCES_STORE_FILE, SENTENCES_OFFSETS_FILE
+from common.IndexReader import read_lexicon, read_doc_lengths
+from common.LiveDocs import LiveDocs
+from common.CollectionStats import update_collection_stats
+from common.ImpactFile import update_impact_index
+from common.Segments import (
+    read_manifest, write_manifest, manifest_lock, reserve_segment, replace_segments, retire_segments, rebuild_root_lists,
+    remove_segment_files, segment_path, select_merge, MERGE_FACTOR, MERGE_LOCK_FILE,
+)
+
+def open_segment(path, num_docs):
+    segment = {
+        'path': path,
+        'num_docs': num_docs,
+        'live_docs': LiveDocs.load(path / 'metadata', num_docs),
+        'lexicon': read_lexicon(path / 'metadata'),
+        'postings': PostingsReader(path / 'metadata'),
+        'doc_lengths': read_doc_lengths(path / 'doc-lengths.txt', num_docs),
+        'documents': DocumentStore(path / 'documents'),
+        'display': DocumentStore(path / 'documents', store_file=DISPLAY_STORE_FILE, offsets_file=DISPLAY_OFFSETS_FILE),
+        'metadata': MetadataStore(path / 'metadata'),
+        'sentences': None,
+    }
+    # segments written before the sentence offsets existed get them from the display fields
+    if (path / 'documents' / SENTENCES_STORE_FILE).is_file():
+        segment['sentences'] = DocumentStore(path / 'documents', store_file=SENTENCES_STORE_FILE, offsets_file=SENTENCES_OFFSETS_FILE)
+    return segment
+
+def close_segment(segment):
+    segment['postings'].close()
+    segment['documents'].close()
+    segment['display'].close()
+    if segment['sentences'] is not None:
+        segment['sentences'].close()
+    segment['metadata'].close()
+
+def segment_postings(segment, term):
+    # a term's postings in one segment, moved to the merged internal ids, deleted documents dropped
+    local_id = segment['lexicon'].get(term)
+    if local_id is None:
+        return []
+
+    postings = segment['postings'][local_id]
+    id_map = segment['id_map']
+    merged = []
+    for i in range(0, len(postings), 2):
+        doc_id = id_map[postings[i]]
+        if doc_id >= 0:
+            merged.append(doc_id)
+            merged.append(postings[i + 1])
+    return merged
+
+def has_live_postings(segments, term):
+    for segment in segments:
+        if term in segment['lexicon']:
+            if not segment['live_docs'].num_deleted or segment_postings(segment, term):
+                return True
+    return False
+
+def merged_postings(lexicon, segments):
+    # a term's postings are the postings of every segment in order
+    for term_id, term in enumerate(lexicon):
+        postings = []
+        for segment in segments:
+            postings.extend(segment_postings(segment, term))
+        yield term_id, postings
+
+def write_segment(destPath, segments):
+    # merged internal ids, deleted documents are left out (-1)
+    num_docs = 0
+    doc_lengths = array('I')
+    for segment in segments:
+        id_map = []
+        for doc_id in range(segment['num_docs']):
+            if segment['live_docs'].is_live(doc_id):
+                id_map.append(num_docs)
+                doc_lengths.append(segment['doc_lengths'][doc_id])
+                num_docs += 1
+            else:
+                id_map.append(-1)
+        segment['id_map'] = id_map
+
+    # term ids in the order terms first appear, same as a single IndexEngine run over the segments;
+    # terms only left in deleted documents are dropped
+    lexicon = {}
+    for segment in segments:
+        for term in segment['lexicon']:
+            if term not in lexicon and has_live_postings(segments, term):
+                lexicon[term] = len(lexicon)
+
+    write_postings_stream(destPath / 'metadata', len(lexicon), merged_postings(lexicon, segments), doc_lengths)
+    write_lexicon(destPath / 'metadata', lexicon, num_docs)
+
+    compress = segments[0]['documents'].compressed
+    internal_id = 0
+    with (destPath / 'docno.txt').open("w", encoding ="utf-8") as docno_file, \
+            (destPath / 'doc-lengths.txt').open("w", encoding ="utf-8") as doc_lengths_file, \
+            DocumentStoreWriter(destPath / 'documents', compress) as document_store, \
+            DocumentStoreWriter(destPath / 'documents', compress, store_file=DISPLAY_STORE_FILE, offsets_file=DISPLAY_OFFSETS_FILE) as display_store, \
+            DocumentStoreWriter(destPath / 'documents', store_file=SENTENCES_STORE_FILE, offsets_file=SENTENCES_OFFSETS_FILE) as sentence_store, \
+            MetadataStoreWriter(destPath / 'metadata') as metadata_store:
+        for segment in segments:
+            for doc_id in range(segment['num_docs']):
+                if segment['id_map'][doc_id] < 0:
+                    continue
+
+                docNo = segment['metadata'].docno(doc_id)
+                metadata_store.add(docNo, segment['metadata'].packed_date(doc_id), segment['metadata'].headline(doc_id))
+                document_store.add(segment['documents'].get(doc_id))
+                display_record = segment['display'].get(doc_id)
+                display_store.add(display_record)
+                if segment['sentences'] is not None:
+                    sentence_store.add(segment['sentences'].get(doc_id))
+                else:
+                    sentence_store.add(build_sentence_record(parse_display_record(display_record)[2]))
+
+                separator = '\n' if internal_id else ''
+                docno_file.write(separator + docNo)
+                doc_lengths_file.write(separator + str(segment['doc_lengths'][doc_id]))
+                internal_id += 1
+
+    return num_docs
+
+def commit_merge(index_path, segments, names, name, num_docs):
+    # returns the names of the segments that can be removed from disk now
+    destPath = segment_path(index_path, name)
+    with manifest_lock(index_path):
+        manifest = read_manifest(index_path)
+
+        # documents deleted while the merge was running are deleted in the merged segment too
+        live_docs = LiveDocs(num_docs)
+        for segment in segments:
+            current = LiveDocs.load(segment['path'] / 'metadata', segment['num_docs'])
+            for doc_id, merged_id in enumerate(segment['id_map']):
+                if merged_id >= 0 and not current.is_live(doc_id):
+                    live_docs.delete(merged_id)
+        if live_docs.num_deleted:
+            live_docs.save(destPath / 'metadata')
+
+        merged = [{'name': name, 'num_docs': num_docs, 'num_deleted': live_docs.num_deleted}] if num_docs else []
+        replace_segments(manifest, names, merged)
+        removable = retire_segments(manifest, names)
+
+        # dropping deleted documents shifts the global ids of every later segment
+        if num_docs != sum(segment['num_docs'] for segment in segments):
+            rebuild_root_lists(index_path, manifest)
+        write_manifest(index_path, manifest)
+    return removable
+
+def merge_segments(index_path, segments):
+    # segments: adjacent manifest entries, returns the name of the segment replacing them
+    names = [segment['name'] for segment in segments]
+    name = reserve_segment(index_path)
+    destPath = segment_path(index_path, name)
+    (destPath / 'documents').mkdir(parents=True)
+    (destPath / 'metadata').mkdir()
+
+    opened = [open_segment(segment_path(index_path, segment['name']), segment['num_docs']) for segment in segments]
+    try:
+        num_docs = write_segment(destPath, opened)
+    finally:
+        for segment in opened:
+            close_segment(segment)
+
+    removable = commit_merge(index_path, opened, names, name, num_docs)
+    # merging drops deleted documents and shifts the global ids the norms are stored by
+    update_collection_stats(index_path)
+    # the segments merged away now stay until the next merge, only the ones before them go
+    for old_name in removable:
+        remove_segment_files(index_path, old_name)
+    # an empty merged segment never made it into a manifest
+    if not num_docs:
+        remove_segment_files(index_path, name)
+
+    print(f"Merged {len(names)} segments ({num_docs:,} live documents) into {name}")
+    return name
+
+def merge(index_path, merge_factor=MERGE_FACTOR, force=False):
+    # returns the generation found with nothing left to merge and the impacts fresh
+    while True:
+        manifest = read_manifest(index_path)
+        segments = manifest['segments']
+        if force:
+            # everything into one segment without deleted documents
+            needs_merge = len(segments) > 1 or any(segment.get('num_deleted', 0) for segment in segments)
+            selected = (0, len(segments)) if needs_merge else None
+        else:
+            selected = select_merge(segments, merge_factor)
+
+        if selected is not None:
+            start, end = selected
+            merge_segments(index_path, segments[start:end])
+        # DeleteDoc and --append leave the impacts stale for this run to rebuild, once nothing is
+        # left to merge; a change during the rebuild means another round
+        elif update_impact_index(index_path):
+            return manifest['generation']
+
+def main():
+    args, options = split_options(sys.argv[1:], flags=('force',))
+    if len(args) != 1:
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Expected exactly one argument!
+
+                Usage: python src/MergeEngine.py <directory to index> [--merge-factor <N>] [--force]
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    index_path = Path(args[0])
+    if not index_path.is_dir():
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Directory does not exist!
+
+                Choose a new directory path, or create the directory using IndexEngine.
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    merge_factor = MERGE_FACTOR
+    if 'merge-factor' in options:
+        try:
+            merge_factor = int(options['merge-factor'])
+        except ValueError:
+            merge_factor = 0
+        if merge_factor < 2:
+            print(
+                '''
+                # ------------------------------------------------------------------------------------------------
+
+                    Error: --merge-factor expects a whole number of at least 2!
+
+                # ------------------------------------------------------------------------------------------------
+                '''
+            )
+            return -1
+
+    # one merger per index at a time, a second one started meanwhile gives up. The index may have
+    # changed after the last check of the one holding the lock, so that one looks again once it
+    # has let go and takes over if nobody else has
+    while True:
+        with (index_path / MERGE_LOCK_FILE).open('w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print("Another merge is already running on this index")
+                return
+
+            generation = merge(index_path, merge_factor, 'force' in options)
+        if read_manifest(index_path)['generation'] == generation:
+            break
+
+if __name__ == '__main__':
+    main()
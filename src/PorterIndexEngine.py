@@ -10,26 +10,30 @@ https://stackoverflow.com/questions/8933237/how-do-i-check-if-a-directory-exists
 
 '''
 
-import gzip
 import sys
+from array import array
 from pathlib import Path
-import re
 from collections import defaultdict, Counter
-import json
 from common.SimpleTokenizer import Tokenize
+from common.FieldExtractor import extract_fields
+from common.PostingsFile import write_postings, write_run, merge_runs
+from common.LexiconFile import write_lexicon
+from common.CollectionStats import update_collection_stats
+from common.ImpactFile import update_impact_index, read_impacts_info, IMPACT_BITS
+from common.CommandLine import split_options
+from common.Pipeline import imap_ordered
+from common.DocumentFramer import frame_documents
+from common.DocumentStore import DocumentStoreWriter
+from common.MetadataStore import MetadataStoreWriter, docno_date, format_date
+from common.DisplayFields import build_display_record, parse_display_record, DISPLAY_STORE_FILE, DISPLAY_OFFSETS_FILE
+from common.Snippets import build_sentence_record, SENTENCES_STORE_FILE, SENTENCES_OFFSETS_FILE
+from common.Segments import reserve_segment, segment_path, add_segment, start_background_merge
+from common.StemCache import StemCache, STEM_CACHE_FILE, hit_rate
 from nltk.stem import PorterStemmer
 
 ps = PorterStemmer()
-
-def dateParser(s):
-    parsed = s.split(' ')
-    docno = parsed[1]
-    
-    month = docno[2:4]
-    day = docno[4:6]
-    year = docno[6:8]
-
-    return docno, year, month, day
+# surface form -> stem, see common/StemCache.py
+stem_cache = StemCache(ps.stem)
 
 def createDirectory(destPath):
     p = Path(destPath)
@@ -53,125 +57,6 @@ def createDirectory(destPath):
         )
         return -1
     
-def saveDocument(date, fileName, file):
-    # check if year month day subdirectories exist
-    # if so, write file
-    # else, create directory then write file
-
-    year, month, day = date
-
-    fileDir = destPath + '/documents/' + year + '/' + month + '/' + day
-    filePath = fileDir + '/' + fileName + '.txt'
-
-    if not Path(fileDir).is_dir():
-        Path(fileDir).mkdir(parents=True)
-
-    with Path(filePath).open("w", encoding ="utf-8") as f:
-        f.write(file)
-
-def processHeadline(headlineInfo, docNo, internal_id):
-    headlineRegex = '<HEADLINE>.*?<\/HEADLINE>'
-    headline = re.findall(headlineRegex, headlineInfo)
-
-    default = 'NULL'
-    temp = []
-    output = ''
-
-    if headline:
-        h = headline[0].split(' ')
-        for char in h:
-            if char not in ['<P>', '</P>', '<HEADLINE>', '</HEADLINE>']:
-                temp.append(char)
-        output = ' '.join(temp)
-    else:
-        output = default
-        return []
-
-    buildMeta(output, docNo, internal_id)
-
-    return [ps.stem(token) for token in Tokenize(output)]
-
-
-def process_graphic(text):
-    graphic_regex = '<GRAPHIC>.*?<\/GRAPHIC>'
-    graphic = re.findall(graphic_regex, text)
-
-    default = 'NULL'
-    temp = []
-    output = ''
-
-    if graphic:
-        g = graphic[0].split(' ')
-        for char in g:
-            if char not in ['<P>', '</P>', '<GRAPHIC>', '</GRAPHIC>']:
-                temp.append(char)
-        output = ' '.join(temp)
-    else:
-        output = default
-        return []
-    
-    return [ps.stem(token) for token in Tokenize(output)]
-
-def process_text(txt):
-    text_regex = '<TEXT>.*?<\/TEXT>'
-    text = re.findall(text_regex, txt)
-
-    default = 'NULL'
-    temp = []
-    output = ''
-
-    if text:
-        t = text[0].split(' ')
-        for char in t:
-            if char not in ['<P>', '</P>', '<TEXT>', '</TEXT>']:
-                temp.append(char)
-        output = ' '.join(temp)
-    else:
-        output = default
-        return []
-    
-    return [ps.stem(token) for token in Tokenize(output)]
-
-def buildMeta(title, docNo, internal_id):
-    month = docNo[2:4]
-    day = docNo[4:6]
-    year = docNo[6:8]
-
-    monthMap = {
-        '01': 'January',
-        '02': 'February',
-        '03': 'March',
-        '04': 'April',
-        '05': 'May',
-        '06': 'June',
-        '07': 'July',
-        '08': 'August',
-        '09': 'September',
-        '10': 'October',
-        '11': 'November',
-        '12': 'December',
-    }
-
-    # according to project doc it is guaranteed that all dates are 19xx
-    fullDate = f'{monthMap[month]} {day}, 19{year}'
-
-    content = f'docno: {docNo}\ninternal id: {internal_id}\ndate: {fullDate}\nheadline: {title}\n'
-
-    saveMeta(content, (year, month, day), docNo)
-
-def saveMeta(content, date, docNo):
-    year, month, day = date
-
-    fileDir = destPath + '/metadata/' + year + '/' + month + '/' + day
-    print(fileDir)
-    filePath = fileDir + '/' + docNo + '_meta.txt'
-
-    if not Path(fileDir).is_dir():
-        Path(fileDir).mkdir(parents=True)
-
-    with Path(filePath).open("w", encoding ="utf-8") as f:
-        f.write(content)
-
 def convert_tokens_via_lexicon(tokens_list):
     token_ids = []
     for token in tokens_list:
@@ -192,86 +77,204 @@ def add_to_postings(word_counts, doc_id):
         postings.append(doc_id)
         postings.append(count)
 
-def read(gzPath, destPath):
-    gz = Path(gzPath)
-    content = []
-
-    docnoList = []
-    doc_lengths = []
-    internal_id = 0
+# rough size of one (doc, tf) pair held in the in-memory postings lists, used against the memory budget
+BYTES_PER_POSTING = 72
 
-    docNo, year, month, day = '', '', '', ''
+def flush_run(run_dir, runs):
+    # write the postings gathered so far as a sorted run and start over with an empty index
+    if not run_dir.is_dir():
+        run_dir.mkdir()
 
-    tokens = []
+    run_path = run_dir / f'run-{len(runs)}.bin'
+    write_run(run_path, inverted_index)
+    runs.append(run_path)
+    inverted_index.clear()
 
-    global inverted_index
-    inverted_index = defaultdict(list)
-    global lexicon
-    lexicon = defaultdict(int)
+def init_worker(stems):
+    # pool processes start from the parent's (warm) stem cache
+    global stem_cache
+    stem_cache = StemCache(ps.stem, stems)
 
-    with gzip.open(gz,'rt') as f:
-        for line in f:
+def parse_document(document):
+    # worker: field extraction, tokenization and display fields, runs in a pool process when --workers > 1
+    docNo, fileToSave = document
+    headline, graphic, text = extract_fields(fileToSave.decode('utf-8'))
+    display_record = build_display_record(headline, graphic, text, format_date(docno_date(docNo)))
+    # sentence and token offsets of the display body, for snippets (see common/Snippets.py)
+    sentence_record = build_sentence_record(parse_display_record(display_record)[2])
 
-            l = line.strip()
-            content.append(l)
-
-            if '<DOCNO>' and '</DOCNO>' in l:
-                docNo, year, month, day = dateParser(l)
-
-            if l == '</DOC>':
-                fileToSave = '\n'.join(content)
-
-                full_text = ' '.join(content)
-
-                tokens.extend(processHeadline(full_text, docNo, internal_id))
-                tokens.extend(process_graphic(full_text))
-                tokens.extend(process_text(full_text))
+    tokens = []
+    for field in (headline, graphic, text):
+        if field is not None:
+            tokens.extend(stem_cache.stem_tokens(Tokenize(field)))
 
-                token_ids = convert_tokens_via_lexicon(tokens)
-                word_counts = count_words(token_ids)
-                add_to_postings(word_counts, internal_id)
+    # newly stemmed forms and hit counts go back to the parent with the document
+    return 'NULL' if headline is None else headline, tokens, display_record, sentence_record, stem_cache.drain()
 
-                doc_lengths.append(str(len(tokens)))
-                
-                saveDocument((year, month, day), docNo, fileToSave)
-                content.clear()
-                docnoList.append(docNo)
+def read(gzPath, destPath, memory_budget=None, workers=1, compress_documents=False, stem_cache_seed=None, stem_cache_path=None):
+    internal_id = 0
 
-                tokens.clear()
-                internal_id += 1
+    # the stem cache starts from stem_cache_path, next to the lexicon unless given, with the forms of
+    # stem_cache_seed merged in, and is saved back there
+    if stem_cache_path is None:
+        stem_cache_path = destPath + '/metadata/' + STEM_CACHE_FILE
+    global stem_cache
+    stem_cache = StemCache.load(stem_cache_path, ps.stem)
+    if stem_cache_seed is not None:
+        stem_cache.update(StemCache.load(stem_cache_seed, ps.stem).stems)
+    stem_hits, stem_misses = 0, 0
 
-    docNoList_content = '\n'.join(docnoList)
-    with Path(destPath + '/docno.txt').open("w", encoding ="utf-8") as f:
-        f.write(docNoList_content)
+    global inverted_index
+    inverted_index = defaultdict(list)
+    global lexicon
+    lexicon = defaultdict(int)
 
-    doc_lengths_content = '\n'.join(doc_lengths)
-    with Path(destPath + '/doc-lengths.txt').open("w", encoding ="utf-8") as f:
-        f.write(doc_lengths_content)
+    # with a memory budget, postings are flushed to sorted runs on disk and merged at the end
+    run_dir = Path(destPath + '/metadata/runs')
+    runs = []
+    num_postings = 0
+
+    # docnos and doc lengths are streamed out, only the lengths are kept as 4 bytes per document
+    # for the block maxima of the postings
+    doc_lengths = array('I')
+    docno_file = Path(destPath + '/docno.txt').open("w", encoding ="utf-8")
+    doc_lengths_file = Path(destPath + '/doc-lengths.txt').open("w", encoding ="utf-8")
+
+    # raw documents go into one packed store, in internal id order
+    document_store = DocumentStoreWriter(destPath + '/documents', compress_documents)
+    # sanitized headline, date and body text for rendering search results
+    display_store = DocumentStoreWriter(destPath + '/documents', compress_documents, store_file=DISPLAY_STORE_FILE, offsets_file=DISPLAY_OFFSETS_FILE)
+    sentence_store = DocumentStoreWriter(destPath + '/documents', store_file=SENTENCES_STORE_FILE, offsets_file=SENTENCES_OFFSETS_FILE)
+    # docno, date and headline columns, also in internal id order
+    metadata_store = MetadataStoreWriter(destPath + '/metadata')
+
+    with docno_file, doc_lengths_file, document_store, display_store, sentence_store, metadata_store:
+        # consumer: documents come back in archive order, so ids and term ids match a serial build
+        for document, (headline, tokens, display_record, sentence_record, (stems, hits, misses)) in imap_ordered(parse_document, frame_documents(gzPath), workers, initializer=init_worker, initargs=(stem_cache.stems,)):
+            docNo, fileToSave = document
+
+            stem_cache.update(stems)
+            stem_hits += hits
+            stem_misses += misses
+
+            metadata_store.add(docNo, docno_date(docNo), headline)
+
+            token_ids = convert_tokens_via_lexicon(tokens)
+            word_counts = count_words(token_ids)
+            add_to_postings(word_counts, internal_id)
+
+            separator = '\n' if internal_id else ''
+            doc_lengths_file.write(separator + str(len(tokens)))
+            doc_lengths.append(len(tokens))
+
+            document_store.add(fileToSave)
+            display_store.add(display_record)
+            sentence_store.add(sentence_record)
+            docno_file.write(separator + docNo)
+
+            internal_id += 1
+
+            num_postings += len(word_counts)
+            if memory_budget and num_postings * BYTES_PER_POSTING >= memory_budget:
+                flush_run(run_dir, runs)
+                num_postings = 0
+
+    stem_cache.save(stem_cache_path)
+    print(f"Stem cache: {len(stem_cache):,} surface forms, {stem_hits:,} hits, {stem_misses:,} misses ({hit_rate(stem_hits, stem_misses):.1%} hit rate)")
+
+    if runs:
+        if inverted_index:
+            flush_run(run_dir, runs)
+        merge_runs(runs, destPath + '/metadata', len(lexicon), doc_lengths)
+        for run_path in runs:
+            run_path.unlink()
+        run_dir.rmdir()
+    else:
+        write_postings(destPath + '/metadata', inverted_index, doc_lengths)
 
-    with Path(destPath + '/metadata/lexicon.json').open("w") as f:
-        json.dump(lexicon, f)
+    # written after the postings, which give the document frequencies for the stored IDFs
+    write_lexicon(destPath + '/metadata', lexicon, internal_id)
 
-    with Path(destPath + '/metadata/inverted_index.json').open("w") as f:
-        json.dump(inverted_index, f)
+    return internal_id
 
 def main():
-    if len(sys.argv) != 3:
+    args, options = split_options(sys.argv[1:], flags=('compress-documents', 'append', 'impacts'))
+    if len(args) != 2:
         print(
             '''
             # ------------------------------------------------------------------------------------------------
 
                 Error: Expected exactly two arguments!
 
-                Usage: python src/IndexEngine.py <path to latimes gz file> <path to output directory>
+                Usage: python src/IndexEngine.py <path to latimes gz file> <path to output directory> [--memory-budget <MB>] [--workers <N>] [--compress-documents] [--append] [--k1 <value>] [--b <value>] [--impacts] [--stem-cache <path to stem-cache.json>]
 
             # ------------------------------------------------------------------------------------------------
             '''
         )
         return -1
     
-    gzPath = sys.argv[1]
-    global destPath 
-    destPath = str(Path(sys.argv[2]))
+    gzPath = args[0]
+    destPath = str(Path(args[1]))
+
+    memory_budget = None
+    if 'memory-budget' in options:
+        try:
+            memory_budget = float(options['memory-budget']) * 1024 * 1024
+        except ValueError:
+            memory_budget = -1
+        if memory_budget <= 0:
+            print(
+                '''
+                # ------------------------------------------------------------------------------------------------
+
+                    Error: --memory-budget expects a positive number of megabytes!
+
+                # ------------------------------------------------------------------------------------------------
+                '''
+            )
+            return -1
+
+    workers = 1
+    if 'workers' in options:
+        try:
+            workers = int(options['workers'])
+        except ValueError:
+            workers = 0
+        if workers < 1:
+            print(
+                '''
+                # ------------------------------------------------------------------------------------------------
+
+                    Error: --workers expects a positive whole number!
+
+                # ------------------------------------------------------------------------------------------------
+                '''
+            )
+            return -1
+
+    # BM25 parameters the length norms are precomputed for, see common/CollectionStats.py
+    bm25_parameters = {}
+    for name in ('k1', 'b'):
+        if name in options:
+            try:
+                bm25_parameters[name] = float(options[name])
+            except ValueError:
+                bm25_parameters[name] = -1
+            if bm25_parameters[name] < 0:
+                print(
+                    '''
+                    # ------------------------------------------------------------------------------------------------
+
+                        Error: --k1 and --b expect non-negative numbers!
+
+                    # ------------------------------------------------------------------------------------------------
+                    '''
+                )
+                return -1
+
+    # impact-ordered postings for SearchEngine, see common/ImpactFile.py; on an index that has
+    # them, appending leaves them to the background merge either way
+    impact_bits = IMPACT_BITS if 'impacts' in options else None
 
     gz = Path(gzPath)
     if not gz.is_file():
@@ -286,11 +289,59 @@ def main():
         )
         return -1
 
+    if 'stem-cache' in options and not Path(str(options['stem-cache'])).is_file():
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: stem cache file does not exist at the path provided!
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    if 'append' in options:
+        # the archive becomes a new segment of the existing index, see common/Segments.py
+        if not Path(destPath).is_dir():
+            print(
+                '''
+                # ------------------------------------------------------------------------------------------------
+
+                    Error: --append expects an existing index directory!
+
+                    Build the index without --append first.
+
+                # ------------------------------------------------------------------------------------------------
+                '''
+            )
+            return -1
+
+        segment = reserve_segment(destPath)
+        segmentPath = str(segment_path(destPath, segment))
+        createPath = createDirectory(segmentPath)
+        if createPath == -1:
+            return -1
+
+        # appended segments share the stem cache of the index
+        num_docs = read(gzPath, segmentPath, memory_budget, workers, 'compress-documents' in options, options.get('stem-cache'), destPath + '/metadata/' + STEM_CACHE_FILE)
+        # documents already in the index under the same docno are replaced
+        num_replaced = add_segment(destPath, segment, num_docs)
+        if num_replaced:
+            print(f"Replaced {num_replaced} existing documents")
+        update_collection_stats(destPath, **bm25_parameters)
+        if impact_bits is not None and read_impacts_info(destPath) is None:
+            update_impact_index(destPath, impact_bits)
+        start_background_merge(destPath)
+        return
+
     createPath = createDirectory(destPath)
     if createPath == -1:
         return -1
     
-    read(gzPath, destPath)
+    read(gzPath, destPath, memory_budget, workers, 'compress-documents' in options, options.get('stem-cache'))
+    update_collection_stats(destPath, **bm25_parameters)
+    update_impact_index(destPath, impact_bits)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
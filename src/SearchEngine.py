@@ -1,321 +1,255 @@
+import sys
 from pathlib import Path
-import json
 from common.SimpleTokenizer import Tokenize
-from datetime import datetime
-import re
-from math import log
+from common.DisplayFields import parse_display_record, DISPLAY_STORE_FILE, DISPLAY_OFFSETS_FILE
+from common.Snippets import make_snippet, parse_sentence_record, SENTENCES_STORE_FILE, SENTENCES_OFFSETS_FILE
 import time
-import heapq
+from common.IndexReader import load_index, open_segmented, close_lexicon
+from common.Scoring import block_max_top_k
+from common.ImpactFile import open_impact_index, impact_top_k
+from common.DocumentStore import DocumentStore
+from common.MetadataStore import MetadataStore
+from common.ResultCache import ResultCache, query_key
+from common.Segments import read_manifest
 
 # BM25 Parameters
 K1 = 1.2
 B = 0.75
 
-def load_index_data(index_path):
-    print("Loading lexicon...")
-    with open(index_path / 'metadata/lexicon.json', 'r') as f:
-        lexicon = json.load(f)
-
-    print("Loading inverted index...")
-    with open(index_path / 'metadata/inverted_index.json', 'r') as f:
-        inverted_index = json.load(f)
-
-    print("Loading doc lengths...")
-    doc_lengths = []
-    total_word_count = 0
-    num_docs = 0
-    
-    with open(index_path / 'doc-lengths.txt', "r") as f:
-        for line in f:
-            words = int(line.strip())
-            total_word_count += words
-            doc_lengths.append(words)
-            num_docs += 1
-    
-    avg_doc_length = total_word_count / num_docs
-
-    return lexicon, inverted_index, doc_lengths, num_docs, avg_doc_length
-
-def bm25_search(query_terms, lexicon, inverted_index, doc_lengths, num_docs, avg_doc_length):
-    query_terms = set(query_terms)  # avoid duplicates
-    scores = [0] * num_docs
-
-    for term in query_terms:
-        term_id = lexicon.get(term, None)
-        posting = None
-
-        if term_id:
-            posting = inverted_index.get(str(term_id), None)
-        if posting:
-            ni = len(posting) // 2
-            
-            for i in range(0, len(posting), 2):
-                doc_id = posting[i]
-                fi = posting[i + 1]
-                
-                k = K1 * ((1-B) + B * doc_lengths[doc_id]/avg_doc_length)
-                scores[doc_id] += ((fi / (k+fi)) * log((num_docs-ni+0.5)/(ni+0.5)))
-
-    scored_docs = [(doc_id, score) for doc_id, score in enumerate(scores) if score > 0]
-    scored_docs.sort(key=lambda x: x[1], reverse=True)
-    
-    return scored_docs[:10]
-
-def get_document_content(doc_id, index_path):
-    docno = None
-    with open(index_path / 'docno.txt', 'r') as f:
-        for i, line in enumerate(f):
-            if i == doc_id:
-                docno = line.strip()
-                break
-    
+# on an index built with --impacts, a query scores at most this many postings, highest impacts
+# first, and stops at the deadline; None for no limit (see common/ImpactFile.py)
+POSTINGS_BUDGET = 100000
+DEADLINE_MS = 100
+
+# results per page; a query that misses the result cache is scored CACHE_DEPTH deep, so the next
+# pages come out of the cache (see common/ResultCache.py)
+PAGE_SIZE = 10
+CACHE_DEPTH = 100
+
+BOLD = '\033[1m'
+RESET = '\033[0m'
+
+def load_index_data(index_path, in_memory=True):
+    # fans out over every segment of the index, see common/IndexReader.py; in_memory=False keeps
+    # the postings memory-mapped, shared through the page cache by every process serving them
+    return load_index(index_path, in_memory=in_memory, k1=K1, b=B)
+
+def open_document_stores(index_path):
+    document_store = open_segmented(index_path, lambda path: DocumentStore(path / 'documents'))
+    display_store = open_segmented(index_path, lambda path: DocumentStore(path / 'documents', store_file=DISPLAY_STORE_FILE, offsets_file=DISPLAY_OFFSETS_FILE))
+    metadata_store = open_segmented(index_path, lambda path: MetadataStore(path / 'metadata'))
+    return document_store, display_store, metadata_store
+
+def open_sentence_store(index_path):
+    # sentence and token offsets for snippets, None if a segment was written without them
+    try:
+        return open_segmented(index_path, lambda path: DocumentStore(path / 'documents', store_file=SENTENCES_STORE_FILE, offsets_file=SENTENCES_OFFSETS_FILE))
+    except FileNotFoundError:
+        return None
+
+def bm25_search(query_terms, lexicon, inverted_index, norms, num_docs, k=10, impacts=None):
+    # top k results, skipping the documents that cannot make them, see common/Scoring.py
+    if impacts is not None:
+        deadline = time.perf_counter() + DEADLINE_MS / 1000 if DEADLINE_MS is not None else None
+        return impact_top_k(query_terms, impacts, k, POSTINGS_BUDGET, deadline)
+    return block_max_top_k(query_terms, lexicon, inverted_index, norms, num_docs, k)
+
+def result_key(query_terms, impacts=None):
+    # result cache key of a query, with every parameter the ranking depends on
+    return query_key(query_terms, K1, B, impacts is not None, POSTINGS_BUDGET, DEADLINE_MS)
+
+def scoring_depth(depth):
+    # results scored for a query that needs the top depth: CACHE_DEPTH, doubled until it covers them
+    scored_depth = CACHE_DEPTH
+    while scored_depth < depth:
+        scored_depth *= 2
+    return scored_depth
+
+def cached_search(query_terms, cache, depth, lexicon, inverted_index, norms, num_docs, impacts=None):
+    # top depth results of the normalized query, from the cache when it has them
+    key = result_key(query_terms, impacts)
+    results = cache.get(key, depth)
+    if results is None:
+        scored_depth = scoring_depth(depth)
+        results = bm25_search(list(key[0]), lexicon, inverted_index, norms, num_docs, k=scored_depth, impacts=impacts)
+        cache.put(key, results, scored_depth)
+    return results
+
+def get_document_content(doc_id, display_store, metadata_store):
+    # headline, body text and date were sanitized and formatted at index time
+    docno = metadata_store.docno(doc_id)
     if not docno:
         return None, None, None, None
 
-    year, month, day = docno[6:8], docno[2:4], docno[4:6]
-    doc_path = index_path / 'documents' / year / month / day / f'{docno}.txt'
-    
-    with open(doc_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    headline_regex = '<HEADLINE>.*?<\/HEADLINE>'
-    headline = re.findall(headline_regex, content, re.DOTALL)
-
-    headline_text = 'NULL'
-    if headline:
-        h = headline[0].split(' ')
-        temp = []
-        for char in h:
-            if char not in ['<P>', '</P>', '<HEADLINE>', '</HEADLINE>']:
-                temp.append(char)
-        headline_text = ' '.join(temp)
-
-    text_regex = '<TEXT>.*?<\/TEXT>'
-    text = re.findall(text_regex, content, re.DOTALL)
-
-    text_content = 'NULL'
-    if text:
-        t = text[0].split(' ')
-        temp = []
-        for char in t:
-            if char not in ['<P>', '</P>', '<TEXT>', '</TEXT>']:
-                temp.append(char)
-        text_content = ' '.join(temp)
-
-    graphic_regex = '<GRAPHIC>.*?<\/GRAPHIC>'
-    graphic = re.findall(graphic_regex, content, re.DOTALL)
-
-    graphic_text = 'NULL'
-    if graphic:
-        g = graphic[0].split(' ')
-        temp = []
-        for char in g:
-            if char not in ['<P>', '</P>', '<GRAPHIC>', '</GRAPHIC>']:
-                temp.append(char)
-        graphic_text = ' '.join(temp)
-
-    full_text = []
-    if text_content != 'NULL':
-        full_text.append(text_content)
-    if graphic_text != 'NULL':
-        full_text.append(graphic_text)
-        
-    combined_text = ' '.join(full_text)
-    
-    date = datetime.strptime(f'19{year}{month}{day}', '%Y%m%d').strftime('%B %d, %Y')
-    
-    return headline_text, combined_text, date, docno
-
-def create_snippet(text, query_terms):
-
-    originals = []
-    curr_sentence = ""
-    
-    for char in text:
-        curr_sentence += char
-        if char in '.!?':
-            originals.append(curr_sentence.strip())
-            curr_sentence = ""
-            
-    if curr_sentence.strip():
-        originals.append(curr_sentence.strip())
-
-    sentences = [s.strip() for s in originals if s.strip()]
-    distinct_query_terms = set(query_terms)
-    max_heap = []
-
-    """
-    DA RULES
-    +2 points if its the first sentence, +1 if its the second, 0 otherwise
-    +n points for every matching word in the doc against the query, including repetitions
-    +n for number of distinct query terms that match some word in the doc
-    """
-
-    for i, sentence in enumerate(sentences):
-        l, c, d, k = 0, 0, 0, 0
-        tokenized_sentence = Tokenize(re.sub(r'[.!?]$', '', sentence))
-
-        if len(tokenized_sentence) < 5:
-            continue
-        
-        if i == 0:
-            l = 2
-        elif i == 1:
-            l = 1
-
-        curr_run = 0
-        max_run = 0
-        for token in tokenized_sentence:
-            if token in query_terms:
-                curr_run += 1
-                c += 1
-            else:
-                max_run = max(max_run, curr_run)
-                curr_run = 0
-        
-        max_run = max(max_run, curr_run)
-        k = max_run
-
-        for distinct_term in distinct_query_terms:
-            if distinct_term in tokenized_sentence:
-                d += 1
-
-        score = l+2*c+4*d+3*k
-        max_heap.append((-score, sentence))
-
-    heapq.heapify(max_heap)
-
-    if len(max_heap) >= 2:
-        summary = []
-        for _ in range(2):
-            _, sentence, = heapq.heappop(max_heap)
-            
-            if sentence.count('"') % 2 != 0:
-                sentence = sentence.replace('"', '')
-            
-            if sentence.count("'") % 2 != 0:
-                sentence = sentence.replace("'", '')
-                
-            summary.append(sentence)
-        
-        return ' '.join(summary)
-    
-    elif len(max_heap) == 1:
-        return heapq.heappop(max_heap)[1]
-    else:
-        return " "
-
-def sanitizer(text):
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'\s+([.,;!?])', r'\1', text)
-    return text.strip()
-
-def view_document(doc_id, index_path):
-    docno = None
-    with open(index_path / 'docno.txt', 'r') as f:
-        for i, line in enumerate(f):
-            if i == doc_id:
-                docno = line.strip()
-                break
-    
-    if not docno:
+    headline, date, text = parse_display_record(display_store.get(doc_id))
+    return headline, text, date, docno
+
+def create_snippet(text, query_terms, sentence_record=None):
+    # (snippet, matches): the two best sentences and where the query terms are in them, scored from
+    # the offsets recorded at index time when there are some, see common/Snippets.py
+    return make_snippet(text, query_terms, parse_sentence_record(sentence_record))
+
+def result_summary(doc_id, query_terms, display_store, metadata_store, sentence_store=None):
+    # (headline, date, docno, snippet, matches) of a result, the snippet stands in for a missing headline
+    headline, text, date, docno = get_document_content(doc_id, display_store, metadata_store)
+    sentence_record = sentence_store.get(doc_id) if sentence_store is not None else None
+    snippet, matches = create_snippet(text, query_terms, sentence_record)
+    if headline == 'NULL':
+        headline = snippet[:50] + "..."
+    return headline, date, docno, snippet, matches
+
+def highlight(snippet, matches):
+    # query terms in bold, on a terminal
+    if not sys.stdout.isatty():
+        return snippet
+    parts = []
+    pos = 0
+    for start, end in matches:
+        parts.extend((snippet[pos:start], BOLD, snippet[start:end], RESET))
+        pos = end
+    parts.append(snippet[pos:])
+    return ''.join(parts)
+
+def view_document(doc_id, document_store):
+    content = document_store.get(doc_id)
+    if content is None:
         return False
 
-    year, month, day = docno[6:8], docno[2:4], docno[4:6]
-    doc_path = index_path / 'documents' / year / month / day / f'{docno}.txt'
-    
-    with open(doc_path, 'r') as f:
-        content = f.read()
-        print("\n" + content + "\n")
+    print("\n" + content.decode('utf-8') + "\n")
     return True
 
+def load_search_data(index_path, in_memory=True):
+    # postings, impacts and stores of the index as it is now, with the generation they belong to
+    generation = read_manifest(index_path)['generation']
+    lexicon, inverted_index, norms, num_docs, _ = load_index_data(index_path, in_memory)
+    # None unless the index was built with --impacts and they are up to date
+    impacts = open_impact_index(index_path, K1, B)
+    document_store, display_store, metadata_store = open_document_stores(index_path)
+    sentence_store = open_sentence_store(index_path)
+    return generation, (lexicon, inverted_index, norms, num_docs, impacts), (document_store, display_store, metadata_store, sentence_store)
+
+def close_search_data(index, stores):
+    # every file and mapping load_search_data() opened
+    lexicon, inverted_index, _, _, impacts = index
+    close_lexicon(lexicon)
+    inverted_index.close()
+    if impacts is not None:
+        impacts.close()
+    for store in stores:
+        if store is not None:
+            store.close()
+
 def main():
     index_path = Path('/Users/campbellwang/index/')
     
     print("Loading search engine...")
-    lexicon, inverted_index, doc_lengths, num_docs, avg_doc_length = load_index_data(index_path)
+    generation, (lexicon, inverted_index, norms, num_docs, impacts), (document_store, display_store, metadata_store, sentence_store) = load_search_data(index_path)
+    cache = ResultCache()
+    cache.invalidate(generation)
     
     print("\nSearch engine ready!")
     print("Commands:")
     print("  - Enter your search query and press Enter")
-    print("  - Enter a number (1-10) to view a specific document")
+    print("  - Enter a result number to view a specific document")
+    print("  - Enter 'M' for more results")
     print("  - Enter 'N' for a new search")
     print("  - Enter 'Q' or Ctrl+C to quit")
     
     current_results = []
+    query_terms = None
+    page = 0
     
     while True:
         try:
             if not current_results:
-                print("Search Query:", end=" ")
-                query = input().strip()
-                
-                if not query:
-                    continue
+                if query_terms is None:
+                    print("Search Query:", end=" ")
+                    query = input().strip()
                     
-                query_terms = Tokenize(query)
-                
-                if not query_terms:
-                    continue
+                    if not query:
+                        continue
+                        
+                    query_terms = Tokenize(query)
+                    page = 0
+                    
+                    if not query_terms:
+                        query_terms = None
+                        continue
                 
                 print("\nSearching...\n", end="", flush=True)
                 start_time = time.time()
+
+                # DeleteDoc, appends and merges bump the generation, the cached results go with it
+                if read_manifest(index_path)['generation'] != cache.generation:
+                    print("Index changed, reloading...")
+                    close_search_data((lexicon, inverted_index, norms, num_docs, impacts), (document_store, display_store, metadata_store, sentence_store))
+                    generation, (lexicon, inverted_index, norms, num_docs, impacts), (document_store, display_store, metadata_store, sentence_store) = load_search_data(index_path)
+                    cache.invalidate(generation)
+
+                hits = cache.hits
+                results = cached_search(query_terms, cache, (page + 1) * PAGE_SIZE, lexicon, inverted_index, norms, num_docs, impacts=impacts)
+                cached = cache.hits > hits
+                page_results = results[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
                 
-                results = bm25_search(query_terms, lexicon, inverted_index, doc_lengths, num_docs, avg_doc_length)
-                
-                if not results:
+                if not page_results:
+                    if page:
+                        print("\nNo more results for your query")
+                        page -= 1
+                        current_results = page_doc_ids
+                        continue
                     print(f"\nNo results found for your query: {query}")
+                    query_terms = None
                     continue
                 
-                print(f"Found {len(results)} results:")
+                print(f"Results {page * PAGE_SIZE + 1}-{page * PAGE_SIZE + len(page_results)}:")
                 print("-"*80 + "\n")
                 
-                for rank, (doc_id, _) in enumerate(results, 1):
-                    headline, text, date, docno = get_document_content(doc_id, index_path)
-
-                    text = sanitizer(text)
-                    headline = sanitizer(headline)
-
+                for rank, (doc_id, _) in enumerate(page_results, page * PAGE_SIZE + 1):
+                    headline, date, docno, snippet, matches = result_summary(doc_id, query_terms, display_store, metadata_store, sentence_store)
                     current_results.append(doc_id)
-                    snippet = create_snippet(text, query_terms)
-                    
-                    if headline == 'NULL':
-                        headline = snippet[:50] + "..."
                     
                     print(f"{rank}. {headline} ({date})")
-                    print(f"{snippet} ({docno})\n")
+                    print(f"{highlight(snippet, matches)} ({docno})\n")
                 
                 end_time = time.time()
                 print("-"*80)
-                print(f"Retrieval took {end_time - start_time:.2f} seconds.")
+                print(f"Retrieval took {end_time - start_time:.2f} seconds{' (cached)' if cached else ''}.")
             
-            print(f"\nWhat would you like to do? (1-{len(current_results)}: view document, N: new search, Q: quit)")
+            first_rank = page * PAGE_SIZE + 1
+            last_rank = page * PAGE_SIZE + len(current_results)
+            print(f"\nWhat would you like to do? ({first_rank}-{last_rank}: view document, M: more results, N: new search, Q: quit)")
             print("Command:", end=" ")
             command = input().strip().upper()
             
             if command == 'Q':
+                print(f"\nResult cache: {cache.hits} hits, {cache.misses} misses ({cache.hit_rate():.0%} hit rate)")
                 print("\nExiting...\n")
                 break
             elif command == 'N':
                 current_results = []
+                query_terms = None
                 print("\n" + "-"*80 + "\n")
                 continue
+            elif command == 'M':
+                page_doc_ids = current_results
+                current_results = []
+                page += 1
+                continue
             else:
                 try:
                     rank = int(command)
-                    if 1 <= rank <= len(current_results):
-                        doc_id = current_results[rank-1]
-                        if not view_document(doc_id, index_path):
+                    if first_rank <= rank <= last_rank:
+                        doc_id = current_results[rank - first_rank]
+                        if not view_document(doc_id, document_store):
                             print("\nError: Could not display document.")
                     else:
-                        print("\nError: Please enter a valid rank number between 1 and", len(current_results))
+                        print(f"\nError: Please enter a valid rank number between {first_rank} and {last_rank}")
                 except ValueError:
-                    print("\nError: Please enter a number, 'N', or 'Q'")
+                    print("\nError: Please enter a number, 'M', 'N', or 'Q'")
                 
         except KeyboardInterrupt:
             print("\nExiting...\n")
             break
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,543 @@
+"""
+Long-running HTTP/JSON search service around the BM25 engine of SearchEngine.py.
+
+The index is loaded once and requests are answered on one asyncio event loop, standard library
+only:
+
+    GET /search?q=<query>[&page=<n>]   a page of results: rank, docno, headline, date, score,
+                                       snippet, and the [start, end] of every query term in it
+    GET /doc?docno=<docno>             the raw document, or /doc?id=<internal id>
+    GET /stats                         request counters and the result cache
+
+Scoring, snippets and document lookups run in a thread pool so the event loop keeps accepting and
+answering requests. The result cache (see common/ResultCache.py) is only touched from the event
+loop, and concurrent misses of the same query wait for one scoring. The manifest generation is
+checked at most once a second; a new one (DeleteDoc, an append, a merge) loads the index again in
+the background while the old one keeps serving, then drops the cache. Every generation counts the
+requests and pool jobs using it, and its files are closed once the last of them is done.
+
+Connections are HTTP/1.1 keep-alive, closed after KEEP_ALIVE_SECONDS without a request.
+
+Threads cannot score in parallel. With --workers N a supervisor opens the listening socket and
+forks N worker processes that accept on it, each with its own event loop, thread pool and result
+cache. A worker opens the index after the fork with the postings, lexicon and stores memory-mapped
+rather than decoded into Python objects, so the OS page cache holds one copy of the index for every
+worker. The supervisor loads nothing and restarts workers that die, after RESTART_DELAY_SECONDS
+when a worker did not last MIN_WORKER_SECONDS, e.g. on an index it cannot open.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from common.CommandLine import split_options
+from common.IndexReader import open_live_docs
+from common.ResultCache import ResultCache, CACHE_ENTRIES
+from common.Segments import read_manifest
+from common.SimpleTokenizer import Tokenize
+from SearchEngine import load_search_data, close_search_data, bm25_search, result_key, scoring_depth, result_summary, PAGE_SIZE
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_THREADS = 4
+
+# deepest page served, a query is never scored deeper than MAX_PAGES * PAGE_SIZE
+MAX_PAGES = 100
+RELOAD_CHECK_SECONDS = 1.0
+KEEP_ALIVE_SECONDS = 30
+
+RESTART_DELAY_SECONDS = 1.0
+MIN_WORKER_SECONDS = 5.0
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    410: 'Gone',
+    500: 'Internal Server Error',
+}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def load_service_data(index_path, in_memory=True):
+    # load_search_data() plus the live docs, /doc does not hand out deleted documents
+    generation, index, stores = load_search_data(index_path, in_memory)
+    return generation, index, stores, open_live_docs(index_path)
+
+def summarize(results, query_terms, stores, first_rank):
+    # JSON results of a page, runs in the pool
+    _, display_store, metadata_store, sentence_store = stores
+    hits = []
+    for rank, (doc_id, score) in enumerate(results, first_rank):
+        headline, date, docno, snippet, matches = result_summary(doc_id, query_terms, display_store, metadata_store, sentence_store)
+        hits.append({
+            'rank': rank,
+            'docno': docno,
+            'headline': headline,
+            'date': date,
+            'score': score,
+            'snippet': snippet,
+            'highlights': matches,
+        })
+    return hits
+
+def fetch_document(doc_id, docno, stores, live_docs):
+    # (internal id, docno, raw document) by internal id or docno, runs in the pool
+    document_store, _, metadata_store, _ = stores
+    if doc_id is None:
+        doc_id = metadata_store.doc_id(docno)
+        if doc_id is None:
+            raise HttpError(404, f'Docno {docno} does not exist')
+    elif doc_id not in metadata_store:
+        raise HttpError(404, f'Internal ID {doc_id} does not exist')
+
+    if not live_docs.is_live(doc_id):
+        raise HttpError(410, 'Document has been deleted from the index')
+    return doc_id, metadata_store.docno(doc_id), document_store.get(doc_id).decode('utf-8')
+
+def int_param(params, name, default):
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        raise HttpError(400, f'{name} expects a whole number')
+
+async def read_request(reader):
+    # (method, target, version, headers), or None once the client is done
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_SECONDS)
+    except asyncio.TimeoutError:
+        return None
+    if not request_line.strip():
+        return None
+
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise HttpError(400, 'Malformed request line')
+    method, target, version = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    # GET requests have no body, anything sent anyway is read past
+    length = headers.get('content-length')
+    if length:
+        await reader.readexactly(int(length))
+    return method, target, version, headers
+
+def encode_response(status, body, keep_alive):
+    payload = json.dumps(body).encode('utf-8')
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return head.encode('latin-1') + payload
+
+class LoadedIndex:
+    """
+    One generation of the index as the service serves it. Requests and pool jobs hold it with
+    acquire()/release(), on the event loop; once it is retired by a reload, the last release
+    closes its files.
+    """
+    def __init__(self, generation, index, stores, live_docs):
+        self.generation = generation
+        self.index = index
+        self.stores = stores
+        self.live_docs = live_docs
+        self.users = 0
+        self.retired = False
+
+    def acquire(self):
+        self.users += 1
+        return self
+
+    def release(self):
+        self.users -= 1
+        if self.retired and not self.users:
+            self.close()
+
+    def retire(self):
+        self.retired = True
+        if not self.users:
+            self.close()
+
+    def close(self):
+        close_search_data(self.index, self.stores)
+
+class SearchService:
+    def __init__(self, index_path, threads=DEFAULT_THREADS, cache_entries=CACHE_ENTRIES, in_memory=True):
+        self.index_path = Path(index_path)
+        self.threads = threads
+        self.in_memory = in_memory
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.cache = ResultCache(max_entries=cache_entries)
+
+        # the LoadedIndex requests are served from, swapped as a whole on reload
+        self.current = None
+        self.reload = None
+        self.next_check = 0
+
+        # (generation, cache key) -> (depth, future) of the scorings in flight
+        self.scoring = {}
+        self.requests = 0
+        self.errors = 0
+        self.routes = {
+            '/search': self.search,
+            '/doc': self.document,
+            '/stats': self.stats,
+        }
+
+    async def run_in_pool(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def submit(self, loaded, func, *args):
+        # a pool job on one generation, which stays open until the job is done even if the
+        # request waiting for it goes away
+        future = asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        loaded.acquire()
+        future.add_done_callback(lambda _: loaded.release())
+        return future
+
+    async def load(self):
+        old = self.current
+        self.current = LoadedIndex(*await self.run_in_pool(load_service_data, self.index_path, self.in_memory))
+        self.cache.invalidate(self.current.generation)
+        if old is not None:
+            old.retire()
+
+    async def reload_index(self):
+        try:
+            await self.load()
+            print(f"Reloaded the index at generation {self.current.generation}")
+        except Exception as e:
+            # e.g. a merge replacing segments under us, tried again at the next check
+            print(f"Could not reload the index: {e}")
+        finally:
+            self.reload = None
+
+    def check_generation(self):
+        # starts a reload in the background when the manifest has moved on
+        now = time.monotonic()
+        if now < self.next_check or self.reload is not None:
+            return
+        self.next_check = now + RELOAD_CHECK_SECONDS
+        if read_manifest(self.index_path)['generation'] != self.current.generation:
+            self.reload = asyncio.ensure_future(self.reload_index())
+
+    async def score(self, loaded, key, depth):
+        # top results of a query that missed the cache, shared with the requests asking for it meanwhile
+        generation = loaded.generation
+        pending = self.scoring.get((generation, key))
+        if pending is not None and pending[0] >= depth:
+            return await asyncio.shield(pending[1])
+
+        lexicon, inverted_index, norms, num_docs, impacts = loaded.index
+        scored_depth = scoring_depth(depth)
+        future = self.submit(
+            loaded, bm25_search, list(key[0]), lexicon, inverted_index, norms, num_docs, scored_depth, impacts)
+        self.scoring[(generation, key)] = (scored_depth, future)
+        try:
+            results = await asyncio.shield(future)
+        finally:
+            if self.scoring.get((generation, key), (None, None))[1] is future:
+                del self.scoring[(generation, key)]
+
+        # results of an index that was reloaded meanwhile are not cached
+        if generation == self.cache.generation:
+            self.cache.put(key, results, scored_depth)
+        return results
+
+    async def search(self, params):
+        query = params.get('q', '').strip()
+        if not query:
+            raise HttpError(400, 'Expected a query: /search?q=<query>')
+        page = int_param(params, 'page', 1)
+        if not 1 <= page <= MAX_PAGES:
+            raise HttpError(400, f'page expects a number between 1 and {MAX_PAGES}')
+
+        start_time = time.perf_counter()
+        self.check_generation()
+        loaded = self.current.acquire()
+        try:
+            query_terms = Tokenize(query)
+            depth = page * PAGE_SIZE
+            key = result_key(query_terms, loaded.index[4])
+            results = self.cache.get(key, depth)
+            cached = results is not None
+            if results is None:
+                results = await self.score(loaded, key, depth)
+
+            first = (page - 1) * PAGE_SIZE
+            hits = await self.submit(loaded, summarize, results[first:depth], query_terms, loaded.stores, first + 1)
+        finally:
+            loaded.release()
+        return {
+            'query': query,
+            'page': page,
+            'results': hits,
+            'cached': cached,
+            'took_ms': round((time.perf_counter() - start_time) * 1000, 3),
+        }
+
+    async def document(self, params):
+        if 'id' in params:
+            doc_id, docno = int_param(params, 'id', None), None
+        elif 'docno' in params:
+            doc_id, docno = None, params['docno'].strip()
+        else:
+            raise HttpError(400, 'Expected /doc?docno=<docno> or /doc?id=<internal id>')
+
+        self.check_generation()
+        loaded = self.current
+        doc_id, docno, document = await self.submit(loaded, fetch_document, doc_id, docno, loaded.stores, loaded.live_docs)
+        return {'id': doc_id, 'docno': docno, 'document': document}
+
+    async def stats(self, params):
+        return {
+            'pid': os.getpid(),
+            'generation': self.current.generation,
+            'threads': self.threads,
+            'requests': self.requests,
+            'errors': self.errors,
+            'cache': {
+                'entries': len(self.cache),
+                'hits': self.cache.hits,
+                'misses': self.cache.misses,
+                'hit_rate': self.cache.hit_rate(),
+                'evictions': self.cache.evictions,
+                'invalidations': self.cache.invalidations,
+            },
+        }
+
+    async def respond(self, method, target):
+        # (status, JSON body) of a request
+        self.requests += 1
+        try:
+            if method != 'GET':
+                raise HttpError(405, f'{method} is not supported, only GET')
+            url = urlsplit(target)
+            handler = self.routes.get(url.path)
+            if handler is None:
+                raise HttpError(404, f'No such endpoint {url.path}, expected /search, /doc or /stats')
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            return 200, await handler(params)
+        except HttpError as e:
+            return e.status, {'error': e.message}
+        except Exception as e:
+            self.errors += 1
+            print(f"Error answering {target}: {e!r}")
+            return 500, {'error': 'Internal server error'}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HttpError as e:
+                    writer.write(encode_response(e.status, {'error': e.message}, False))
+                    break
+                if request is None:
+                    break
+
+                method, target, version, headers = request
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+
+                status, body = await self.respond(method, target)
+                writer.write(encode_response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            # the client went away or sent something unreadable
+            pass
+        finally:
+            writer.close()
+
+async def serve(index_path, host, port, threads, cache_entries):
+    service = SearchService(index_path, threads, cache_entries)
+    print("Loading search engine...")
+    await service.load()
+
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    # port 0 picks a free one
+    port = server.sockets[0].getsockname()[1]
+    print(f"\nServing {index_path} on http://{host}:{port}/ with {threads} threads")
+    print_endpoints()
+    async with server:
+        await server.serve_forever()
+
+async def serve_socket(sock, index_path, threads, cache_entries):
+    # a worker: the index memory-mapped, answering on the supervisor's listening socket
+    service = SearchService(index_path, threads, cache_entries, in_memory=False)
+    await service.load()
+
+    server = await asyncio.start_server(service.handle_connection, sock=sock)
+    print(f"Worker {os.getpid()} ready", flush=True)
+    async with server:
+        await server.serve_forever()
+
+def print_endpoints():
+    print("  - GET /search?q=<query>[&page=<n>]")
+    print("  - GET /doc?docno=<docno> or /doc?id=<internal id>")
+    print("  - GET /stats")
+    print("Press Ctrl+C to quit", flush=True)
+
+def run_worker(sock, index_path, threads, cache_entries):
+    # in the forked child, never returns. Ctrl+C reaches the whole process group, the supervisor
+    # decides when workers stop and sends them SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    status = 0
+    try:
+        asyncio.run(serve_socket(sock, index_path, threads, cache_entries))
+    except BaseException as e:
+        print(f"Worker {os.getpid()} failed: {e!r}", flush=True)
+        status = 1
+    finally:
+        os._exit(status)
+
+def supervise(index_path, host, port, workers, threads, cache_entries):
+    # pre-forks workers sharing one listening socket and restarts the ones that die
+    sock = socket.create_server((host, port))
+    port = sock.getsockname()[1]
+    print(f"Serving {index_path} on http://{host}:{port}/ with {workers} workers of {threads} threads")
+    print_endpoints()
+
+    # pid -> when it was started
+    children = {}
+
+    def start_worker():
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            run_worker(sock, index_path, threads, cache_entries)
+        children[pid] = time.monotonic()
+
+    # SIGTERM stops the supervisor like Ctrl+C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for _ in range(workers):
+            start_worker()
+
+        while True:
+            pid, status = os.wait()
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting", flush=True)
+            # a worker that dies on startup is not restarted in a tight loop
+            if time.monotonic() - started < MIN_WORKER_SECONDS:
+                time.sleep(RESTART_DELAY_SECONDS)
+            start_worker()
+    except KeyboardInterrupt:
+        print("\nExiting...\n")
+    finally:
+        # a second Ctrl+C does not leave workers behind
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        sock.close()
+
+def main():
+    args, options = split_options(sys.argv[1:])
+    if len(args) != 1:
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Expected the index directory!
+
+                Usage: python src/SearchService.py <directory to index> [--host <address>] [--port <port>] [--threads <N>] [--cache-entries <N>] [--workers <N>]
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    index_path = Path(args[0])
+    if not index_path.is_dir():
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: Directory does not exist!
+
+                Choose a new directory path, or create the directory using IndexEngine.
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    host = options.get('host', DEFAULT_HOST)
+    try:
+        port = int(options.get('port', DEFAULT_PORT))
+        threads = int(options.get('threads', DEFAULT_THREADS))
+        cache_entries = int(options.get('cache-entries', CACHE_ENTRIES))
+        workers = int(options['workers']) if 'workers' in options else None
+    except ValueError:
+        port = threads = cache_entries = -1
+        workers = None
+    if not 0 <= port < 1 << 16 or threads < 1 or cache_entries < 0 or (workers is not None and workers < 1):
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: --port, --threads, --cache-entries and --workers expect whole numbers!
+
+                --threads and --workers have to be at least 1, --cache-entries 0 turns the result cache off.
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    if workers is not None:
+        if not hasattr(os, 'fork'):
+            print(
+                '''
+                # ------------------------------------------------------------------------------------------------
+
+                    Error: --workers needs os.fork, which this platform does not have!
+
+                # ------------------------------------------------------------------------------------------------
+                '''
+            )
+            return -1
+        supervise(index_path, host, port, workers, threads, cache_entries)
+        return
+
+    try:
+        asyncio.run(serve(index_path, host, port, threads, cache_entries))
+    except KeyboardInterrupt:
+        print("\nExiting...\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
 from collections import defaultdict
 from math import log2
+from pathlib import Path
 import sys
+import time
+from common.CommandLine import split_options
+
+TOPICS = set(str(i) for i in range(401, 451) if i not in {416, 423, 437, 444, 447})
+
+# postings budgets of the tradeoff curve, see common/ImpactFile.py
+BUDGETS = (1000, 3000, 10000, 30000, 100000)
 
 def load_qrels(qrels_path):
     # { 
@@ -112,7 +120,7 @@ def sort_results(lines):
     return [line[3] for line in parsed]
     
 def load_results(results_path):
-    topics = set(str(i) for i in range(401, 451) if i not in {416, 423, 437, 444, 447})
+    topics = TOPICS
     results = {topic: [] for topic in topics}
     
     try:
@@ -133,7 +141,117 @@ def load_results(results_path):
 
     return results
 
+def mean_scores(qrels, results):
+    metrics_sums = defaultdict(float)
+    for topic in TOPICS:
+        for metric, value in evaluate_topic(qrels, topic, results.get(topic, [])).items():
+            metrics_sums[metric] += value
+    return {metric: value / len(TOPICS) for metric, value in metrics_sums.items()}
+
+def tradeoff_curve(qrels, index_path, queries_path, budgets):
+    # effectiveness and latency of impact-ordered search per postings budget, next to exact BM25
+    from common.SimpleTokenizer import Tokenize
+    from common.IndexReader import load_index, open_segmented
+    from common.MetadataStore import MetadataStore
+    from common.CollectionStats import K1, B
+    from common.Scoring import bm25_top_k
+    from common.ImpactFile import open_impact_index, impact_top_k
+
+    impacts = open_impact_index(index_path, K1, B)
+    if impacts is None:
+        print(
+            '''
+            # ------------------------------------------------------------------------------------------------
+
+                Error: No up to date impact-ordered postings in the index!
+
+                Build the index with IndexEngine --impacts (or ConvertIndex --impacts) first.
+
+            # ------------------------------------------------------------------------------------------------
+            '''
+        )
+        return -1
+
+    lexicon, inverted_index, norms, num_docs, _ = load_index(index_path, in_memory=True, k1=K1, b=B)
+    metadata_store = open_segmented(index_path, lambda path: MetadataStore(path / 'metadata'))
+    queries = []
+    with open(queries_path, 'r') as f:
+        for idx, line in enumerate(f):
+            if idx % 2 == 0:
+                topic = line.strip()
+            else:
+                queries.append((topic, Tokenize(line.strip())))
+
+    def run(search):
+        # (topic -> docnos, postings scored per query, ms per query)
+        results = {}
+        stats = {'postings': 0}
+        elapsed = 0
+        for topic, query_terms in queries:
+            start = time.perf_counter()
+            ranking = search(query_terms, stats)
+            elapsed += time.perf_counter() - start
+            results[topic] = [metadata_store.docno(doc_id) for doc_id, _ in ranking]
+        return results, stats['postings'] / len(queries), elapsed / len(queries) * 1000
+
+    def exact(query_terms, stats):
+        for term in set(query_terms):
+            term_id = lexicon.get(term)
+            if term_id is not None:
+                stats['postings'] += inverted_index.df(term_id)
+        return bm25_top_k(query_terms, lexicon, inverted_index, norms, num_docs, 1000)
+
+    rows = [('BM25', *run(exact))]
+    for budget in list(budgets) + [None]:
+        rows.append((
+            budget if budget is not None else 'all',
+            *run(lambda query_terms, stats: impact_top_k(query_terms, impacts, 1000, budget, stats=stats)),
+        ))
+
+    print("\nEffectiveness/latency tradeoff (impact-ordered postings, top 1000):")
+    print("-" * 90)
+    print(f"{'Budget':>8} {'Postings':>10} {'ms/query':>10} {'AP':>10} {'P@10':>10} {'NDCG@10':>10} {'NDCG@1000':>10}")
+    print("-" * 90)
+    for budget, results, postings, latency in rows:
+        scores = mean_scores(qrels, results)
+        print(f"{budget:>8} {postings:>10,.0f} {latency:>10.2f} {scores['ap']:>10.3f} {scores['P_10']:>10.3f} {scores['ndcg_cut_10']:>10.3f} {scores['ndcg_cut_1000']:>10.3f}")
+
 def main():
+    args, options = split_options(sys.argv[1:])
+    if 'tradeoff' in options:
+        if len(args) != 1 or 'queries' not in options or options['tradeoff'] is True:
+            print(
+                '''
+                # ------------------------------------------------------------------------------------------------
+
+                    Error: Expected a qrels file, an index directory and a queries file!
+
+                    Usage: python src/TopicEvaluator.py <path to qrels file> --tradeoff <directory to index> --queries <path to queries file> [--budgets <N,N,...>]
+
+                # ------------------------------------------------------------------------------------------------
+                '''
+            )
+            return -1
+
+        budgets = BUDGETS
+        if 'budgets' in options:
+            try:
+                budgets = [int(budget) for budget in str(options['budgets']).split(',')]
+            except ValueError:
+                budgets = [0]
+            if min(budgets) < 1:
+                print(
+                    '''
+                    # ------------------------------------------------------------------------------------------------
+
+                        Error: --budgets expects comma separated positive whole numbers!
+
+                    # ------------------------------------------------------------------------------------------------
+                    '''
+                )
+                return -1
+
+        return tradeoff_curve(load_qrels(args[0]), Path(options['tradeoff']), options['queries'], budgets)
 
     if len(sys.argv) != 3:
         print(
@@ -143,6 +261,7 @@ def main():
                 Error: Expected exactly three arguments!
 
                 Usage: python src/TopicEvaluator.py <path to qrels file> <path to results file>
+                       python src/TopicEvaluator.py <path to qrels file> --tradeoff <directory to index> --queries <path to queries file> [--budgets <N,N,...>]
 
                 Sample: python src/TopicEvaluator.py LA-only.trec8-401.450.minus416-423-437-444-447.txt student1.results
 
@@ -0,0 +1,128 @@
+"""
+Collection statistics and BM25 length norms.
+
+BM25 needs N and the average document length, plus for every posting the length norm
+K1 * ((1 - B) + B * length / avg_doc_length) of its document. Instead of every query tool
+re-deriving them from doc-lengths.txt, they are computed whenever the searchable contents of the
+index change and stored at the root of the index:
+
+    collection-stats.json  {"generation", "num_docs", "total_length", "avg_doc_length", "k1", "b"}
+    norms.bin              header (magic, generation, number of ids), then one double per global internal id
+
+N and the lengths only count live documents (see common.LiveDocs). The files are only used while
+their generation matches the manifest (see common.Segments) and their K1/B are the ones asked for,
+otherwise load_collection_stats computes everything from doc-lengths.txt like before.
+"""
+from array import array
+from math import log
+from pathlib import Path
+import json
+import os
+import struct
+from common.LiveDocs import LiveDocs
+from common.Segments import read_manifest, manifest_lock, segment_path, read_lines
+
+STATS_FILE = 'collection-stats.json'
+NORMS_FILE = 'norms.bin'
+
+K1 = 1.2
+B = 0.75
+
+MAGIC = b'NORM'
+# magic, manifest generation, number of internal ids
+HEADER = struct.Struct('<4sQI')
+
+def bm25_idf(num_docs, df):
+    return log((num_docs - df + 0.5) / (df + 0.5))
+
+def length_norms(doc_lengths, avg_doc_length, k1=K1, b=B):
+    return array('d', (k1 * ((1 - b) + b * length / avg_doc_length) for length in doc_lengths))
+
+def compute_collection_stats(index_path, manifest):
+    # (doc lengths of every internal id, number of live documents, total length of the live documents)
+    index_path = Path(index_path)
+    segments = manifest['segments']
+    num_ids = sum(segment['num_docs'] for segment in segments)
+    doc_lengths = array('I', (int(line) for line in read_lines(index_path / 'doc-lengths.txt', num_ids)))
+
+    num_docs = 0
+    total_length = 0
+    base = 0
+    for segment in segments:
+        live_docs = LiveDocs.load(segment_path(index_path, segment['name']) / 'metadata', segment['num_docs'])
+        for doc_id in range(segment['num_docs']):
+            if live_docs.is_live(doc_id):
+                num_docs += 1
+                total_length += doc_lengths[base + doc_id]
+        base += segment['num_docs']
+    return doc_lengths, num_docs, total_length
+
+def read_stats_file(index_path):
+    path = Path(index_path) / STATS_FILE
+    if not path.is_file():
+        return None
+    with path.open('r') as f:
+        return json.load(f)
+
+def write_collection_stats(index_path, manifest, k1=K1, b=B):
+    # the caller holds the manifest lock, so the files match the manifest's generation
+    index_path = Path(index_path)
+    doc_lengths, num_docs, total_length = compute_collection_stats(index_path, manifest)
+    avg_doc_length = total_length / num_docs if num_docs else 0.0
+    norms = length_norms(doc_lengths, avg_doc_length, k1, b) if num_docs else array('d', [0.0] * len(doc_lengths))
+
+    # both written to temporary files and renamed, so readers never see half-written stats
+    tmp_path = index_path / (NORMS_FILE + '.tmp')
+    with tmp_path.open('wb') as f:
+        f.write(HEADER.pack(MAGIC, manifest['generation'], len(norms)))
+        f.write(norms.tobytes())
+    os.replace(tmp_path, index_path / NORMS_FILE)
+
+    stats = {
+        'generation': manifest['generation'],
+        'num_docs': num_docs,
+        'total_length': total_length,
+        'avg_doc_length': avg_doc_length,
+        'k1': k1,
+        'b': b,
+    }
+    tmp_path = index_path / (STATS_FILE + '.tmp')
+    with tmp_path.open('w') as f:
+        json.dump(stats, f, indent=2)
+    os.replace(tmp_path, index_path / STATS_FILE)
+
+def update_collection_stats(index_path, k1=None, b=None):
+    # recomputes the stats for the current manifest, K1/B default to what the index already uses
+    stats = read_stats_file(index_path) or {}
+    k1 = stats.get('k1', K1) if k1 is None else k1
+    b = stats.get('b', B) if b is None else b
+    with manifest_lock(index_path):
+        write_collection_stats(index_path, read_manifest(index_path), k1, b)
+
+def read_norms(index_path, generation, num_ids):
+    path = Path(index_path) / NORMS_FILE
+    if not path.is_file():
+        return None
+    with path.open('rb') as f:
+        data = f.read()
+    magic, norms_generation, norms_ids = HEADER.unpack_from(data)
+    if magic != MAGIC or norms_generation != generation or norms_ids != num_ids:
+        return None
+    norms = array('d')
+    norms.frombytes(data[HEADER.size:])
+    return norms
+
+def load_collection_stats(index_path, manifest, k1=K1, b=B):
+    # (length norms of every internal id, N, average doc length) for the manifest's generation
+    num_ids = sum(segment['num_docs'] for segment in manifest['segments'])
+    stats = read_stats_file(index_path)
+    if stats and stats['generation'] == manifest['generation'] and stats['k1'] == k1 and stats['b'] == b:
+        norms = read_norms(index_path, manifest['generation'], num_ids)
+        if norms is not None:
+            return norms, stats['num_docs'], stats['avg_doc_length']
+
+    # stale, missing or for other parameters
+    doc_lengths, num_docs, total_length = compute_collection_stats(index_path, manifest)
+    avg_doc_length = total_length / num_docs if num_docs else 0.0
+    norms = length_norms(doc_lengths, avg_doc_length, k1, b) if num_docs else array('d', [0.0] * len(doc_lengths))
+    return norms, num_docs, avg_doc_length
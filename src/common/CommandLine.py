@@ -0,0 +1,22 @@
+def split_options(args, flags=()):
+    # separates positional arguments from --name value options and --flag switches
+    # names listed in flags never take a value
+    positional = []
+    options = {}
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('--'):
+            name = arg[2:]
+            if name in flags or i + 1 >= len(args):
+                options[name] = True
+                i += 1
+            else:
+                options[name] = args[i + 1]
+                i += 2
+        else:
+            positional.append(arg)
+            i += 1
+
+    return positional, options
@@ -0,0 +1,31 @@
+"""
+Display fields for search result pages.
+
+The indexer stores one record per document holding the sanitized headline, the formatted date
+and the sanitized body text (TEXT followed by GRAPHIC), so rendering a result is a single lookup.
+A record is the three fields joined by newlines. Sanitized fields never contain newlines.
+"""
+import re
+
+DISPLAY_STORE_FILE = 'display.bin'
+DISPLAY_OFFSETS_FILE = 'display-offsets.bin'
+
+tag_regex = re.compile(r'<[^>]+>')
+whitespace_regex = re.compile(r'\s+')
+space_before_punctuation_regex = re.compile(r'\s+([.,;!?])')
+
+def sanitizer(text):
+    text = tag_regex.sub('', text)
+    text = whitespace_regex.sub(' ', text)
+    text = space_before_punctuation_regex.sub(r'\1', text)
+    return text.strip()
+
+def build_display_record(headline, graphic, text, date):
+    headline = sanitizer('NULL' if headline is None else headline)
+    body = sanitizer(' '.join(field for field in (text, graphic) if field is not None))
+    return f'{headline}\n{date}\n{body}'.encode('utf-8')
+
+def parse_display_record(record):
+    # returns (headline, date, body)
+    headline, date, body = bytes(record).decode('utf-8').split('\n', 2)
+    return headline, date, body
@@ -0,0 +1,52 @@
+"""
+Streaming <DOC> framer for the latimes .gz archive.
+
+The archive is decompressed in large chunks and split on <DOC> / </DOC> boundaries directly
+in bytes, so no per-line strings are created. Each document comes out as one bytes object
+together with its DOCNO.
+"""
+import gzip
+from pathlib import Path
+
+DOC_START = b'<DOC>'
+DOC_END = b'</DOC>'
+DOCNO_START = b'<DOCNO>'
+DOCNO_END = b'</DOCNO>'
+
+CHUNK_SIZE = 1 << 22
+
+def parse_docno(document):
+    start = document.find(DOCNO_START)
+    if start == -1:
+        return ''
+    start += len(DOCNO_START)
+    end = document.find(DOCNO_END, start)
+    if end == -1:
+        return ''
+    return document[start:end].strip().decode('ascii')
+
+def frame_documents(gz_path, chunk_size=CHUNK_SIZE):
+    # yields (docno, raw document bytes from <DOC> up to and including </DOC>)
+    leftover = b''
+
+    with gzip.open(Path(gz_path), 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+
+            data = leftover + chunk if leftover else chunk
+            pos = 0
+            while True:
+                end = data.find(DOC_END, pos)
+                if end == -1:
+                    break
+                end += len(DOC_END)
+
+                start = data.find(DOC_START, pos, end)
+                if start != -1:
+                    document = data[start:end]
+                    yield parse_docno(document), document
+                pos = end
+
+            leftover = data[pos:]
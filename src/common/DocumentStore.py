@@ -0,0 +1,160 @@
+"""
+Packed document store.
+
+Raw documents are appended to one blob file instead of being written as one .txt file each:
+
+    store.bin    documents back to back, optionally grouped into zlib-compressed blocks
+    offsets.bin  a small header followed by one fixed-width record per internal id:
+                 (block offset, block length, offset inside the block, document length)
+
+The same format also holds the pre-rendered display records (see common.DisplayFields),
+under different file names.
+
+Without compression every document is its own "block", so a lookup is a single slice of the
+memory-mapped blob. With compression, documents are packed into blocks of about block_size
+bytes before compressing, and the reader keeps a small LRU of decompressed blocks, behind a lock
+so threads can share a reader.
+"""
+from collections import OrderedDict
+from pathlib import Path
+import mmap
+import struct
+import threading
+import zlib
+import common.ErrorMessages
+
+STORE_FILE = 'store.bin'
+OFFSETS_FILE = 'offsets.bin'
+
+MAGIC = b'DOCS'
+FLAG_COMPRESSED = 1
+
+# magic, flags, block size
+HEADER = struct.Struct('<4sII')
+# block offset, block length, offset inside the decompressed block, document length
+RECORD = struct.Struct('<QIII')
+
+DEFAULT_BLOCK_SIZE = 1 << 16
+DEFAULT_CACHED_BLOCKS = 64
+
+class DocumentStoreWriter:
+    def __init__(self, store_path, compress=False, block_size=DEFAULT_BLOCK_SIZE, store_file=STORE_FILE, offsets_file=OFFSETS_FILE):
+        store_path = Path(store_path)
+        self.compress = compress
+        self.block_size = block_size
+
+        self.store_file = (store_path / store_file).open('wb')
+        self.offsets_file = (store_path / offsets_file).open('wb')
+        self.offsets_file.write(HEADER.pack(MAGIC, FLAG_COMPRESSED if compress else 0, block_size))
+
+        self.offset = 0
+        self.num_docs = 0
+        self.block = bytearray()
+        self.block_records = []
+
+    def add(self, document):
+        # appends a raw document and returns its internal id
+        doc_id = self.num_docs
+        self.num_docs += 1
+
+        if not self.compress:
+            self.store_file.write(document)
+            self.offsets_file.write(RECORD.pack(self.offset, len(document), 0, len(document)))
+            self.offset += len(document)
+            return doc_id
+
+        self.block_records.append((len(self.block), len(document)))
+        self.block += document
+        if len(self.block) >= self.block_size:
+            self.flush_block()
+        return doc_id
+
+    def flush_block(self):
+        if not self.block_records:
+            return
+
+        data = zlib.compress(bytes(self.block))
+        self.store_file.write(data)
+        for offset_in_block, length in self.block_records:
+            self.offsets_file.write(RECORD.pack(self.offset, len(data), offset_in_block, length))
+
+        self.offset += len(data)
+        self.block.clear()
+        self.block_records.clear()
+
+    def close(self):
+        self.flush_block()
+        self.store_file.close()
+        self.offsets_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class DocumentStore:
+    def __init__(self, store_path, cached_blocks=DEFAULT_CACHED_BLOCKS, store_file=STORE_FILE, offsets_file=OFFSETS_FILE):
+        store_path = Path(store_path)
+        blob_path = store_path / store_file
+        offsets_path = store_path / offsets_file
+
+        if not blob_path.is_file() or not offsets_path.is_file():
+            raise FileNotFoundError(common.ErrorMessages.metadata_file_not_found_at_path('Document store'))
+
+        with offsets_path.open('rb') as f:
+            self.offsets = f.read()
+
+        magic, flags, self.block_size = HEADER.unpack_from(self.offsets)
+        if magic != MAGIC:
+            raise ValueError(f'{offsets_path} is not a document store offset table')
+        self.compressed = bool(flags & FLAG_COMPRESSED)
+        self.num_docs = (len(self.offsets) - HEADER.size) // RECORD.size
+
+        self.file = blob_path.open('rb')
+        if blob_path.stat().st_size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+
+        self.cached_blocks = cached_blocks
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.num_docs
+
+    def block(self, block_offset, block_length):
+        # LRU of decompressed blocks, keyed by their offset in the blob
+        with self.lock:
+            block = self.blocks.get(block_offset)
+            if block is not None:
+                self.blocks.move_to_end(block_offset)
+                self.hits += 1
+                return block
+            self.misses += 1
+
+        block = zlib.decompress(self.data[block_offset:block_offset + block_length])
+        with self.lock:
+            self.blocks[block_offset] = block
+            if len(self.blocks) > self.cached_blocks:
+                self.blocks.popitem(last=False)
+        return block
+
+    def get(self, doc_id):
+        # raw document bytes for an internal id, or None if the id is out of range
+        if not 0 <= doc_id < self.num_docs:
+            return None
+
+        block_offset, block_length, offset_in_block, length = RECORD.unpack_from(self.offsets, HEADER.size + doc_id * RECORD.size)
+        if not self.compressed:
+            return self.data[block_offset:block_offset + length]
+
+        return self.block(block_offset, block_length)[offset_in_block:offset_in_block + length]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
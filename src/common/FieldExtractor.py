@@ -0,0 +1,38 @@
+"""
+Single-pass extraction of the indexed fields of a latimes document.
+
+One scan over the document finds the first <HEADLINE>, <GRAPHIC> and <TEXT> element,
+and the <P> / </P> paragraph tags inside each of them are dropped.
+"""
+import re
+
+FIELDS = ('HEADLINE', 'GRAPHIC', 'TEXT')
+PARAGRAPH_TAGS = {'<P>', '</P>'}
+
+open_tag_regex = re.compile(r'<(HEADLINE|GRAPHIC|TEXT)>')
+
+def strip_paragraph_tags(span):
+    return ' '.join(word for word in span.split() if word not in PARAGRAPH_TAGS)
+
+def extract_fields(document):
+    # returns (headline, graphic, text), with None for every field the document doesn't have
+    found = {}
+    pos = 0
+
+    while len(found) < len(FIELDS):
+        match = open_tag_regex.search(document, pos)
+        if not match:
+            break
+
+        field = match.group(1)
+        close_tag = f'</{field}>'
+        end = document.find(close_tag, match.end())
+        if end == -1:
+            pos = match.end()
+            continue
+
+        if field not in found:
+            found[field] = strip_paragraph_tags(document[match.end():end])
+        pos = end + len(close_tag)
+
+    return found.get('HEADLINE'), found.get('GRAPHIC'), found.get('TEXT')
@@ -0,0 +1,299 @@
+"""
+Impact-ordered postings for budgeted, score-at-a-time search.
+
+Every posting's BM25 contribution tf / (tf + norm) * idf is computed once, for the whole index
+(global internal ids, live documents, the K1/B of collection-stats.json), and quantized to an
+integer impact between 1 and 2 ** IMPACT_BITS - 1. Contributions that are not positive are
+dropped, a term with a negative IDF can only lower a score. A term's postings are grouped by
+impact, highest first, and stored in the impacts/ directory at the root of the index:
+
+    impacts.json              {"generation", "k1", "b", "bits", "scale", "num_docs"}
+    lexicon.bin               term -> term id of this directory (see common.LexiconFile)
+    impacts.bin               per term: (impact, number of docs, byte length, doc id gaps) segments
+    impacts-directory.bin     one (offset, length) record per term id
+
+A query takes the segments of all its terms, highest impact first, and adds each segment's impact
+to the documents in it, until a postings budget or a deadline runs out. With no limit the ranking
+is BM25 up to the quantization; scores are handed back as impact sums times scale, the
+contribution of one impact level.
+
+The directory belongs to one manifest generation, query tools only use it while it is fresh
+(open_impact_index). Every impact depends on N and the average doc length, so any change to the
+index leaves all of it stale. DeleteDoc and --append do not rebuild it: the MergeEngine they start
+in the background calls update_impact_index once nothing is left to merge, which rebuilds it once
+for the whole batch of changes, outside the manifest lock.
+"""
+from array import array
+from pathlib import Path
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+from common.PostingsFile import encode_vbyte
+from common.LexiconFile import LexiconFile, write_lexicon, read_vbyte_at
+from common.CollectionStats import bm25_idf, read_stats_file, K1, B
+from common.IndexReader import load_index, open_lexicon
+from common.Segments import read_manifest, manifest_lock, segment_path
+from common.Scoring import top_k
+
+IMPACTS_DIR = 'impacts'
+IMPACTS_INFO_FILE = 'impacts.json'
+IMPACTS_FILE = 'impacts.bin'
+IMPACTS_DIRECTORY_FILE = 'impacts-directory.bin'
+
+IMPACT_BITS = 8
+
+# offset into impacts.bin, encoded length in bytes
+DIRECTORY_RECORD = struct.Struct('<QI')
+
+def quantize(contribution, scale):
+    return max(1, int(contribution / scale + 0.5))
+
+def encode_segments(doc_impacts, out):
+    # (doc id, impact) pairs in doc id order, written as segments of decreasing impact
+    segments = {}
+    for doc_id, impact in doc_impacts:
+        segments.setdefault(impact, []).append(doc_id)
+
+    for impact in sorted(segments, reverse=True):
+        gaps = bytearray()
+        prev_doc = 0
+        for doc_id in segments[impact]:
+            encode_vbyte(doc_id - prev_doc, gaps)
+            prev_doc = doc_id
+        encode_vbyte(impact, out)
+        encode_vbyte(len(segments[impact]), out)
+        encode_vbyte(len(gaps), out)
+        out += gaps
+
+def decode_gaps(data):
+    doc_ids = array('I')
+    value = 0
+    shift = 0
+    doc_id = 0
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            continue
+        doc_id += value | byte << shift
+        doc_ids.append(doc_id)
+        value = 0
+        shift = 0
+    return doc_ids
+
+def index_terms(index_path, manifest):
+    # every term of every segment, in the order they first appear
+    terms = {}
+    for segment in manifest['segments']:
+        lexicon = open_lexicon(segment_path(index_path, segment['name']) / 'metadata')
+        for term in lexicon:
+            terms.setdefault(term, None)
+        if isinstance(lexicon, LexiconFile):
+            lexicon.close()
+    return terms
+
+def term_contributions(terms, lexicon, inverted_index, norms, num_docs):
+    # (term, doc ids, BM25 contributions) of every term that can raise a score
+    for term in terms:
+        entry = lexicon.lookup(term)
+        posting = None if entry is None else inverted_index.postings(entry[0])
+        if not posting:
+            continue
+        doc_ids, tfs = posting
+        idf = entry[1]
+        if idf is None:
+            idf = bm25_idf(num_docs, len(doc_ids))
+        if idf > 0:
+            yield term, doc_ids, [fi / (norms[doc_id] + fi) * idf for doc_id, fi in zip(doc_ids, tfs)]
+
+def write_impact_index(index_path, bits=IMPACT_BITS):
+    # built without the manifest lock, False if the index changed meanwhile and nothing was swapped in
+    index_path = Path(index_path)
+    manifest = read_manifest(index_path)
+    stats = read_stats_file(index_path) or {}
+    k1, b = stats.get('k1', K1), stats.get('b', B)
+    lexicon, inverted_index, norms, num_docs, _ = load_index(index_path, in_memory=True, k1=k1, b=b)
+    terms = index_terms(index_path, manifest)
+
+    # two passes, the scale needs the largest contribution before anything is quantized
+    print("Computing impacts...")
+    max_contribution = 0
+    for _, _, contributions in term_contributions(terms, lexicon, inverted_index, norms, num_docs):
+        max_contribution = max(max_contribution, max(contributions))
+    scale = max_contribution / (2 ** bits - 1) if max_contribution else 1.0
+
+    # written next to the live directory and swapped in, searches fall back to exact BM25 while
+    # the directory is missing
+    print("Writing impacts...")
+    tmp_path = index_path / (IMPACTS_DIR + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir()
+
+    impact_terms = {}
+    dfs = []
+    directory = bytearray()
+    offset = 0
+    with (tmp_path / IMPACTS_FILE).open('wb') as f:
+        for term, doc_ids, contributions in term_contributions(terms, lexicon, inverted_index, norms, num_docs):
+            doc_impacts = [
+                (doc_id, quantize(contribution, scale))
+                for doc_id, contribution in zip(doc_ids, contributions) if contribution > 0
+            ]
+            if not doc_impacts:
+                continue
+
+            data = bytearray()
+            encode_segments(doc_impacts, data)
+            f.write(data)
+            directory += DIRECTORY_RECORD.pack(offset, len(data))
+            offset += len(data)
+            impact_terms[term] = len(impact_terms)
+            dfs.append(len(doc_ids))
+    inverted_index.close()
+    with (tmp_path / IMPACTS_DIRECTORY_FILE).open('wb') as f:
+        f.write(directory)
+    write_lexicon(tmp_path, impact_terms, num_docs, dfs)
+
+    info = {
+        'generation': manifest['generation'],
+        'k1': k1,
+        'b': b,
+        'bits': bits,
+        'scale': scale,
+        'num_docs': num_docs,
+    }
+    with (tmp_path / IMPACTS_INFO_FILE).open('w') as f:
+        json.dump(info, f, indent=2)
+
+    # the lock is only held to check the generation and swap the directories
+    with manifest_lock(index_path):
+        if read_manifest(index_path)['generation'] != manifest['generation']:
+            shutil.rmtree(tmp_path)
+            return False
+        impacts_path = index_path / IMPACTS_DIR
+        if impacts_path.exists():
+            shutil.rmtree(impacts_path)
+        os.replace(tmp_path, impacts_path)
+    return True
+
+def is_fresh(info, index_path):
+    stats = read_stats_file(index_path) or {}
+    return (
+        info['generation'] == read_manifest(index_path)['generation']
+        and info['k1'] == stats.get('k1', K1) and info['b'] == stats.get('b', B)
+    )
+
+def update_impact_index(index_path, bits=None):
+    # rebuilds a stale impacts/; indexes without one only get it if bits is given.
+    # False if the index changed during the rebuild, the caller can try again
+    index_path = Path(index_path)
+    info = read_impacts_info(index_path)
+    if bits is None:
+        if info is None:
+            return True
+        bits = info['bits']
+    if info is not None and info['bits'] == bits and is_fresh(info, index_path):
+        return True
+    return write_impact_index(index_path, bits)
+
+def read_impacts_info(index_path):
+    path = Path(index_path) / IMPACTS_DIR / IMPACTS_INFO_FILE
+    if not path.is_file():
+        return None
+    with path.open('r') as f:
+        return json.load(f)
+
+class ImpactIndex:
+    """
+    Read-only, memory-mapped view over impacts/. segments(term) lists a term's
+    (impact, number of docs, start, end) segments without decoding them, doc_ids() decodes one.
+    """
+    def __init__(self, index_path):
+        path = Path(index_path) / IMPACTS_DIR
+        self.info = read_impacts_info(index_path)
+        self.scale = self.info['scale']
+        self.lexicon = LexiconFile(path)
+
+        self.directory_file = (path / IMPACTS_DIRECTORY_FILE).open('rb')
+        self.file = (path / IMPACTS_FILE).open('rb')
+        self.directory = self.map(self.directory_file)
+        self.data = self.map(self.file)
+
+    @staticmethod
+    def map(file):
+        if not os.fstat(file.fileno()).st_size:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def segments(self, term):
+        term_id = self.lexicon.get(term)
+        if term_id is None:
+            return []
+
+        offset, length = DIRECTORY_RECORD.unpack_from(self.directory, term_id * DIRECTORY_RECORD.size)
+        segments = []
+        pos = offset
+        while pos < offset + length:
+            impact, pos = read_vbyte_at(self.data, pos)
+            count, pos = read_vbyte_at(self.data, pos)
+            size, pos = read_vbyte_at(self.data, pos)
+            segments.append((impact, count, pos, pos + size))
+            pos += size
+        return segments
+
+    def doc_ids(self, start, end):
+        return decode_gaps(self.data[start:end])
+
+    def close(self):
+        for data in (self.data, self.directory):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self.file.close()
+        self.directory_file.close()
+        self.lexicon.close()
+
+def open_impact_index(index_path, k1, b):
+    # the impact index if it was built for the current manifest and these K1/B, otherwise None
+    info = read_impacts_info(index_path)
+    if info is None or info['k1'] != k1 or info['b'] != b:
+        return None
+    if info['generation'] != read_manifest(index_path)['generation']:
+        return None
+    return ImpactIndex(index_path)
+
+def impact_top_k(query_terms, impacts, k, budget=None, deadline=None, stats=None):
+    """
+    Top k (internal id, score) pairs, adding up the highest impacts first.
+
+    Stops once budget postings have been scored, or at deadline (a time.perf_counter() value),
+    checked between segments. stats, if given, counts the postings scored in stats['postings'].
+    """
+    segments = []
+    for term in set(query_terms):
+        segments.extend(impacts.segments(term))
+    # highest impacts first, the longest segments go last among equal impacts
+    segments.sort(key=lambda segment: (-segment[0], segment[1]))
+
+    scores = {}
+    get = scores.get
+    evaluated = 0
+    for impact, count, start, end in segments:
+        if budget is not None and evaluated >= budget:
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+        doc_ids = impacts.doc_ids(start, end)
+        if budget is not None and count > budget - evaluated:
+            doc_ids = doc_ids[:budget - evaluated]
+        for doc_id in doc_ids:
+            scores[doc_id] = get(doc_id, 0) + impact
+        evaluated += len(doc_ids)
+
+    if stats is not None:
+        stats['postings'] = stats.get('postings', 0) + evaluated
+    return [(doc_id, score * impacts.scale) for doc_id, score in top_k(scores, k)]
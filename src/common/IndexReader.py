@@ -0,0 +1,318 @@
+"""
+Loads an index for searching, whatever number of segments it has (see common.Segments).
+
+A single-segment index is returned as is: the memory-mapped lexicon (see common.LexiconFile) and
+its postings. With several segments the query tools get views that fan out over every segment and
+look the same as a single index built from scratch over all the archives: global term ids handed
+out as terms are looked up, postings with global internal ids, and collection statistics (N, average doc length, df) over every segment.
+
+Postings are handed out as (doc ids, term frequencies) typed arrays by postings(term_id).
+lexicon.lookup(term) gives (term id, idf), where the idf is None when the stored one does not hold
+for the whole index. Instead of doc lengths the query tools get the BM25 length norm of every
+internal id as an array('d') (see common.CollectionStats).
+
+Deleted documents (see common.LiveDocs) are dropped from the postings as they are read, and N and
+the average doc length only count live documents. norms still has an entry for every internal id,
+so it is the size to use for per-document arrays.
+"""
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+import json
+import threading
+import common.ErrorMessages
+from common.LexiconFile import LexiconFile, LEXICON_FILE
+from common.PostingsFile import PostingsReader, PostingsArrays
+from common.LiveDocs import LiveDocs, LivePostings
+from common.CollectionStats import load_collection_stats, K1, B
+from common.Segments import read_manifest, segment_path, segment_bases
+
+def read_doc_lengths(path, num_docs):
+    # the root doc-lengths.txt covers every segment, a segment only owns its first num_docs lines
+    doc_lengths = []
+    with open(path, 'r') as f:
+        for line in f:
+            if len(doc_lengths) == num_docs:
+                break
+            doc_lengths.append(int(line.strip()))
+    return doc_lengths
+
+def open_lexicon(metadata_path):
+    # memory-mapped lexicon.bin, or the lexicon.json dict of indexes built before it
+    metadata_path = Path(metadata_path)
+    if (metadata_path / LEXICON_FILE).is_file():
+        return LexiconFile(metadata_path)
+
+    json_path = metadata_path / 'lexicon.json'
+    if not json_path.is_file():
+        raise FileNotFoundError(common.ErrorMessages.metadata_file_not_found_at_path('Lexicon'))
+    with open(json_path, 'r') as f:
+        return json.load(f)
+
+def read_lexicon(metadata_path):
+    # the whole lexicon as a term -> term id dict in term id order, for MergeEngine
+    lexicon = open_lexicon(metadata_path)
+    if isinstance(lexicon, LexiconFile):
+        terms = dict(lexicon.items())
+        lexicon.close()
+        return terms
+    return lexicon
+
+def close_lexicon(lexicon):
+    # lexicon.json dicts have nothing to close
+    if hasattr(lexicon, 'close'):
+        lexicon.close()
+
+class SegmentedLexicon:
+    """
+    term -> global term id. The segment lexicons are not merged up front: a term gets the next
+    global id the first time it is looked up and is found in any segment. Ids are handed out under
+    a lock, so the threads of SearchService can share it.
+    """
+    def __init__(self, lexicons):
+        self.lexicons = lexicons
+        self.ids = {}
+        self.terms = []
+        self.lock = threading.Lock()
+
+    def get(self, term, default=None):
+        term_id = self.ids.get(term)
+        if term_id is None:
+            if not any(term in lexicon for lexicon in self.lexicons):
+                return default
+            with self.lock:
+                term_id = self.ids.get(term)
+                if term_id is None:
+                    term_id = self.ids[term] = len(self.terms)
+                    self.terms.append(term)
+        return term_id
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __getitem__(self, term):
+        term_id = self.get(term)
+        if term_id is None:
+            raise KeyError(term)
+        return term_id
+
+    def close(self):
+        for lexicon in self.lexicons:
+            close_lexicon(lexicon)
+
+class ComputedIdfLexicon:
+    """
+    A lexicon whose stored IDFs do not hold for the whole index: a lexicon.json, several segments,
+    or deleted documents. lookup() gives None for the IDF, the scoring code then computes it from
+    the live document frequency.
+    """
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+
+    def get(self, term, default=None):
+        return self.lexicon.get(term, default)
+
+    def __contains__(self, term):
+        return term in self.lexicon
+
+    def __getitem__(self, term):
+        return self.lexicon[term]
+
+    def lookup(self, term):
+        term_id = self.lexicon.get(term)
+        return None if term_id is None else (term_id, None)
+
+    def close(self):
+        close_lexicon(self.lexicon)
+
+class SegmentedPostings:
+    # postings of a global term id, concatenated over the segments with global internal ids
+    def __init__(self, terms, lexicons, readers, bases):
+        self.terms = terms
+        self.segments = list(zip(lexicons, readers, bases))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term_id):
+        return 0 <= int(term_id) < len(self.terms)
+
+    def __getitem__(self, term_id):
+        if term_id not in self:
+            raise KeyError(term_id)
+
+        term = self.terms[int(term_id)]
+        postings = []
+        for lexicon, reader, base in self.segments:
+            local_id = lexicon.get(term)
+            if local_id is None:
+                continue
+
+            segment_postings = reader[local_id]
+            if base:
+                for i in range(0, len(segment_postings), 2):
+                    segment_postings[i] += base
+            postings.extend(segment_postings)
+        return postings
+
+    def get(self, term_id, default=None):
+        try:
+            return self[term_id]
+        except (KeyError, ValueError):
+            return default
+
+    def postings(self, term_id):
+        # (doc ids, term frequencies) typed arrays over every segment, or None
+        if term_id not in self:
+            return None
+
+        term = self.terms[int(term_id)]
+        doc_ids = array('I')
+        tfs = array('I')
+        for lexicon, reader, base in self.segments:
+            local_id = lexicon.get(term)
+            postings = None if local_id is None else reader.postings(local_id)
+            if postings is None:
+                continue
+
+            segment_doc_ids, segment_tfs = postings
+            if base:
+                doc_ids.extend(doc_id + base for doc_id in segment_doc_ids)
+            else:
+                doc_ids.extend(segment_doc_ids)
+            tfs.extend(segment_tfs)
+        return (doc_ids, tfs) if doc_ids else None
+
+    def blocks(self, term_id):
+        # block maxima over every segment with global internal ids, None if a segment has none
+        if term_id not in self:
+            return None
+
+        term = self.terms[int(term_id)]
+        last_docs = array('I')
+        max_tfs = array('I')
+        shortest_docs = array('I')
+        for lexicon, reader, base in self.segments:
+            local_id = lexicon.get(term)
+            if local_id is None:
+                continue
+            blocks = reader.blocks(local_id)
+            if blocks is None:
+                return None
+
+            segment_last_docs, segment_max_tfs, segment_shortest_docs = blocks
+            last_docs.extend(doc_id + base for doc_id in segment_last_docs)
+            max_tfs.extend(segment_max_tfs)
+            shortest_docs.extend(doc_id + base for doc_id in segment_shortest_docs)
+        return (last_docs, max_tfs, shortest_docs) if last_docs else None
+
+    def df(self, term_id):
+        if term_id not in self:
+            raise KeyError(term_id)
+
+        term = self.terms[int(term_id)]
+        df = 0
+        for lexicon, reader, _ in self.segments:
+            local_id = lexicon.get(term)
+            if local_id is not None:
+                df += reader.df(local_id)
+        return df
+
+    def close(self):
+        for _, reader, _ in self.segments:
+            reader.close()
+
+class SegmentedStore:
+    """
+    Wraps one per-segment store (DocumentStore, MetadataStore, ...) per segment behind global
+    internal ids. Any method taking an internal id as its first argument is forwarded to the
+    owning segment; ids outside every segment give None.
+    """
+    def __init__(self, stores, bases, sizes):
+        self.stores = stores
+        self.bases = bases
+        self.sizes = sizes
+        self.num_docs = sum(sizes)
+
+    def __len__(self):
+        return self.num_docs
+
+    def __contains__(self, doc_id):
+        return 0 <= doc_id < self.num_docs
+
+    def locate(self, doc_id):
+        i = bisect_right(self.bases, doc_id) - 1
+        if i < 0 or doc_id >= self.bases[i] + self.sizes[i]:
+            return None, None
+        return self.stores[i], doc_id - self.bases[i]
+
+    def doc_ids(self, docno):
+        # reverse docno lookup of MetadataStore, global internal ids in id order
+        return [base + local_id for store, base in zip(self.stores, self.bases) for local_id in store.doc_ids(docno)]
+
+    def doc_id(self, docno):
+        # the latest document with the docno, an appended segment replaces older versions
+        doc_ids = self.doc_ids(docno)
+        return doc_ids[-1] if doc_ids else None
+
+    def close(self):
+        for store in self.stores:
+            store.close()
+
+    def __getattr__(self, name):
+        def forward(doc_id, *args):
+            store, local_id = self.locate(doc_id)
+            if store is None:
+                return None
+            return getattr(store, name)(local_id, *args)
+        return forward
+
+def open_segmented(index_path, opener):
+    # opener(segment path) opens one segment's store, e.g. lambda path: DocumentStore(path / 'documents')
+    segments = read_manifest(index_path)['segments']
+    if len(segments) == 1:
+        return opener(segment_path(index_path, segments[0]['name']))
+
+    stores = [opener(segment_path(index_path, segment['name'])) for segment in segments]
+    return SegmentedStore(stores, segment_bases(segments), [segment['num_docs'] for segment in segments])
+
+def open_live_docs(index_path):
+    # live-docs bitmaps of every segment behind global internal ids
+    segments = read_manifest(index_path)['segments']
+    live_docs = [LiveDocs.load(segment_path(index_path, segment['name']) / 'metadata', segment['num_docs']) for segment in segments]
+    if len(segments) == 1:
+        return live_docs[0]
+    return SegmentedStore(live_docs, segment_bases(segments), [segment['num_docs'] for segment in segments])
+
+def load_index(index_path, in_memory=False, k1=K1, b=B):
+    # in_memory decodes every postings list up front into typed arrays (PostingsArrays),
+    # otherwise they are decoded from the memory-mapped file per lookup
+    manifest = read_manifest(index_path)
+    segments = manifest['segments']
+    paths = [segment_path(index_path, segment['name']) for segment in segments]
+    segment_live_docs = [LiveDocs.load(path / 'metadata', segment['num_docs']) for path, segment in zip(paths, segments)]
+
+    print("Loading lexicon...")
+    lexicons = [open_lexicon(path / 'metadata') for path in paths]
+
+    print("Loading inverted index...")
+    readers = []
+    for path, live_docs in zip(paths, segment_live_docs):
+        reader = PostingsArrays(path / 'metadata') if in_memory else PostingsReader(path / 'metadata')
+        if live_docs.num_deleted:
+            reader = LivePostings(reader, live_docs)
+        readers.append(reader)
+
+    print("Loading collection statistics...")
+    norms, num_docs, avg_doc_length = load_collection_stats(index_path, manifest, k1, b)
+
+    if len(segments) == 1:
+        lexicon = lexicons[0]
+        # the IDFs stored in lexicon.bin are exact as long as the segment is the whole, undeleted index
+        if not isinstance(lexicon, LexiconFile) or segment_live_docs[0].num_deleted:
+            lexicon = ComputedIdfLexicon(lexicon)
+        return lexicon, readers[0], norms, num_docs, avg_doc_length
+
+    lexicon = SegmentedLexicon(lexicons)
+    inverted_index = SegmentedPostings(lexicon.terms, lexicons, readers, segment_bases(segments))
+    return ComputedIdfLexicon(lexicon), inverted_index, norms, num_docs, avg_doc_length
@@ -0,0 +1,174 @@
+"""
+On-disk lexicon.
+
+metadata/lexicon.bin maps a term to its term id and BM25 IDF without loading the vocabulary. Terms
+are sorted by their UTF-8 bytes and front-coded in blocks of BLOCK_SIZE: the first term of a block
+is stored in full, every other term as the length of the prefix it shares with the term before it
+plus the rest.
+
+    header         magic, number of terms, number of blocks
+    block offsets  one <Q per block, relative to the first block
+    blocks         (shared prefix length, suffix length, suffix bytes, term id, idf) entries
+
+The integers are variable-byte encoded like the postings. The IDF is a <d computed from the
+segment's own N and df when the lexicon is written (see common.CollectionStats). A lookup binary
+searches the first terms of the blocks and scans a single block. The file is memory-mapped, so
+opening it reads nothing and a query only touches the pages of the blocks it searches. The term id
+indexes the postings directory (see common.PostingsFile), which holds the df and the location of
+the postings.
+"""
+from pathlib import Path
+import mmap
+import os
+import struct
+import common.ErrorMessages
+from common.PostingsFile import PostingsReader, encode_vbyte
+from common.CollectionStats import bm25_idf
+
+LEXICON_FILE = 'lexicon.bin'
+
+BLOCK_SIZE = 16
+
+MAGIC = b'LEXI'
+# magic, number of terms, number of blocks
+HEADER = struct.Struct('<4sII')
+BLOCK_OFFSET = struct.Struct('<Q')
+IDF = struct.Struct('<d')
+
+def write_lexicon(metadata_path, lexicon, num_docs, dfs=None):
+    # lexicon: term -> term id; without dfs (term id -> df) the postings are already written
+    # and give each term's df
+    reader = PostingsReader(metadata_path) if dfs is None else None
+    df = reader.df if reader is not None else dfs.__getitem__
+    entries = sorted(
+        (term.encode('utf-8'), term_id, bm25_idf(num_docs, df(term_id)))
+        for term, term_id in lexicon.items()
+    )
+    if reader is not None:
+        reader.close()
+
+    offsets = bytearray()
+    blocks = bytearray()
+    prev_term = b''
+    for i, (term, term_id, idf) in enumerate(entries):
+        if i % BLOCK_SIZE == 0:
+            offsets += BLOCK_OFFSET.pack(len(blocks))
+            prefix = 0
+        else:
+            prefix = len(os.path.commonprefix((prev_term, term)))
+        encode_vbyte(prefix, blocks)
+        encode_vbyte(len(term) - prefix, blocks)
+        blocks += term[prefix:]
+        encode_vbyte(term_id, blocks)
+        blocks += IDF.pack(idf)
+        prev_term = term
+
+    with (Path(metadata_path) / LEXICON_FILE).open('wb') as f:
+        f.write(HEADER.pack(MAGIC, len(entries), len(offsets) // BLOCK_OFFSET.size))
+        f.write(offsets)
+        f.write(blocks)
+
+def read_vbyte_at(data, pos):
+    # (value, position after it)
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+class LexiconFile:
+    """
+    Read-only, memory-mapped view over lexicon.bin with the lookups the query tools use on the
+    JSON lexicon dict: get(), [] and in. Iterating gives the terms in term id order, like the dict.
+    lookup() also returns the stored IDF.
+    """
+    def __init__(self, metadata_path):
+        path = Path(metadata_path) / LEXICON_FILE
+        if not path.is_file():
+            raise FileNotFoundError(common.ErrorMessages.metadata_file_not_found_at_path('Lexicon'))
+
+        self.file = path.open('rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_terms, self.num_blocks = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a lexicon file')
+        self.blocks_start = HEADER.size + self.num_blocks * BLOCK_OFFSET.size
+
+    def __len__(self):
+        return self.num_terms
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __getitem__(self, term):
+        term_id = self.get(term)
+        if term_id is None:
+            raise KeyError(term)
+        return term_id
+
+    def block_start(self, block):
+        return self.blocks_start + BLOCK_OFFSET.unpack_from(self.data, HEADER.size + block * BLOCK_OFFSET.size)[0]
+
+    def first_term(self, block):
+        # the first entry of a block shares no prefix
+        pos = self.block_start(block) + 1
+        length, pos = read_vbyte_at(self.data, pos)
+        return self.data[pos:pos + length]
+
+    def block_entries(self, block):
+        # (term bytes, term id, idf) of every entry in the block, in sorted order
+        data = self.data
+        pos = self.block_start(block)
+        term = b''
+        for _ in range(min(BLOCK_SIZE, self.num_terms - block * BLOCK_SIZE)):
+            prefix, pos = read_vbyte_at(data, pos)
+            length, pos = read_vbyte_at(data, pos)
+            term = term[:prefix] + data[pos:pos + length]
+            pos += length
+            term_id, pos = read_vbyte_at(data, pos)
+            idf, = IDF.unpack_from(data, pos)
+            pos += IDF.size
+            yield term, term_id, idf
+
+    def get(self, term, default=None):
+        entry = self.lookup(term)
+        return default if entry is None else entry[0]
+
+    def lookup(self, term):
+        # (term id, idf), or None
+        key = term.encode('utf-8')
+
+        # last block starting at or before the key
+        lo, hi = 0, self.num_blocks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.first_term(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if not lo:
+            return None
+
+        for term, term_id, idf in self.block_entries(lo - 1):
+            if term == key:
+                return term_id, idf
+            if term > key:
+                break
+        return None
+
+    def items(self):
+        # (term, term id) pairs in term id order, decodes the whole file
+        entries = [(term_id, term) for block in range(self.num_blocks) for term, term_id, _ in self.block_entries(block)]
+        entries.sort()
+        return [(term.decode('utf-8'), term_id) for term_id, term in entries]
+
+    def __iter__(self):
+        return (term for term, _ in self.items())
+
+    def close(self):
+        self.data.close()
+        self.file.close()
@@ -0,0 +1,124 @@
+"""
+Live-docs bitmaps for deleted and replaced documents.
+
+Segments are never rewritten to drop a document. A segment with deletions gets a
+metadata/live-docs.bin bitmap next to its postings instead: a small header followed by one bit
+per internal id, set while the document is live. Readers skip cleared ids while traversing the
+postings, and MergeEngine leaves them out when it compacts the segment.
+"""
+from array import array
+from pathlib import Path
+import os
+import struct
+
+LIVE_DOCS_FILE = 'live-docs.bin'
+
+MAGIC = b'LIVE'
+# magic, number of documents
+HEADER = struct.Struct('<4sI')
+
+class LiveDocs:
+    def __init__(self, num_docs, bits=None):
+        self.num_docs = num_docs
+        if bits is None:
+            # every document live, padding bits past num_docs stay cleared
+            bits = bytearray(b'\xff' * (num_docs // 8))
+            if num_docs % 8:
+                bits.append((1 << num_docs % 8) - 1)
+        self.bits = bytearray(bits)
+        self.num_deleted = num_docs - bin(int.from_bytes(self.bits, 'little')).count('1')
+
+    @classmethod
+    def load(cls, metadata_path, num_docs):
+        # segments without the file have no deletions
+        path = Path(metadata_path) / LIVE_DOCS_FILE
+        if not path.is_file():
+            return cls(num_docs)
+
+        with path.open('rb') as f:
+            data = f.read()
+        magic, stored_num_docs = HEADER.unpack_from(data)
+        if magic != MAGIC or stored_num_docs != num_docs:
+            raise ValueError(f'{path} is not a live-docs bitmap for {num_docs} documents')
+        return cls(num_docs, data[HEADER.size:])
+
+    def save(self, metadata_path):
+        # written to a temporary file and renamed, so readers never see a half-written bitmap
+        path = Path(metadata_path) / LIVE_DOCS_FILE
+        tmp_path = path.with_name(LIVE_DOCS_FILE + '.tmp')
+        with tmp_path.open('wb') as f:
+            f.write(HEADER.pack(MAGIC, self.num_docs))
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return self.num_docs - self.num_deleted
+
+    def is_live(self, doc_id):
+        return 0 <= doc_id < self.num_docs and self.bits[doc_id >> 3] >> (doc_id & 7) & 1 == 1
+
+    def delete(self, doc_id):
+        # returns False if the document was already deleted
+        if not self.is_live(doc_id):
+            return False
+        self.bits[doc_id >> 3] &= ~(1 << (doc_id & 7)) & 0xFF
+        self.num_deleted += 1
+        return True
+
+class LivePostings:
+    # wraps a PostingsReader and drops deleted documents from every postings list it reads
+    def __init__(self, reader, live_docs):
+        self.reader = reader
+        self.live_docs = live_docs
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __contains__(self, term_id):
+        return term_id in self.reader
+
+    def __getitem__(self, term_id):
+        postings = self.get(term_id)
+        if postings is None:
+            raise KeyError(term_id)
+        return postings
+
+    def get(self, term_id, default=None):
+        postings = self.reader.get(term_id)
+        if postings is None:
+            return default
+
+        bits = self.live_docs.bits
+        live_postings = []
+        for i in range(0, len(postings), 2):
+            doc_id = postings[i]
+            if bits[doc_id >> 3] >> (doc_id & 7) & 1:
+                live_postings.append(doc_id)
+                live_postings.append(postings[i + 1])
+        return live_postings
+
+    def postings(self, term_id):
+        postings = self.reader.postings(term_id)
+        if postings is None:
+            return None
+
+        bits = self.live_docs.bits
+        live_doc_ids = array('I')
+        live_tfs = array('I')
+        for doc_id, tf in zip(*postings):
+            if bits[doc_id >> 3] >> (doc_id & 7) & 1:
+                live_doc_ids.append(doc_id)
+                live_tfs.append(tf)
+        return (live_doc_ids, live_tfs) if live_doc_ids else None
+
+    def df(self, term_id):
+        # live document frequency, the directory only knows the count including deletions
+        postings = self.postings(term_id)
+        return len(postings[0]) if postings else 0
+
+    def blocks(self, term_id):
+        # the block maxima still bound the live postings, they only cover more documents
+        return self.reader.blocks(term_id)
+
+    def close(self):
+        self.reader.close()
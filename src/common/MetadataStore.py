@@ -0,0 +1,208 @@
+"""
+Columnar per-document metadata, indexed by internal id.
+
+    docnos.bin            header (magic, width) + one fixed-width, NUL-padded utf-8 docno per document
+    docno-index.bin       header (magic, width, count) + (docno, internal id) records sorted by docno
+    dates.bin             one packed uint32 per document: year * 10000 + month * 100 + day
+    headlines.bin         every headline back to back, utf-8 encoded
+    headline-offsets.bin  num_docs + 1 uint64 offsets into headlines.bin
+
+Every field of every document is a constant-time slice, nothing is parsed up front. The other way
+round, a docno is found by binary searching docno-index.bin, which has the same padded docnos as
+docnos.bin followed by a <I internal id. The width is that of the longest docno of the segment, so
+the writer keeps the docnos until it is closed and writes both files then.
+"""
+from pathlib import Path
+import mmap
+import struct
+import common.ErrorMessages
+
+DOCNOS_FILE = 'docnos.bin'
+DOCNO_INDEX_FILE = 'docno-index.bin'
+DATES_FILE = 'dates.bin'
+HEADLINES_FILE = 'headlines.bin'
+HEADLINE_OFFSETS_FILE = 'headline-offsets.bin'
+
+MAGIC = b'DNOS'
+# magic, docno width in bytes
+DOCNO_HEADER = struct.Struct('<4sI')
+INDEX_MAGIC = b'DIDX'
+# magic, docno width in bytes, number of records
+DOCNO_INDEX_HEADER = struct.Struct('<4sII')
+DOC_ID = struct.Struct('<I')
+DATE = struct.Struct('<I')
+OFFSET = struct.Struct('<Q')
+
+MONTHS = [
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December',
+]
+
+def docno_date(docno):
+    # LAMMDDYY-NNNN, according to project doc it is guaranteed that all dates are 19xx
+    month = int(docno[2:4])
+    day = int(docno[4:6])
+    year = 1900 + int(docno[6:8])
+    return year * 10000 + month * 100 + day
+
+def format_date(packed_date):
+    year, month, day = packed_date // 10000, packed_date // 100 % 100, packed_date % 100
+    return f'{MONTHS[month - 1]} {day:02d}, {year}'
+
+def write_docno_index(metadata_path, docnos, docno_width):
+    # docnos: the padded docnos in internal id order
+    records = sorted((docno, doc_id) for doc_id, docno in enumerate(docnos))
+    with (Path(metadata_path) / DOCNO_INDEX_FILE).open('wb') as f:
+        f.write(DOCNO_INDEX_HEADER.pack(INDEX_MAGIC, docno_width, len(records)))
+        f.write(b''.join(docno + DOC_ID.pack(doc_id) for docno, doc_id in records))
+
+def add_docno_index(metadata_path):
+    # docno-index.bin for metadata columns written before it existed
+    metadata_store = MetadataStore(metadata_path)
+    docnos = [metadata_store.padded_docno(doc_id) for doc_id in range(len(metadata_store))]
+    write_docno_index(metadata_path, docnos, metadata_store.docno_width)
+    metadata_store.close()
+
+def map_file(path):
+    with path.open('rb') as f:
+        if not path.stat().st_size:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class MetadataStoreWriter:
+    def __init__(self, metadata_path):
+        metadata_path = Path(metadata_path)
+        self.metadata_path = metadata_path
+        self.docnos = []
+        self.dates_file = (metadata_path / DATES_FILE).open('wb')
+        self.headlines_file = (metadata_path / HEADLINES_FILE).open('wb')
+        self.headline_offsets_file = (metadata_path / HEADLINE_OFFSETS_FILE).open('wb')
+
+        self.headline_offsets_file.write(OFFSET.pack(0))
+        self.headline_offset = 0
+
+    def add(self, docno, date, headline):
+        # documents have to be added in internal id order
+        self.docnos.append(docno.encode('utf-8'))
+
+        self.dates_file.write(DATE.pack(date))
+
+        encoded_headline = headline.encode('utf-8')
+        self.headlines_file.write(encoded_headline)
+        self.headline_offset += len(encoded_headline)
+        self.headline_offsets_file.write(OFFSET.pack(self.headline_offset))
+
+    def close(self):
+        # at least one byte wide, the reader divides by the width
+        docno_width = max(map(len, self.docnos), default=1)
+        docnos = [docno.ljust(docno_width, b'\0') for docno in self.docnos]
+        with (self.metadata_path / DOCNOS_FILE).open('wb') as f:
+            f.write(DOCNO_HEADER.pack(MAGIC, docno_width))
+            f.write(b''.join(docnos))
+        write_docno_index(self.metadata_path, docnos, docno_width)
+        self.dates_file.close()
+        self.headlines_file.close()
+        self.headline_offsets_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class MetadataStore:
+    def __init__(self, metadata_path):
+        metadata_path = Path(metadata_path)
+        for file_name in (DOCNOS_FILE, DATES_FILE, HEADLINES_FILE, HEADLINE_OFFSETS_FILE):
+            if not (metadata_path / file_name).is_file():
+                raise FileNotFoundError(common.ErrorMessages.metadata_file_not_found_at_path('Document metadata'))
+
+        self.docnos = map_file(metadata_path / DOCNOS_FILE)
+        magic, self.docno_width = DOCNO_HEADER.unpack_from(self.docnos)
+        if magic != MAGIC:
+            raise ValueError(f'{metadata_path / DOCNOS_FILE} is not a docno table')
+        self.num_docs = (len(self.docnos) - DOCNO_HEADER.size) // self.docno_width
+
+        # segments written before docno-index.bin existed fall back to a dict built on first use
+        self.docno_index = None
+        self.docno_dict = None
+        if (metadata_path / DOCNO_INDEX_FILE).is_file():
+            self.docno_index = map_file(metadata_path / DOCNO_INDEX_FILE)
+            magic, _, self.num_indexed = DOCNO_INDEX_HEADER.unpack_from(self.docno_index)
+            if magic != INDEX_MAGIC:
+                raise ValueError(f'{metadata_path / DOCNO_INDEX_FILE} is not a docno index')
+
+        self.dates = map_file(metadata_path / DATES_FILE)
+        self.headline_offsets = map_file(metadata_path / HEADLINE_OFFSETS_FILE)
+        self.headlines = map_file(metadata_path / HEADLINES_FILE)
+
+    def __len__(self):
+        return self.num_docs
+
+    def __contains__(self, doc_id):
+        return 0 <= doc_id < self.num_docs
+
+    def padded_docno(self, doc_id):
+        start = DOCNO_HEADER.size + doc_id * self.docno_width
+        return self.docnos[start:start + self.docno_width]
+
+    def docno(self, doc_id):
+        if not 0 <= doc_id < self.num_docs:
+            return None
+        return self.padded_docno(doc_id).rstrip(b'\0').decode('utf-8')
+
+    def indexed_docno(self, i):
+        start = DOCNO_INDEX_HEADER.size + i * (self.docno_width + DOC_ID.size)
+        return self.docno_index[start:start + self.docno_width]
+
+    def doc_ids(self, docno):
+        # internal ids of the documents with this docno, in id order
+        key = docno.encode('utf-8')
+        if len(key) > self.docno_width:
+            return []
+        key = key.ljust(self.docno_width, b'\0')
+
+        if self.docno_index is None:
+            if self.docno_dict is None:
+                # built aside, a thread sharing the store never sees it half filled
+                docno_dict = {}
+                for doc_id in range(self.num_docs):
+                    docno_dict.setdefault(self.padded_docno(doc_id), []).append(doc_id)
+                self.docno_dict = docno_dict
+            return self.docno_dict.get(key, [])
+
+        # first record at or after the key, records with the same docno are in id order
+        lo, hi = 0, self.num_indexed
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.indexed_docno(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        doc_ids = []
+        while lo < self.num_indexed and self.indexed_docno(lo) == key:
+            start = DOCNO_INDEX_HEADER.size + lo * (self.docno_width + DOC_ID.size) + self.docno_width
+            doc_ids.append(DOC_ID.unpack_from(self.docno_index, start)[0])
+            lo += 1
+        return doc_ids
+
+    def doc_id(self, docno):
+        # internal id of the latest document with this docno, or None
+        doc_ids = self.doc_ids(docno)
+        return doc_ids[-1] if doc_ids else None
+
+    def packed_date(self, doc_id):
+        return DATE.unpack_from(self.dates, doc_id * DATE.size)[0]
+
+    def date(self, doc_id):
+        return format_date(self.packed_date(doc_id))
+
+    def headline(self, doc_id):
+        start, = OFFSET.unpack_from(self.headline_offsets, doc_id * OFFSET.size)
+        end, = OFFSET.unpack_from(self.headline_offsets, (doc_id + 1) * OFFSET.size)
+        return self.headlines[start:end].decode('utf-8')
+
+    def close(self):
+        for data in (self.docnos, self.docno_index, self.dates, self.headline_offsets, self.headlines):
+            if isinstance(data, mmap.mmap):
+                data.close()
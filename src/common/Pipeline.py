@@ -0,0 +1,38 @@
+from itertools import islice
+from multiprocessing import Pool
+
+def batches(items, batch_size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def imap_ordered(func, items, workers=1, batch_size=1024, initializer=None, initargs=()):
+    """
+    Yields (item, func(item)) for every item, in input order.
+
+    With more than one worker, func runs in a process pool. Items are handed out in batches
+    so at most two batches are in flight at once: the next batch is parsed while the caller
+    consumes the current one, and a fast producer can't run ahead and fill up memory.
+    func has to be a module-level function so it can be pickled. initializer(*initargs) runs once
+    in every pool process before it takes work.
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    chunksize = max(1, batch_size // (workers * 4))
+
+    with Pool(workers, initializer, initargs) as pool:
+        pending = None
+        for batch in batches(items, batch_size):
+            job = pool.map_async(func, batch, chunksize)
+            if pending:
+                yield from zip(pending[0], pending[1].get())
+            pending = (batch, job)
+
+        if pending:
+            yield from zip(pending[0], pending[1].get())
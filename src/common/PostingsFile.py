@@ -0,0 +1,410 @@
+"""
+Binary postings format.
+
+The inverted index is stored as these files inside the index's metadata directory:
+
+    postings.bin            every postings list back to back, variable-byte encoded
+    postings-directory.bin  one fixed-width record per term id: (offset, length, df)
+    postings-blocks.bin     block maxima for dynamic pruning, see below
+
+A postings list is encoded as alternating (doc id gap, term frequency) pairs, so
+[doc, tf, doc, tf, ...] becomes [doc - prev_doc, tf, ...] before variable-byte encoding.
+Each integer uses 7 bits per byte and the high bit is set on every byte except the last.
+
+Every postings list is cut into blocks of BLOCK_SIZE postings, and postings-blocks.bin has one
+(last doc id, highest tf, doc id of the shortest document) record per block. Since a BM25 term
+score grows with tf and shrinks with document length, tf / (tf + norm of the shortest document)
+bounds the score of every posting in the block, whatever K1, B and average length are used at
+query time (see common.Scoring).
+"""
+from array import array
+from pathlib import Path
+import heapq
+import mmap
+import struct
+import common.ErrorMessages
+
+POSTINGS_FILE = 'postings.bin'
+DIRECTORY_FILE = 'postings-directory.bin'
+
+# offset into postings.bin, encoded length in bytes, document frequency
+DIRECTORY_RECORD = struct.Struct('<QII')
+
+BLOCKS_FILE = 'postings-blocks.bin'
+BLOCK_SIZE = 128
+BLOCKS_MAGIC = b'BLKM'
+# magic, number of terms, block size; followed by num_terms + 1 <Q first block numbers
+BLOCKS_HEADER = struct.Struct('<4sII')
+BLOCK_START = struct.Struct('<Q')
+# last doc id, highest term frequency, doc id of the shortest document
+BLOCK_RECORD = struct.Struct('<III')
+
+def encode_vbyte(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def encode_postings(postings):
+    out = bytearray()
+    prev_doc = 0
+    for i in range(0, len(postings), 2):
+        doc_id = postings[i]
+        encode_vbyte(doc_id - prev_doc, out)
+        encode_vbyte(postings[i + 1], out)
+        prev_doc = doc_id
+    return bytes(out)
+
+def decode_postings(data):
+    postings = []
+    value = 0
+    shift = 0
+    doc_id = 0
+    is_doc = True
+
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            continue
+
+        value |= byte << shift
+        if is_doc:
+            doc_id += value
+            postings.append(doc_id)
+        else:
+            postings.append(value)
+
+        is_doc = not is_doc
+        value = 0
+        shift = 0
+
+    return postings
+
+def split_postings(flat):
+    # [doc, tf, doc, tf, ...] -> (doc ids, term frequencies) as typed arrays
+    return array('I', flat[0::2]), array('I', flat[1::2])
+
+def encode_blocks(postings, doc_lengths, out):
+    # block maxima of a [doc, tf, ...] list; doc_lengths is indexed by the same internal ids
+    doc_ids = postings[0::2]
+    tfs = postings[1::2]
+    for start in range(0, len(doc_ids), BLOCK_SIZE):
+        block_doc_ids = doc_ids[start:start + BLOCK_SIZE]
+        shortest = min(block_doc_ids, key=doc_lengths.__getitem__)
+        out += BLOCK_RECORD.pack(block_doc_ids[-1], max(tfs[start:start + BLOCK_SIZE]), shortest)
+
+class BlocksWriter:
+    # collects the block maxima term by term, in increasing term id order
+    def __init__(self, num_terms, doc_lengths):
+        self.doc_lengths = doc_lengths
+        self.starts = array('Q', [0] * (num_terms + 1))
+        self.records = bytearray()
+        self.next_term = 0
+
+    def add(self, term_id, postings):
+        num_blocks = len(self.records) // BLOCK_RECORD.size
+        while self.next_term <= term_id:
+            self.starts[self.next_term] = num_blocks
+            self.next_term += 1
+        encode_blocks(postings, self.doc_lengths, self.records)
+
+    def write(self, metadata_path):
+        num_blocks = len(self.records) // BLOCK_RECORD.size
+        for term_id in range(self.next_term, len(self.starts)):
+            self.starts[term_id] = num_blocks
+        with (Path(metadata_path) / BLOCKS_FILE).open('wb') as f:
+            f.write(BLOCKS_HEADER.pack(BLOCKS_MAGIC, len(self.starts) - 1, BLOCK_SIZE))
+            f.write(b''.join(BLOCK_START.pack(start) for start in self.starts))
+            f.write(self.records)
+
+def write_postings_stream(metadata_path, num_terms, term_postings, doc_lengths=None):
+    # term_postings yields (term_id, [doc, tf, ...]) in increasing term id order; with the
+    # length of every document the block maxima are written too
+    metadata_path = Path(metadata_path)
+    directory = bytearray(DIRECTORY_RECORD.size * num_terms)
+    blocks = BlocksWriter(num_terms, doc_lengths) if doc_lengths is not None else None
+
+    offset = 0
+    with (metadata_path / POSTINGS_FILE).open('wb') as f:
+        for term_id, postings in term_postings:
+            if not postings:
+                continue
+            data = encode_postings(postings)
+            f.write(data)
+            DIRECTORY_RECORD.pack_into(directory, term_id * DIRECTORY_RECORD.size, offset, len(data), len(postings) // 2)
+            offset += len(data)
+            if blocks:
+                blocks.add(term_id, postings)
+
+    with (metadata_path / DIRECTORY_FILE).open('wb') as f:
+        f.write(directory)
+    if blocks:
+        blocks.write(metadata_path)
+
+def write_postings(metadata_path, inverted_index, doc_lengths=None):
+    # term ids are handed out densely by the lexicon, so the directory is indexed by term id
+    num_terms = max(inverted_index) + 1 if inverted_index else 0
+    write_postings_stream(metadata_path, num_terms, ((term_id, inverted_index[term_id]) for term_id in sorted(inverted_index)), doc_lengths)
+
+def write_postings_blocks(metadata_path, doc_lengths):
+    # block maxima for postings written without them
+    reader = PostingsReader(metadata_path)
+    blocks = BlocksWriter(len(reader), doc_lengths)
+    for term_id in range(len(reader)):
+        postings = reader.get(term_id)
+        if postings:
+            blocks.add(term_id, postings)
+    reader.close()
+    blocks.write(metadata_path)
+
+def read_vbyte(f):
+    value = 0
+    shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        byte = byte[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+        shift += 7
+
+def write_run(run_path, inverted_index):
+    # a run is a partial index sorted by term id: (term id, byte length, postings) records
+    with Path(run_path).open('wb') as f:
+        for term_id in sorted(inverted_index):
+            data = encode_postings(inverted_index[term_id])
+            header = bytearray()
+            encode_vbyte(term_id, header)
+            encode_vbyte(len(data), header)
+            f.write(header)
+            f.write(data)
+
+def read_run(run_path, run_number):
+    with Path(run_path).open('rb') as f:
+        while True:
+            term_id = read_vbyte(f)
+            if term_id is None:
+                return
+            length = read_vbyte(f)
+            yield term_id, run_number, decode_postings(f.read(length))
+
+def merge_runs(run_paths, metadata_path, num_terms, doc_lengths=None):
+    """
+    k-way merge of sorted runs into the final postings file.
+
+    Runs are flushed in document order, so concatenating a term's postings in run order
+    gives exactly the list a single in-memory build would have produced.
+    """
+    def merged_postings():
+        runs = [read_run(run_path, run_number) for run_number, run_path in enumerate(run_paths)]
+        current_term = None
+        current_postings = []
+        for term_id, _, postings in heapq.merge(*runs):
+            if term_id != current_term:
+                if current_postings:
+                    yield current_term, current_postings
+                current_term = term_id
+                current_postings = []
+            current_postings.extend(postings)
+        if current_postings:
+            yield current_term, current_postings
+
+    write_postings_stream(metadata_path, num_terms, merged_postings(), doc_lengths)
+
+class BlockMaxima:
+    # memory-mapped view over postings-blocks.bin
+    def __init__(self, path):
+        self.file = path.open('rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_terms, self.block_size = BLOCKS_HEADER.unpack_from(self.data)
+        if magic != BLOCKS_MAGIC:
+            raise ValueError(f'{path} is not a postings blocks file')
+        self.records_start = BLOCKS_HEADER.size + (self.num_terms + 1) * BLOCK_START.size
+
+    @classmethod
+    def open(cls, metadata_path):
+        # None for postings written without block maxima
+        path = Path(metadata_path) / BLOCKS_FILE
+        return cls(path) if path.is_file() else None
+
+    def blocks(self, term_id):
+        # (last doc ids, highest tfs, shortest doc ids) of the term's blocks as typed arrays
+        records = array('I')
+        if not 0 <= term_id < self.num_terms:
+            return records, records, records
+        first, end = struct.unpack_from('<2Q', self.data, BLOCKS_HEADER.size + term_id * BLOCK_START.size)
+        records.frombytes(self.data[self.records_start + first * BLOCK_RECORD.size:self.records_start + end * BLOCK_RECORD.size])
+        return records[0::3], records[1::3], records[2::3]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+class PostingsReader:
+    """
+    Read-only view over a binary postings file.
+
+    Postings are decoded on demand and both files are memory-mapped, so opening the index reads nothing.
+    get() and [] accept the term id as an int or as the string keys used by the old JSON index,
+    and return the same flat [doc, tf, doc, tf, ...] list that json.load used to produce.
+    """
+    def __init__(self, metadata_path):
+        metadata_path = Path(metadata_path)
+        postings_path = metadata_path / POSTINGS_FILE
+        directory_path = metadata_path / DIRECTORY_FILE
+
+        if not postings_path.is_file() or not directory_path.is_file():
+            raise FileNotFoundError(common.ErrorMessages.metadata_file_not_found_at_path('Postings file'))
+
+        # the directory is memory-mapped too, a lookup unpacks one record
+        self.directory_file = directory_path.open('rb')
+        if directory_path.stat().st_size:
+            self.directory = mmap.mmap(self.directory_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.directory = b''
+        self.num_terms = len(self.directory) // DIRECTORY_RECORD.size
+
+        self.file = postings_path.open('rb')
+        if postings_path.stat().st_size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+        self.block_maxima = BlockMaxima.open(metadata_path)
+
+    def record(self, term_id):
+        # (offset, length, df), or None for a term id outside the directory
+        term_id = int(term_id)
+        if not 0 <= term_id < self.num_terms:
+            return None
+        return DIRECTORY_RECORD.unpack_from(self.directory, term_id * DIRECTORY_RECORD.size)
+
+    def __len__(self):
+        return self.num_terms
+
+    def __contains__(self, term_id):
+        return self.df(term_id) > 0
+
+    def __getitem__(self, term_id):
+        postings = self.get(term_id)
+        if postings is None:
+            raise KeyError(term_id)
+        return postings
+
+    def df(self, term_id):
+        record = self.record(term_id)
+        return record[2] if record else 0
+
+    def get_bytes(self, term_id):
+        record = self.record(term_id)
+        if not record or not record[2]:
+            return None
+        offset, length, _ = record
+        return self.data[offset:offset + length]
+
+    def get(self, term_id, default=None):
+        data = self.get_bytes(term_id)
+        if data is None:
+            return default
+        return decode_postings(data)
+
+    def postings(self, term_id):
+        # (doc ids, term frequencies) as typed arrays, or None if the term has no postings
+        flat = self.get(term_id)
+        if flat is None:
+            return None
+        return split_postings(flat)
+
+    def blocks(self, term_id):
+        # block maxima of the term, None if the index has none
+        if self.block_maxima is None:
+            return None
+        return self.block_maxima.blocks(int(term_id))
+
+    def close(self):
+        for data in (self.data, self.directory):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self.file.close()
+        self.directory_file.close()
+        if self.block_maxima is not None:
+            self.block_maxima.close()
+
+class PostingsArrays:
+    """
+    The whole postings file decoded into contiguous typed arrays, for the query tools:
+
+        doc_ids  every term's doc ids back to back, in term id order
+        tfs      the matching term frequencies
+        starts   num_terms + 1 offsets, term t owns doc_ids[starts[t]:starts[t + 1]]
+
+    That is 8 bytes per posting, where a JSON-loaded index holds two boxed ints in a list per
+    posting. postings() hands out zero-copy memoryview slices. get() and [] still return flat
+    [doc, tf, ...] lists, like PostingsReader. The block maxima stay memory-mapped.
+    """
+    def __init__(self, metadata_path):
+        reader = PostingsReader(metadata_path)
+        self.doc_ids = array('I')
+        self.tfs = array('I')
+        self.starts = array('Q', [0])
+        try:
+            for term_id in range(len(reader)):
+                flat = reader.get(term_id)
+                if flat:
+                    self.doc_ids.extend(flat[0::2])
+                    self.tfs.extend(flat[1::2])
+                self.starts.append(len(self.doc_ids))
+        finally:
+            reader.close()
+        self.block_maxima = BlockMaxima.open(metadata_path)
+
+        self.doc_ids_view = memoryview(self.doc_ids)
+        self.tfs_view = memoryview(self.tfs)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __contains__(self, term_id):
+        return self.df(term_id) > 0
+
+    def __getitem__(self, term_id):
+        postings = self.get(term_id)
+        if postings is None:
+            raise KeyError(term_id)
+        return postings
+
+    def df(self, term_id):
+        term_id = int(term_id)
+        if 0 <= term_id < len(self):
+            return self.starts[term_id + 1] - self.starts[term_id]
+        return 0
+
+    def postings(self, term_id):
+        term_id = int(term_id)
+        if not self.df(term_id):
+            return None
+        start, end = self.starts[term_id], self.starts[term_id + 1]
+        return self.doc_ids_view[start:end], self.tfs_view[start:end]
+
+    def get(self, term_id, default=None):
+        postings = self.postings(term_id)
+        if postings is None:
+            return default
+        doc_ids, tfs = postings
+        flat = [0] * (2 * len(doc_ids))
+        flat[0::2] = doc_ids
+        flat[1::2] = tfs
+        return flat
+
+    def blocks(self, term_id):
+        if self.block_maxima is None:
+            return None
+        return self.block_maxima.blocks(int(term_id))
+
+    def close(self):
+        self.doc_ids_view.release()
+        self.tfs_view.release()
+        if self.block_maxima is not None:
+            self.block_maxima.close()
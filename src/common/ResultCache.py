@@ -0,0 +1,85 @@
+"""
+LRU cache of ranked query results for the interactive search engine.
+
+A query is keyed on its normalized form: the distinct query terms, sorted, plus the parameters of
+the ranking (K1, B, impact budget, ...), so a repeated or reworded query with the same terms is a
+hit. Every entry keeps a ranked list deeper than one page, so the next pages are sliced out of it
+without scoring again; asking past its depth is a miss that scores deeper and replaces the entry.
+
+The cache is bounded by a number of entries and an estimate of the bytes they take, whichever is
+hit first, and evicts the least recently used entries. Results belong to one manifest generation
+(see common.Segments): invalidate() with a new generation drops everything.
+"""
+from collections import OrderedDict
+import sys
+
+CACHE_ENTRIES = 1024
+CACHE_BYTES = 16 * 1024 * 1024
+
+def query_key(query_terms, *params):
+    # bm25 sums a query's terms in set order, so the normalized terms are also what gets scored
+    return (tuple(sorted(set(query_terms))),) + params
+
+def results_size(results):
+    # rough size of a list of (internal id, score) tuples
+    if not results:
+        return sys.getsizeof(results)
+    doc_id, score = results[0]
+    return sys.getsizeof(results) + len(results) * (sys.getsizeof(results[0]) + sys.getsizeof(doc_id) + sys.getsizeof(score))
+
+class ResultCache:
+    def __init__(self, max_entries=CACHE_ENTRIES, max_bytes=CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (results, depth they were scored to, size)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def invalidate(self, generation):
+        # drops every entry unless the index is still at generation
+        if generation == self.generation:
+            return
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+        self.size = 0
+        self.generation = generation
+
+    def get(self, key, depth):
+        # the cached results if they cover the top depth, otherwise None
+        entry = self.entries.get(key)
+        if entry is not None:
+            results, scored_depth, _ = entry
+            # fewer results than were asked for means there are no more
+            if scored_depth >= depth or len(results) < scored_depth:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return results
+        self.misses += 1
+        return None
+
+    def put(self, key, results, depth):
+        size = results_size(results)
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[2]
+        self.entries[key] = (results, depth, size)
+        self.size += size
+
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def hit_rate(self):
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
@@ -0,0 +1,203 @@
+"""
+BM25 scoring shared by the query tools.
+
+Scores are accumulated in a dict holding only the documents the query's postings touch, and the
+top k are picked with a k-bounded heap, so the cost of a query follows the number of postings it
+reads rather than the size of the collection. Results are ordered by score, highest first, with
+ties in internal id order, the same order a stable sort of every document by score gives.
+
+block_max_top_k walks the documents in id order instead and skips the ones that cannot make the
+top k, using the score bound of every postings block (see common.PostingsFile) against the k-th
+best score found so far, like Block-Max WAND and MaxScore do. The documents it scores get their
+terms added in the same order as in bm25_scores, so the results are exactly those of the
+exhaustive path.
+"""
+from bisect import bisect_left
+from math import inf
+import heapq
+from common.CollectionStats import bm25_idf
+
+# block bounds are inflated a little, so rounding never prunes a document that would tie them
+SAFETY = 1 + 1e-9
+
+def bm25_scores(query_terms, lexicon, inverted_index, norms, num_docs):
+    # internal id -> BM25 score of every document containing at least one of the query terms
+    scores = {}
+    get = scores.get
+    for term in set(query_terms):  # avoid duplicates
+        entry = lexicon.lookup(term)
+        posting = None
+
+        if entry is not None:
+            term_id, idf = entry
+            posting = inverted_index.postings(term_id)
+        if posting:
+            doc_ids, tfs = posting
+            if idf is None:
+                idf = bm25_idf(num_docs, len(doc_ids))
+
+            # length norms and IDF are precomputed, see common/CollectionStats.py
+            for doc_id, fi in zip(doc_ids, tfs):
+                scores[doc_id] = get(doc_id, 0) + fi / (norms[doc_id] + fi) * idf
+    return scores
+
+def top_k(scores, k):
+    # the k best (internal id, score) pairs with a positive score. A heap over the bare scores
+    # finds the k-th best one, and only the documents scoring at least that much, ties included,
+    # are sorted by (score, internal id).
+    if k <= 0:
+        return []
+    values = [score for score in scores.values() if score > 0]
+    threshold = heapq.nlargest(k, values)[-1] if len(values) > k else 0
+    candidates = [(-score, doc_id) for doc_id, score in scores.items() if score > 0 and score >= threshold]
+    candidates.sort()
+    return [(doc_id, -score) for score, doc_id in candidates[:k]]
+
+def bm25_top_k(query_terms, lexicon, inverted_index, norms, num_docs, k):
+    return top_k(bm25_scores(query_terms, lexicon, inverted_index, norms, num_docs), k)
+
+def block_bound(max_tf, min_norm, idf):
+    # highest score of a term in a block, from its highest tf and the lowest length norm
+    if min_norm < 0:
+        # B above 1 makes the norms of short documents negative, nothing is bounded
+        return inf
+    if idf <= 0:
+        # the term can only lower a score
+        return 0.0
+    return max_tf / (max_tf + min_norm) * idf * SAFETY
+
+class TermBlocks:
+    # one query term's postings with the score bound of each of its blocks
+    def __init__(self, doc_ids, tfs, idf, blocks, norms):
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.idf = idf
+        self.pos = 0
+
+        self.last_docs, max_tfs, shortest_docs = blocks
+        self.block = 0
+        # the norm grows with the length, so the shortest document has the smallest one
+        self.block_bounds = [block_bound(tf, norms[doc_id], idf) for tf, doc_id in zip(max_tfs, shortest_docs)]
+
+        # remaining_bounds[i]: bound of blocks i onwards
+        self.remaining_bounds = self.block_bounds[:]
+        for i in range(len(self.remaining_bounds) - 2, -1, -1):
+            self.remaining_bounds[i] = max(self.remaining_bounds[i], self.remaining_bounds[i + 1])
+
+def block_max_top_k(query_terms, lexicon, inverted_index, norms, num_docs, k, stats=None):
+    """
+    Same results as bm25_top_k, skipping the postings that cannot make the top k.
+
+    The documents are walked in windows that end wherever a block of a query term ends, so every
+    term has a single block, and a single score bound, over a window. A window whose bounds add up
+    to no more than the k-th best score so far is skipped without decoding anything, the others
+    are scored like bm25_scores. Once the bounds of the blocks left add up to no more than the
+    k-th best score the search stops. stats, if given, counts the postings scored in
+    stats['postings']. Indexes written without block maxima are scored exhaustively.
+    """
+    if k <= 0:
+        return []
+
+    terms = []
+    for term in set(query_terms):  # same order as bm25_scores
+        entry = lexicon.lookup(term)
+        if entry is None:
+            continue
+        term_id, idf = entry
+        posting = inverted_index.postings(term_id)
+        if not posting:
+            continue
+        blocks = inverted_index.blocks(term_id)
+        if blocks is None:
+            return bm25_top_k(query_terms, lexicon, inverted_index, norms, num_docs, k)
+
+        doc_ids, tfs = posting
+        if idf is None:
+            idf = bm25_idf(num_docs, len(doc_ids))
+        terms.append(TermBlocks(doc_ids, tfs, idf, blocks, norms))
+
+    heap = []
+    threshold = 0
+    evaluated = 0
+    active = [term for term in terms if term.last_docs]
+    while active:
+        if threshold > 0 and sum(term.remaining_bounds[term.block] for term in active) <= threshold:
+            break
+
+        end = min(term.last_docs[term.block] for term in active) + 1
+        bound = sum(term.block_bounds[term.block] for term in active)
+        if bound > threshold:
+            # only the terms with postings in the window count
+            ends = {}
+            for term in active:
+                term_end = bisect_left(term.doc_ids, end, term.pos)
+                if term_end > term.pos:
+                    ends[term] = term_end
+            bound = sum(term.block_bounds[term.block] for term in ends)
+
+            if bound > threshold:
+                # the terms with the lowest bounds cannot reach the threshold together, so only
+                # documents with at least one of the other (essential) terms are scored
+                optional = set()
+                optional_bound = 0
+                for term in sorted(ends, key=lambda term: term.block_bounds[term.block]):
+                    optional_bound += term.block_bounds[term.block]
+                    if optional_bound > threshold:
+                        break
+                    optional.add(term)
+                candidates = None
+                if optional:
+                    candidates = set()
+                    for term in ends:
+                        if term not in optional:
+                            candidates.update(term.doc_ids[term.pos:ends[term]])
+
+                scores = {}
+                get = scores.get
+                for term in terms:
+                    if term not in ends:
+                        continue
+                    term_end = ends[term]
+                    idf = term.idf
+                    if term in optional and len(candidates) * 4 < term_end - term.pos:
+                        # few candidates, look each one up instead of reading the window
+                        doc_ids = term.doc_ids
+                        pos = term.pos
+                        for doc_id in sorted(candidates):
+                            pos = bisect_left(doc_ids, doc_id, pos, term_end)
+                            if pos == term_end:
+                                break
+                            if doc_ids[pos] == doc_id:
+                                fi = term.tfs[pos]
+                                scores[doc_id] = get(doc_id, 0) + fi / (norms[doc_id] + fi) * idf
+                                evaluated += 1
+                    elif term in optional:
+                        for doc_id, fi in zip(term.doc_ids[term.pos:term_end], term.tfs[term.pos:term_end]):
+                            if doc_id in candidates:
+                                scores[doc_id] = get(doc_id, 0) + fi / (norms[doc_id] + fi) * idf
+                                evaluated += 1
+                    else:
+                        for doc_id, fi in zip(term.doc_ids[term.pos:term_end], term.tfs[term.pos:term_end]):
+                            scores[doc_id] = get(doc_id, 0) + fi / (norms[doc_id] + fi) * idf
+                        evaluated += term_end - term.pos
+
+                # a tie with the k-th best only gets in with a lower internal id
+                for doc_id, score in scores.items():
+                    if score > 0 and score >= threshold:
+                        if len(heap) < k:
+                            heapq.heappush(heap, (score, -doc_id))
+                        elif (score, -doc_id) > heap[0]:
+                            heapq.heapreplace(heap, (score, -doc_id))
+                if len(heap) == k:
+                    threshold = heap[0][0]
+
+        for term in active:
+            term.pos = bisect_left(term.doc_ids, end, term.pos)
+            if term.last_docs[term.block] < end:
+                term.block += 1
+        active = [term for term in active if term.block < len(term.last_docs)]
+
+    if stats is not None:
+        stats['postings'] = stats.get('postings', 0) + evaluated
+    results = sorted(heap, reverse=True)
+    return [(-doc_id, score) for score, doc_id in results]
@@ -0,0 +1,271 @@
+"""
+Segment manifest for incrementally built indexes.
+
+A fresh build is a single segment: the index directory itself, named '.'. Every archive appended
+with IndexEngine --append becomes a new immutable segment under segments/, with its own lexicon,
+postings, doc lengths, document store and metadata columns. segments.json lists the live segments
+in document order:
+
+    {"generation": 3, "next_segment": 3, "segments": [{"name": ".", "num_docs": 131896, "num_deleted": 0}, ...]}
+
+Global internal ids are assigned by concatenating the segments in manifest order. The docno.txt
+and doc-lengths.txt at the root of the index always cover every segment in that order.
+Deleted documents keep their ids until MergeEngine compacts their segment (see common.LiveDocs).
+generation goes up every time the searchable contents of the index change.
+
+Segments a merge replaced are listed under "retired" and stay on disk until the next merge, so a
+reader that read the manifest just before the swap still finds every file of its generation. Merged
+segments always get a new name under segments/, the root name '.' is never reused.
+"""
+from contextlib import contextmanager
+from math import log
+from pathlib import Path
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+from common.LiveDocs import LiveDocs
+from common.MetadataStore import MetadataStore, DOCNOS_FILE
+from common.StemCache import STEM_CACHE_FILE
+
+MANIFEST_FILE = 'segments.json'
+LOCK_FILE = 'segments.lock'
+MERGE_LOCK_FILE = 'merge.lock'
+SEGMENTS_DIR = 'segments'
+ROOT_SEGMENT = '.'
+
+# tiered merge policy: merge MERGE_FACTOR adjacent segments of the same size tier,
+# where tier n holds segments of roughly MIN_SEGMENT_DOCS * MERGE_FACTOR ** n live documents
+MERGE_FACTOR = 4
+MIN_SEGMENT_DOCS = 1000
+# a segment with more deleted documents than this is compacted on its own
+MAX_DELETED_RATIO = 0.3
+
+def count_lines(path):
+    if not path.is_file():
+        return 0
+    with path.open('rb') as f:
+        content = f.read()
+    return content.count(b'\n') + 1 if content else 0
+
+def read_manifest(index_path):
+    index_path = Path(index_path)
+    manifest_path = index_path / MANIFEST_FILE
+    if manifest_path.is_file():
+        with manifest_path.open('r') as f:
+            return json.load(f)
+
+    # indexes built before segments existed are one root segment
+    num_docs = count_lines(index_path / 'docno.txt')
+    return {'generation': 0, 'next_segment': 1, 'segments': [{'name': ROOT_SEGMENT, 'num_docs': num_docs, 'num_deleted': 0}]}
+
+def write_manifest(index_path, manifest):
+    # written to a temporary file and renamed, so readers never see a half-written manifest
+    index_path = Path(index_path)
+    tmp_path = index_path / (MANIFEST_FILE + '.tmp')
+    with tmp_path.open('w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, index_path / MANIFEST_FILE)
+
+@contextmanager
+def manifest_lock(index_path):
+    with (Path(index_path) / LOCK_FILE).open('w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def segment_path(index_path, name):
+    return Path(index_path) / name
+
+def segment_bases(segments):
+    # first global internal id of every segment
+    bases = []
+    base = 0
+    for segment in segments:
+        bases.append(base)
+        base += segment['num_docs']
+    return bases
+
+def reserve_segment(index_path):
+    # hands out a new, unused segment directory name
+    with manifest_lock(index_path):
+        manifest = read_manifest(index_path)
+        name = f"{SEGMENTS_DIR}/seg-{manifest['next_segment']:06d}"
+        manifest['next_segment'] += 1
+        write_manifest(index_path, manifest)
+    return name
+
+def append_lines(source_path, dest_path):
+    # appends a newline separated file to another one, both without a trailing newline
+    with source_path.open('r', encoding='utf-8') as f:
+        content = f.read()
+    if not content:
+        return
+    separator = '\n' if count_lines(dest_path) else ''
+    with dest_path.open('a', encoding='utf-8') as f:
+        f.write(separator + content)
+
+def read_lines(path, num_lines):
+    lines = []
+    with path.open('r', encoding='utf-8') as f:
+        for line in f:
+            if len(lines) == num_lines:
+                break
+            lines.append(line.rstrip('\n'))
+    return lines
+
+def find_docnos(index_path, manifest, docnos):
+    # global internal ids of every document with one of the docnos, from each segment's docno index
+    segments = manifest['segments']
+    paths = [segment_path(index_path, segment['name']) / 'metadata' for segment in segments]
+    if not all((path / DOCNOS_FILE).is_file() for path in paths):
+        # indexes without metadata columns, see ConvertIndex.py
+        num_docs = sum(segment['num_docs'] for segment in segments)
+        return [doc_id for doc_id, docno in enumerate(read_lines(Path(index_path) / 'docno.txt', num_docs)) if docno in docnos]
+
+    doc_ids = []
+    for path, base in zip(paths, segment_bases(segments)):
+        metadata_store = MetadataStore(path)
+        for docno in docnos:
+            doc_ids.extend(base + doc_id for doc_id in metadata_store.doc_ids(docno))
+        metadata_store.close()
+    return sorted(doc_ids)
+
+def delete_documents(index_path, manifest, doc_ids):
+    # clears global internal ids in the live-docs bitmaps, the caller holds the manifest lock
+    # and writes the manifest afterwards; returns how many documents were live before
+    segments = manifest['segments']
+    bases = segment_bases(segments)
+    by_segment = {}
+    for doc_id in doc_ids:
+        for segment, base in zip(segments, bases):
+            if base <= doc_id < base + segment['num_docs']:
+                by_segment.setdefault(segment['name'], (segment, []))[1].append(doc_id - base)
+
+    num_deleted = 0
+    for name, (segment, local_ids) in by_segment.items():
+        metadata_path = segment_path(index_path, name) / 'metadata'
+        live_docs = LiveDocs.load(metadata_path, segment['num_docs'])
+        deleted = sum(live_docs.delete(local_id) for local_id in local_ids)
+        if deleted:
+            live_docs.save(metadata_path)
+            segment['num_deleted'] = live_docs.num_deleted
+            num_deleted += deleted
+    return num_deleted
+
+def delete_docnos(index_path, docnos):
+    # deletes every live document with one of the docnos, returns how many were deleted
+    with manifest_lock(index_path):
+        manifest = read_manifest(index_path)
+        num_deleted = delete_documents(index_path, manifest, find_docnos(index_path, manifest, set(docnos)))
+        if num_deleted:
+            manifest['generation'] += 1
+            write_manifest(index_path, manifest)
+    return num_deleted
+
+def add_segment(index_path, name, num_docs):
+    # publishes a fully written segment at the end of the index, older versions of the
+    # documents it contains (same docno) are deleted at the same time
+    index_path = Path(index_path)
+    with manifest_lock(index_path):
+        manifest = read_manifest(index_path)
+        path = segment_path(index_path, name)
+        docnos = set(read_lines(path / 'docno.txt', num_docs))
+        num_replaced = delete_documents(index_path, manifest, find_docnos(index_path, manifest, docnos))
+
+        append_lines(path / 'docno.txt', index_path / 'docno.txt')
+        append_lines(path / 'doc-lengths.txt', index_path / 'doc-lengths.txt')
+
+        manifest['segments'].append({'name': name, 'num_docs': num_docs, 'num_deleted': 0})
+        manifest['generation'] += 1
+        write_manifest(index_path, manifest)
+    return num_replaced
+
+def replace_segments(manifest, names, merged_segments):
+    # swaps adjacent segments for the segment they were merged into (or nothing, if every
+    # document was deleted), the caller holds the manifest lock and writes the manifest
+    segment_names = [segment['name'] for segment in manifest['segments']]
+    start = segment_names.index(names[0])
+    if segment_names[start:start + len(names)] != list(names):
+        raise ValueError('Merged segments are no longer adjacent in the manifest')
+
+    manifest['segments'][start:start + len(names)] = merged_segments
+    manifest['generation'] += 1
+
+def retire_segments(manifest, names):
+    # the caller holds the manifest lock and writes the manifest; returns the segments retired
+    # by the previous merge, which no reader can still be opening and are removed now
+    removable = manifest.get('retired', [])
+    manifest['retired'] = list(names)
+    return removable
+
+def rebuild_root_lists(index_path, manifest):
+    # rewrites the root docno.txt and doc-lengths.txt after compaction changed the global ids
+    index_path = Path(index_path)
+    for file_name in ('docno.txt', 'doc-lengths.txt'):
+        lines = []
+        for segment in manifest['segments']:
+            lines.extend(read_lines(segment_path(index_path, segment['name']) / file_name, segment['num_docs']))
+
+        tmp_path = index_path / (file_name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        os.replace(tmp_path, index_path / file_name)
+
+def remove_segment_files(index_path, name):
+    path = segment_path(index_path, name)
+    if name != ROOT_SEGMENT:
+        shutil.rmtree(path)
+        return
+
+    # the root segment shares its directory with the index, only its own data files go;
+    # the root docno.txt and doc-lengths.txt cover every segment and stay, so does the stem cache
+    for directory in (path / 'documents', path / 'metadata'):
+        for file in directory.iterdir():
+            if file.is_file() and file.name != STEM_CACHE_FILE:
+                file.unlink()
+
+def num_live(segment):
+    return segment['num_docs'] - segment.get('num_deleted', 0)
+
+def tier(num_docs, merge_factor=MERGE_FACTOR, min_segment_docs=MIN_SEGMENT_DOCS):
+    if num_docs <= min_segment_docs:
+        return 0
+    return int(log(num_docs / min_segment_docs, merge_factor))
+
+def select_merge(segments, merge_factor=MERGE_FACTOR, min_segment_docs=MIN_SEGMENT_DOCS):
+    """
+    Tiered merge policy.
+
+    Returns the (start, end) slice of merge_factor adjacent segments in the lowest tier that has
+    that many in a row, or None when nothing needs merging. Only adjacent segments are merged,
+    so global internal ids keep their order. Failing that, a single segment with more than
+    MAX_DELETED_RATIO of its documents deleted is compacted.
+    """
+    tiers = [tier(num_live(segment), merge_factor, min_segment_docs) for segment in segments]
+    best = None
+    for start in range(len(segments) - merge_factor + 1):
+        window = tiers[start:start + merge_factor]
+        if all(t == window[0] for t in window) and (best is None or window[0] < tiers[best]):
+            best = start
+    if best is not None:
+        return best, best + merge_factor
+
+    for start, segment in enumerate(segments):
+        if segment.get('num_deleted', 0) > MAX_DELETED_RATIO * segment['num_docs']:
+            return start, start + 1
+    return None
+
+def start_background_merge(index_path):
+    # runs MergeEngine detached from the current process, it exits once nothing is left to merge
+    merge_engine = Path(__file__).resolve().parent.parent / 'MergeEngine.py'
+    subprocess.Popen(
+        [sys.executable, str(merge_engine), str(index_path)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
@@ -1,11 +1,14 @@
 """
 The tokenizer below is based on SimpleTokenizer by Trevor Strohman, provided by Dr. Mark Smucker
 """
-def Tokenize(text):
+import re
+
+def ReferenceTokenize(text):
+    # the original character loop, kept as the reference Tokenize has to match
     tokens = []
     text = text.lower()
 
-    start = 0 
+    start = 0
     i = 0
 
     for currChar in text:
@@ -13,7 +16,7 @@ def Tokenize(text):
             if start != i :
                 token = text[start:i]
                 tokens.append( token )
-                
+
             start = i + 1
 
         i = i + 1
@@ -23,5 +26,68 @@ def Tokenize(text):
 
     return tokens
 
-    
-    
+# ASCII text: one translate lowercases letters and blanks out every byte that is not a letter or
+# digit, and split() cuts the tokens out
+ascii_table = bytes(
+    (c | 0x20 if chr(c).isalpha() else c) if c < 128 and chr(c).isalnum() else ord(' ')
+    for c in range(256)
+)
+
+# Other text: \w is every str.isalnum() character plus '_', a superset of what the reference
+# keeps. Runs that are not all letters are split again with the exact isdigit()/isalpha() test,
+# which only matters for numeric characters like '½' that are neither.
+word_run_regex = re.compile(r'[^\W_]+')
+
+def split_run(run):
+    # splits an already lowercased \w run on the characters the reference loop breaks on
+    tokens = []
+    start = 0
+    for i, currChar in enumerate(run):
+        if not currChar.isdigit() and not currChar.isalpha():
+            if start != i:
+                tokens.append(run[start:i])
+            start = i + 1
+    if start != len(run):
+        tokens.append(run[start:])
+    return tokens
+
+def Tokenize(text):
+    if text.isascii():
+        return text.encode('ascii').translate(ascii_table).decode('ascii').split()
+
+    tokens = []
+    for run in word_run_regex.findall(text.lower()):
+        if run.isascii() or run.isalpha():
+            tokens.append(run)
+        else:
+            tokens.extend(split_run(run))
+    return tokens
+
+def TokenizeMany(texts):
+    # tokenizes a batch of texts, one token list per text
+    return [Tokenize(text) for text in texts]
+
+ascii_token_regex = re.compile(r'[A-Za-z0-9]+')
+
+def TokenSpans(text):
+    # (start, end) of every token of Tokenize(text), the token is text[start:end].lower(). Only
+    # holds for text whose lowercase has the same length, which the caller checks.
+    if text.isascii():
+        return [match.span() for match in ascii_token_regex.finditer(text)]
+
+    spans = []
+    for match in word_run_regex.finditer(text.lower()):
+        run = match.group()
+        start = match.start()
+        if run.isascii() or run.isalpha():
+            spans.append(match.span())
+            continue
+        token_start = 0
+        for i, currChar in enumerate(run):
+            if not currChar.isdigit() and not currChar.isalpha():
+                if token_start != i:
+                    spans.append((start + token_start, start + i))
+                token_start = i + 1
+        if token_start != len(run):
+            spans.append((start + token_start, start + len(run)))
+    return spans
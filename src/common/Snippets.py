@@ -0,0 +1,219 @@
+"""
+Query-biased snippets for search result pages.
+
+A snippet is the two best sentences of a document's display body (see common.DisplayFields). A
+sentence ends after '.', '!' or '?' and has its surrounding whitespace stripped. Sentences with
+fewer than 5 tokens are skipped, the others score
+
+    +2 for the first sentence, +1 for the second
+    +2 for every token that is a query term, repetitions included
+    +4 for every distinct query term in the sentence
+    +3 for every token of the longest run of consecutive query terms
+
+and ties go to the sentence that sorts first.
+
+The indexer records where every sentence and every token of the body is, so a query only has to
+slice the tokens out and count. Each document gets one record in the document store format
+(sentences.bin, sentence-offsets.bin next to the display fields):
+
+    header   size in bytes of the values, number of sentences, number of tokens
+    values   sentence start gaps, sentence lengths, tokens per sentence,
+             token start gaps, token lengths
+
+in the smallest of 1, 2 or 4 bytes that fits every value. Positions are in characters of the
+body. An empty record means the sentences have to be found at query time, e.g. for a body whose
+lowercase is longer than itself, where token positions would not line up.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import add
+import heapq
+import re
+import struct
+from common.SimpleTokenizer import Tokenize, TokenSpans
+
+SENTENCES_STORE_FILE = 'sentences.bin'
+SENTENCES_OFFSETS_FILE = 'sentence-offsets.bin'
+
+MIN_SENTENCE_TOKENS = 5
+SNIPPET_SENTENCES = 2
+
+# size of the values in bytes, number of sentences, number of tokens
+RECORD_HEADER = struct.Struct('<BII')
+TYPECODES = {1: 'B', 2: 'H', 4: 'I'}
+
+sentence_regex = re.compile(r'[^.!?]*[.!?]|[^.!?]+')
+
+def sentence_spans(text):
+    # (start, end) of every non-empty sentence, without its surrounding whitespace
+    spans = []
+    for match in sentence_regex.finditer(text):
+        sentence = match.group()
+        stripped = sentence.strip()
+        if stripped:
+            start = match.start() + len(sentence) - len(sentence.lstrip())
+            spans.append((start, start + len(stripped)))
+    return spans
+
+def split_sentences(text):
+    # (sentence starts, sentence ends, tokens per sentence, token starts, token ends), or None
+    # when lowercasing changes the length of the text
+    if len(text.lower()) != len(text):
+        return None
+
+    spans = sentence_spans(text)
+    token_spans = TokenSpans(text)
+    token_starts = [start for start, _ in token_spans]
+    # every token lies inside a sentence, the whitespace stripped around them is not a token
+    last_tokens = [bisect_left(token_starts, end) for _, end in spans]
+    token_counts = [last - first for first, last in zip([0] + last_tokens, last_tokens)]
+    return [start for start, _ in spans], [end for _, end in spans], token_counts, token_starts, [end for _, end in token_spans]
+
+def gaps(positions):
+    return [position - prev for prev, position in zip([0] + positions, positions)]
+
+def build_sentence_record(text):
+    sentences = split_sentences(text)
+    if sentences is None:
+        return b''
+
+    starts, ends, token_counts, token_starts, token_ends = sentences
+    values = (
+        gaps(starts) + list(map(int.__sub__, ends, starts)) + token_counts +
+        gaps(token_starts) + list(map(int.__sub__, token_ends, token_starts))
+    )
+    largest = max(values, default=0)
+    size = 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+    return RECORD_HEADER.pack(size, len(starts), len(token_starts)) + array(TYPECODES[size], values).tobytes()
+
+def parse_sentence_record(record):
+    # the split_sentences() of the body, or None for an empty record
+    if not record:
+        return None
+    size, num_sentences, num_tokens = RECORD_HEADER.unpack_from(record)
+    values = array(TYPECODES[size])
+    values.frombytes(bytes(record[RECORD_HEADER.size:]))
+
+    n, m = num_sentences, num_tokens
+    starts = list(accumulate(values[:n]))
+    ends = list(map(add, starts, values[n:2 * n]))
+    token_starts = list(accumulate(values[3 * n:3 * n + m]))
+    token_ends = list(map(add, token_starts, values[3 * n + m:]))
+    return starts, ends, values[2 * n:3 * n].tolist(), token_starts, token_ends
+
+def position_score(i):
+    return 2 if i == 0 else 1 if i == 1 else 0
+
+def sentence_score(i, tokens, query_terms):
+    # None for sentences too short to be shown
+    if len(tokens) < MIN_SENTENCE_TOKENS:
+        return None
+    hits = 0
+    run = 0
+    longest_run = 0
+    for token in tokens:
+        if token in query_terms:
+            hits += 1
+            run += 1
+            if run > longest_run:
+                longest_run = run
+        else:
+            run = 0
+    distinct = len(query_terms.intersection(tokens))
+    return position_score(i) + 2 * hits + 4 * distinct + 3 * longest_run
+
+def query_term_hits(lowered, query_terms, sentences):
+    # sentence -> token numbers of the tokens that are query terms. The query terms are searched
+    # for in the lowercased text, longest first, and a match only counts if it is a whole token.
+    _, _, token_counts, token_starts, token_ends = sentences
+    first_tokens = list(accumulate(token_counts, initial=0))
+    pattern = re.compile('|'.join(sorted(map(re.escape, query_terms), key=len, reverse=True)))
+
+    hits = {}
+    for match in pattern.finditer(lowered):
+        start, end = match.span()
+        token = bisect_left(token_starts, start)
+        if token < len(token_starts) and token_starts[token] == start and token_ends[token] == end:
+            hits.setdefault(bisect_right(first_tokens, token) - 1, []).append(token)
+    return hits
+
+def hits_score(i, tokens, lowered, token_starts, token_ends):
+    # score of sentence i from the token numbers of its query terms
+    longest_run = 0
+    run = 0
+    prev = -1
+    for token in tokens:
+        run = run + 1 if token == prev + 1 else 1
+        longest_run = max(longest_run, run)
+        prev = token
+    distinct = len({lowered[token_starts[token]:token_ends[token]] for token in tokens})
+    return position_score(i) + 2 * len(tokens) + 4 * distinct + 3 * longest_run
+
+def unbalanced_quotes(sentence):
+    # quote characters dropped from a snippet sentence, so it does not open a quote it never closes
+    return [quote for quote in ('"', "'") if sentence.count(quote) % 2 != 0]
+
+def make_snippet(text, query_terms, sentences=None):
+    """
+    (snippet, matches): the best sentences of text joined by a space, and the (start, end) of
+    every query term in the snippet, for highlighting. sentences is the split_sentences() of text,
+    e.g. from the sentence store; it is worked out here when not given.
+
+    Only the sentences with a query term, and the first two, are scored one by one; every other
+    sentence scores 0 and is only looked at when fewer than two sentences score more.
+    """
+    if sentences is None:
+        sentences = split_sentences(text)
+    query_terms = set(query_terms)
+
+    # (-score, sentence, sentence number, (start, end) of its query terms)
+    candidates = []
+    if sentences is None:
+        # tokenized a sentence at a time, without highlighting
+        for i, (start, end) in enumerate(sentence_spans(text)):
+            score = sentence_score(i, Tokenize(text[start:end]), query_terms)
+            if score is not None:
+                candidates.append((-score, text[start:end], i, []))
+    else:
+        starts, ends, token_counts, token_starts, token_ends = sentences
+        lowered = text.lower()
+        hits = query_term_hits(lowered, query_terms, sentences) if query_terms else {}
+        for i, tokens in hits.items():
+            if token_counts[i] >= MIN_SENTENCE_TOKENS:
+                score = hits_score(i, tokens, lowered, token_starts, token_ends)
+                spans = [(token_starts[token] - starts[i], token_ends[token] - starts[i]) for token in tokens]
+                candidates.append((-score, text[starts[i]:ends[i]], i, spans))
+
+        for i in range(min(2, len(starts))):
+            if i not in hits and token_counts[i] >= MIN_SENTENCE_TOKENS:
+                candidates.append((-position_score(i), text[starts[i]:ends[i]], i, []))
+
+        if len(candidates) < SNIPPET_SENTENCES:
+            rest = [
+                (0, text[start:end], i, [])
+                for i, (start, end, count) in enumerate(zip(starts, ends, token_counts))
+                if i > 1 and i not in hits and count >= MIN_SENTENCE_TOKENS
+            ]
+            candidates.extend(heapq.nsmallest(SNIPPET_SENTENCES - len(candidates), rest, key=lambda candidate: candidate[:2]))
+
+    if not candidates:
+        return " ", []
+
+    best = heapq.nsmallest(SNIPPET_SENTENCES, candidates, key=lambda candidate: candidate[:2])
+    summary = []
+    matches = []
+    offset = 0
+    for _, sentence, _, spans in best:
+        # a sentence shown on its own keeps its quotes
+        quotes = unbalanced_quotes(sentence) if len(best) > 1 else []
+        removed = [i for i, char in enumerate(sentence) if char in quotes] if quotes else []
+        for start, end in spans:
+            # quotes are never inside a token
+            shift = bisect_left(removed, start)
+            matches.append((offset + start - shift, offset + end - shift))
+        for quote in quotes:
+            sentence = sentence.replace(quote, '')
+        summary.append(sentence)
+        offset += len(sentence) + 1
+    return ' '.join(summary), matches
@@ -0,0 +1,81 @@
+"""
+Memoized stemming.
+
+The number of distinct surface forms in the collection is tiny next to the number of tokens, so
+every form is stemmed once and looked up afterwards. The cache is saved as metadata/stem-cache.json
+next to the lexicon, so a rebuild or an appended archive starts warm.
+
+Worker processes each get a copy of the cache when the pool starts. drain() hands the forms a
+worker stemmed since the last call (plus its hit and miss counts) back to the parent, which
+merges them into the cache it saves.
+"""
+from pathlib import Path
+import json
+import os
+
+STEM_CACHE_FILE = 'stem-cache.json'
+
+class StemCache:
+    def __init__(self, stem, stems=None):
+        self.stem_function = stem
+        self.stems = {} if stems is None else dict(stems)
+        self.added = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path, stem):
+        # path is a stem-cache.json file; a missing file gives an empty cache
+        path = Path(path)
+        if not path.is_file():
+            return cls(stem)
+        with path.open('r', encoding='utf-8') as f:
+            return cls(stem, json.load(f))
+
+    def save(self, path):
+        path = Path(path)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump(self.stems, f)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.stems)
+
+    def stem(self, token):
+        stemmed = self.stems.get(token)
+        if stemmed is not None:
+            self.hits += 1
+            return stemmed
+
+        self.misses += 1
+        stemmed = self.stem_function(token)
+        self.stems[token] = stemmed
+        self.added[token] = stemmed
+        return stemmed
+
+    def stem_tokens(self, tokens):
+        stems = self.stems
+        stemmed_tokens = []
+        for token in tokens:
+            stemmed = stems.get(token)
+            if stemmed is None:
+                stemmed = self.stem(token)
+            else:
+                self.hits += 1
+            stemmed_tokens.append(stemmed)
+        return stemmed_tokens
+
+    def drain(self):
+        # (new forms, hits, misses) since the last drain
+        drained = (self.added, self.hits, self.misses)
+        self.added = {}
+        self.hits = 0
+        self.misses = 0
+        return drained
+
+    def update(self, stems):
+        self.stems.update(stems)
+
+def hit_rate(hits, misses):
+    return hits / (hits + misses) if hits + misses else 0.0
@@ -0,0 +1,96 @@
+"""
+NumPy backend for the BM25 scorer in common.Scoring.
+
+Each query term's postings become NumPy arrays: zero-copy views of the typed arrays the in-memory
+index hands out, or a vectorized decode of the variable-byte postings for the memory-mapped one.
+The contributions tf / (norm + tf) * idf of a whole postings list are computed at once and
+scattered into a score per internal id, and the top k are taken with argpartition. Every
+contribution goes through the same floating point operations in the same order as the
+pure-Python loop, so the scores are the same.
+
+NumPy is optional. Without it bm25_backend('numpy') hands out the pure-Python scorer.
+"""
+from common.CollectionStats import bm25_idf
+from common.PostingsFile import PostingsReader
+from common.Scoring import bm25_top_k
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+HAVE_NUMPY = np is not None
+
+BACKENDS = ('python', 'numpy')
+
+def decode_postings_numpy(data):
+    # variable-byte [doc gap, tf, ...] bytes -> (doc ids, tfs) without a Python loop per byte
+    values = np.frombuffer(data, dtype=np.uint8)
+    last = values < 0x80
+    ends = np.flatnonzero(last)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # position of every byte inside its integer, 7 bits per byte
+    positions = np.arange(len(values)) - np.repeat(starts, ends - starts + 1)
+    shifted = (values & 0x7F).astype(np.uint64) << (7 * positions).astype(np.uint64)
+    integers = np.add.reduceat(shifted, starts)
+    return np.cumsum(integers[0::2]), integers[1::2]
+
+def term_arrays(inverted_index, term_id):
+    # (doc ids, tfs) of a term as NumPy arrays, or None
+    if isinstance(inverted_index, PostingsReader):
+        data = inverted_index.get_bytes(term_id)
+        return None if data is None else decode_postings_numpy(data)
+
+    posting = inverted_index.postings(term_id)
+    if not posting:
+        return None
+    doc_ids, tfs = posting
+    return np.frombuffer(doc_ids, dtype=np.uint32), np.frombuffer(tfs, dtype=np.uint32)
+
+def numpy_bm25_scores(query_terms, lexicon, inverted_index, norms, num_docs):
+    # BM25 score of every internal id, 0 for the documents no query term touched
+    norms = np.frombuffer(norms, dtype=np.float64)
+    scores = np.zeros(len(norms))
+    for term in set(query_terms):  # same order as bm25_scores
+        entry = lexicon.lookup(term)
+        if entry is None:
+            continue
+        term_id, idf = entry
+        posting = term_arrays(inverted_index, term_id)
+        if posting is None:
+            continue
+        doc_ids, tfs = posting
+        if idf is None:
+            idf = bm25_idf(num_docs, len(doc_ids))
+
+        # doc ids are unique within a postings list, so a fancy-indexed add is a scatter-add
+        tfs = tfs.astype(np.float64)
+        scores[doc_ids] += tfs / (norms[doc_ids] + tfs) * idf
+    return scores
+
+def numpy_top_k(scores, k):
+    # same selection and order as common.Scoring.top_k: positive scores, highest first, ties by id
+    if k <= 0:
+        return []
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        candidate_scores = scores[candidates]
+        threshold = candidate_scores[np.argpartition(-candidate_scores, k - 1)[k - 1]]
+        candidates = candidates[candidate_scores >= threshold]
+    order = np.lexsort((candidates, -scores[candidates]))[:k]
+    return [(int(doc_id), float(scores[doc_id])) for doc_id in candidates[order]]
+
+def numpy_bm25_top_k(query_terms, lexicon, inverted_index, norms, num_docs, k):
+    return numpy_top_k(numpy_bm25_scores(query_terms, lexicon, inverted_index, norms, num_docs), k)
+
+def bm25_backend(name=None):
+    # the top k scorer of a backend, None picks NumPy when it is installed
+    if name is None:
+        name = 'numpy' if HAVE_NUMPY else 'python'
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown scoring backend {name}, expected one of {", ".join(BACKENDS)}')
+    if name == 'numpy' and HAVE_NUMPY:
+        return numpy_bm25_top_k
+    return bm25_top_k
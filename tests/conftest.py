@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the tools import each other as top-level modules from src/, e.g. `from common.SimpleTokenizer import Tokenize`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
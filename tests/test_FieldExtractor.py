@@ -0,0 +1,60 @@
+"""
+The single-pass FieldExtractor against the per-field regex extraction IndexEngine used before it,
+on a small latimes sample: documents without a HEADLINE, GRAPHIC or TEXT, paragraphs inside
+tables, several paragraphs per field and entities.
+"""
+import gzip
+import re
+from pathlib import Path
+import pytest
+from common.DocumentFramer import frame_documents
+from common.FieldExtractor import extract_fields, FIELDS
+from common.SimpleTokenizer import Tokenize
+
+SAMPLE = Path(__file__).parent / 'fixtures' / 'latimes-sample.txt'
+
+def regex_field(full_text, field):
+    # processHeadline / process_graphic / process_text of the old IndexEngine, None for 'NULL'
+    match = re.findall(f'<{field}>.*?<\\/{field}>', full_text)
+    if not match:
+        return None
+    return ' '.join(word for word in match[0].split(' ') if word not in ['<P>', '</P>', f'<{field}>', f'</{field}>'])
+
+def regex_fields(document):
+    # the old reader stripped every line and joined them with spaces before extracting
+    full_text = ' '.join(line.strip() for line in document.split('\n'))
+    return tuple(regex_field(full_text, field) for field in FIELDS)
+
+def field_tokens(fields):
+    return [token for field in fields if field is not None for token in Tokenize(field)]
+
+@pytest.fixture(scope='module')
+def documents(tmp_path_factory):
+    # framed out of a gzipped archive, like IndexEngine reads them
+    gz_path = tmp_path_factory.mktemp('latimes') / 'latimes-sample.gz'
+    with gzip.open(gz_path, 'wb') as f:
+        f.write(SAMPLE.read_bytes())
+    return [(docno, document.decode('utf-8')) for docno, document in frame_documents(gz_path)]
+
+def test_sample_covers_the_edge_cases(documents):
+    fields = [regex_fields(document) for _, document in documents]
+    assert len(documents) == 7
+    assert any(headline is None for headline, _, _ in fields)
+    assert any(graphic is None for _, graphic, _ in fields)
+    assert any(text is None for _, _, text in fields)
+    assert any('<TABLE>' in text for _, _, text in fields if text)
+    assert any('&amp;' in headline for headline, _, _ in fields if headline)
+
+def test_fields_match_regex_extraction(documents):
+    for docno, document in documents:
+        assert extract_fields(document) == regex_fields(document), docno
+
+def test_tokens_match_regex_extraction(documents):
+    for docno, document in documents:
+        assert field_tokens(extract_fields(document)) == field_tokens(regex_fields(document)), docno
+
+def test_paragraph_tags_are_dropped(documents):
+    for docno, document in documents:
+        for field in extract_fields(document):
+            if field is not None:
+                assert '<P>' not in field.split() and '</P>' not in field.split(), docno
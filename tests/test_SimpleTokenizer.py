@@ -0,0 +1,67 @@
+"""
+Property checks of the fast tokenizer against the original character loop, ReferenceTokenize, on
+random Unicode text. Seeded, so a failure reproduces.
+"""
+import random
+import sys
+import unicodedata
+import pytest
+from common.SimpleTokenizer import ReferenceTokenize, Tokenize, TokenizeMany, TokenSpans
+
+NUM_CASES = 20000
+
+def code_points(*categories):
+    # every code point whose general category starts with one of categories
+    return [
+        chr(c) for c in range(sys.maxunicode + 1)
+        if not 0xD800 <= c <= 0xDFFF and unicodedata.category(chr(c)).startswith(categories)
+    ]
+
+ALPHABETS = {
+    'letters': code_points('L'),
+    'digits': code_points('N'),
+    'combining marks': code_points('M'),
+    'punctuation': code_points('P', 'S'),
+    'whitespace': [c for c in map(chr, range(sys.maxunicode + 1)) if c.isspace()],
+    'underscore': ['_'],
+    # ASCII, and characters whose lowercase or digit/letter status is the odd one out
+    'special': list('abcXYZ019 .-,\n\t') + ['½', '²', 'İ', 'ß', 'Σ', 'ς', 'ǅ', 'ﬁ', 'Ⅻ', '٣', '́', '​'],
+}
+
+def random_text(rnd):
+    return ''.join(
+        rnd.choice(ALPHABETS[rnd.choice(list(ALPHABETS))])
+        for _ in range(rnd.randint(0, 40))
+    )
+
+@pytest.fixture(scope='module')
+def texts():
+    rnd = random.Random(12)
+    return [random_text(rnd) for _ in range(NUM_CASES)]
+
+def test_tokenize_matches_reference(texts):
+    for text in texts:
+        assert Tokenize(text) == ReferenceTokenize(text), text
+
+def test_tokenize_many_matches_reference(texts):
+    assert TokenizeMany(texts) == [ReferenceTokenize(text) for text in texts]
+
+def test_token_spans_match_reference(texts):
+    # spans only hold where lowercasing keeps the length, the tokens are slices of the lowercase
+    for text in texts:
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            continue
+        assert [lowered[start:end] for start, end in TokenSpans(text)] == ReferenceTokenize(text), text
+
+@pytest.mark.parametrize('name', sorted(ALPHABETS))
+def test_every_code_point(name):
+    # each code point of an alphabet between word characters and on its own
+    alphabet = ALPHABETS[name]
+    for i in range(0, len(alphabet), 1000):
+        chunk = alphabet[i:i + 1000]
+        for text in ('a'.join(chunk), ' '.join(chunk), ''.join(chunk)):
+            assert Tokenize(text) == ReferenceTokenize(text)
+            lowered = text.lower()
+            if len(lowered) == len(text):
+                assert [lowered[start:end] for start, end in TokenSpans(text)] == ReferenceTokenize(text)